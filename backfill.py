@@ -0,0 +1,339 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from operator import itemgetter
+
+import orjson
+
+from block_record import WIRE_FORMAT, unpack_records
+from block_validator import BlockBatch, BlockCorruptedDataError, BlockInconsistentHashError, validate_batch
+from lease_coordinator import LeaseLost
+from provider_client import ProviderClient
+from sinks import ENCODERS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+def decode_block_range(body, start, end, parent_hash=None):
+    """Parse a JSON-RPC batch response for blocks start..end into packed wire records.
+
+    Module-level so it can run in a worker process: only the response body goes in and 85 bytes
+    per block come back. Returns None when the provider answered the batch with a single error
+    object (no batch support).
+    """
+    responses = orjson.loads(body)
+    if not isinstance(responses, list):
+        return None
+    responses.sort(key=itemgetter("id"))
+    records = [ProviderClient._parse_block_record(start + i, response) for i, response in enumerate(responses)]
+    return pack_chain(records, start, end, parent_hash)
+
+
+def pack_chain(records, start, end, parent_hash=None):
+    """Pack BlockRecords for start..end, checking they are exactly that range and form a chain from `parent_hash`."""
+    if len(records) != end - start + 1:
+        raise BlockCorruptedDataError(f"Expected {end - start + 1} blocks for {start}-{end}, got {len(records)}")
+    failed = validate_batch(BlockBatch.from_records(records), parent_hash, first_number=start)
+    if failed is not None:
+        raise BlockInconsistentHashError(f"Block {start + failed} does not extend the chain before it")
+    return b"".join([record.pack() for record in records])
+
+
+class Manifest:
+    """Which chunks of a backfill are done, kept as JSON next to the chunk files.
+
+    Chunk files are renamed into place before their chunk is marked done, and the manifest itself
+    is written to a temporary file and renamed, so a run killed at any point resumes with every
+    chunk it lists intact.
+    """
+
+    def __init__(self, path, start, end, chunk_size):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                saved = json.load(f)
+            if (saved["from"], saved["to"], saved["chunk_size"]) != (start, end, chunk_size):
+                raise ValueError(
+                    f"{path} is for blocks {saved['from']}-{saved['to']} in chunks of {saved['chunk_size']}, "
+                    f"not {start}-{end} in chunks of {chunk_size}"
+                )
+            self.done = set(saved["done"])
+
+    def chunks(self):
+        for chunk_start in range(self.start, self.end + 1, self.chunk_size):
+            yield chunk_start, min(chunk_start + self.chunk_size - 1, self.end)
+
+    def mark_done(self, chunk_start):
+        self.done.add(chunk_start)
+        self.save()
+
+    def mark_pending(self, chunk_start):
+        self.done.discard(chunk_start)
+        self.save()
+
+    def save(self):
+        # per process, as instances splitting a backfill share the directory
+        partial = f"{self.path}.{os.getpid()}.tmp"
+        with open(partial, "w") as f:
+            json.dump({"from": self.start, "to": self.end, "chunk_size": self.chunk_size, "done": sorted(self.done)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, self.path)
+
+
+class BackfillProgress:
+    """Completed blocks, blocks/sec and ETA of a backfill; the rate counts only this run's blocks."""
+
+    def __init__(self, total_blocks, done_blocks=0, clock=time.monotonic):
+        self.total_blocks = total_blocks
+        self.done_blocks = done_blocks
+        self._clock = clock
+        self._started = clock()
+        self._fetched = 0
+
+    def add(self, blocks):
+        self.done_blocks += blocks
+        self._fetched += blocks
+
+    @property
+    def rate(self):
+        elapsed = self._clock() - self._started
+        return self._fetched / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_s(self):
+        rate = self.rate
+        return (self.total_blocks - self.done_blocks) / rate if rate else None
+
+    def __str__(self):
+        eta_s = self.eta_s
+        eta = "unknown" if eta_s is None else f"{int(eta_s) // 60}m{int(eta_s) % 60:02d}s"
+        percent = self.done_blocks / self.total_blocks * 100 if self.total_blocks else 100.0
+        return f"{self.done_blocks}/{self.total_blocks} blocks ({percent:.1f}%), {self.rate:.0f} blocks/s, ETA {eta}"
+
+
+class Backfill:
+    """Fetch blocks start..end into one output file, in resumable chunks spread over all providers.
+
+    The range is cut into `chunk_size` chunks. `concurrency` chunks are fetched at once, each as
+    consecutive batches of `batch_size` blocks, and every batch goes to the next provider from
+    `ProviderManager.fetch_provider`, so the load follows each provider's rate budget and score;
+    a failed batch is reported to that provider's breaker and retried on the next pick. Each
+    finished chunk is written to `directory/chunks` as packed wire records and marked done in
+    the manifest, so a killed run refetches only the chunks it hadn't finished.
+
+    Batch responses are decoded, validated (contiguous numbers, parent-hash chain) and packed by
+    `decode_block_range`, in `executor` when given (a ProcessPoolExecutor spreads JSON decoding
+    over cores) or else on the event loop. `stitch` joins the chunks into the output file in
+    `output_format` and checks the parent-hash linkage at every chunk boundary; chunks on either
+    side of a broken boundary are fetched again.
+
+    With a `coordinator` (a LeaseCoordinator), several instances backfilling the same range into
+    the same directory split the chunks: each is fetched under a lease of its own, and a chunk
+    another instance holds counts as done once its file appears, or is claimed once the lease
+    expires because that instance died. Every instance then stitches the complete set of chunks
+    into the same output file.
+    """
+
+    def __init__(self, provider_manager, start, end, directory, chunk_size=10_000, batch_size=None, concurrency=8,
+                 executor=None, output_format="ndjson", max_attempts=5, max_stitch_rounds=3,
+                 progress_interval_s=10.0, clock=time.monotonic, coordinator=None):
+        if start > end:
+            raise ValueError(f"Empty block range {start}-{end}")
+        if output_format not in ENCODERS:
+            raise ValueError(f"Unknown output format {output_format}")
+        self.provider_manager = provider_manager
+        self.start = start
+        self.end = end
+        self.directory = directory
+        self.chunk_size = chunk_size
+        # one batch must fit every provider it may be sent to
+        largest = min(provider.max_batch_size for provider in provider_manager.providers)
+        self.batch_size = min(batch_size, largest) if batch_size else largest
+        self.concurrency = concurrency
+        self.executor = executor
+        self.output_format = output_format
+        self.max_attempts = max_attempts
+        self.max_stitch_rounds = max_stitch_rounds
+        self.progress_interval_s = progress_interval_s
+        self._clock = clock
+        self.coordinator = coordinator
+        self.chunk_directory = os.path.join(directory, "chunks")
+        os.makedirs(self.chunk_directory, exist_ok=True)
+        self.manifest = Manifest(os.path.join(directory, MANIFEST_NAME), start, end, chunk_size)
+        extension = "bin" if output_format == "binary" else output_format
+        self.output_path = os.path.join(directory, f"blocks_{start}_{end}.{extension}")
+        self.progress = None
+
+    async def run(self):
+        """Fetch every pending chunk and stitch; returns the output file's path."""
+        for _ in range(self.max_stitch_rounds):
+            await self.fetch_pending()
+            broken = self.stitch()
+            if not broken:
+                return self.output_path
+            logger.warning(f"Chunks {broken} don't link up with their neighbours, fetching them again")
+            for chunk_start in broken:
+                with contextlib.suppress(FileNotFoundError):  # another instance may have removed it first
+                    os.remove(self._chunk_path(chunk_start))
+                self.manifest.mark_pending(chunk_start)
+        raise BlockInconsistentHashError(f"Chunk boundaries still broken after {self.max_stitch_rounds} rounds")
+
+    def pending_chunks(self):
+        return [
+            (chunk_start, chunk_end) for chunk_start, chunk_end in self.manifest.chunks()
+            if chunk_start not in self.manifest.done or not os.path.exists(self._chunk_path(chunk_start))
+        ]
+
+    async def fetch_pending(self):
+        pending = deque(self.pending_chunks())
+        total = self.end - self.start + 1
+        self.progress = BackfillProgress(
+            total, total - sum(chunk_end - chunk_start + 1 for chunk_start, chunk_end in pending), self._clock
+        )
+        if not pending:
+            return
+
+        held_elsewhere = []
+
+        async def worker():
+            while pending or held_elsewhere:
+                if not pending:
+                    # wait for the other instances' chunks to appear or their leases to expire
+                    await asyncio.sleep(self.coordinator.renew_interval_s)
+                    pending.extend(held_elsewhere)
+                    held_elsewhere.clear()
+                    continue
+                chunk = pending.popleft()
+                if self.coordinator is None:
+                    await self._fetch_chunk(*chunk)
+                elif not await self._fetch_claimed_chunk(*chunk):
+                    held_elsewhere.append(chunk)
+
+        reporter = asyncio.create_task(self._report_progress())
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(pending)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+        logger.info(f"Backfill fetched: {self.progress}")
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval_s)
+            logger.info(f"Backfill {self.progress}")
+
+    async def _fetch_claimed_chunk(self, chunk_start, chunk_end):
+        """Fetch a chunk under its lease; False while another instance holds it."""
+        name = f"backfill:{os.path.abspath(self.directory)}:{chunk_start}"
+        if not os.path.exists(self._chunk_path(chunk_start)):
+            if await asyncio.to_thread(self.coordinator.acquire, name) is None:
+                return False
+            # the previous holder may have finished it just before releasing
+            if not os.path.exists(self._chunk_path(chunk_start)):
+                try:
+                    await self.coordinator.hold(name, self._fetch_chunk(chunk_start, chunk_end))
+                except LeaseLost as e:
+                    logger.warning(f"{e}, leaving chunk {chunk_start} to its new holder")
+                    return False
+                return True
+            await asyncio.to_thread(self.coordinator.release, name)
+        self.manifest.mark_done(chunk_start)
+        self.progress.done_blocks += chunk_end - chunk_start + 1
+        return True
+
+    async def _fetch_chunk(self, chunk_start, chunk_end):
+        parts = []
+        parent_hash = None
+        for batch_start in range(chunk_start, chunk_end + 1, self.batch_size):
+            batch_end = min(batch_start + self.batch_size - 1, chunk_end)
+            data = await self._fetch_batch(batch_start, batch_end, parent_hash)
+            parts.append(data)
+            parent_hash = WIRE_FORMAT.unpack_from(data, len(data) - WIRE_FORMAT.size)[2]
+            self.progress.add(batch_end - batch_start + 1)
+        path = self._chunk_path(chunk_start)
+        with open(path + ".part", "wb") as f:
+            f.write(b"".join(parts))
+        os.replace(path + ".part", path)
+        self.manifest.mark_done(chunk_start)
+
+    async def _fetch_batch(self, start, end, parent_hash):
+        manager = self.provider_manager
+        for attempt in range(1, self.max_attempts + 1):
+            if all(breaker.is_open for breaker in manager.breakers):
+                await manager.wait_for_ready_provider()
+            provider = manager.fetch_provider()
+            try:
+                data = await self._fetch_packed(provider, start, end, parent_hash)
+            except Exception as e:
+                await manager.report_failure(provider)
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f"Fetching blocks {start}-{end} from {provider.name} failed ({e!r}), retrying")
+                continue
+            await manager.report_success(provider)
+            return data
+
+    async def _fetch_packed(self, provider, start, end, parent_hash):
+        if provider.batch_supported and end > start:
+            body = await provider.get_block_range_body(start, end)
+            if self.executor is None:
+                data = decode_block_range(body, start, end, parent_hash)
+            else:
+                data = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, decode_block_range, body, start, end, parent_hash
+                )
+            if data is not None:
+                return data
+            logger.warning(f"Provider {provider.name} rejected batch request, falling back to single calls")
+            provider.batch_supported = False
+        return pack_chain(await provider.get_block_records(start, end), start, end, parent_hash)
+
+    def stitch(self):
+        """Join the chunk files into the output file, checking each chunk against the one before it.
+
+        Returns the starts of the chunks on either side of every broken boundary, or of any chunk
+        whose file doesn't hold exactly its range; the output file is only replaced when that's empty.
+        """
+        encode = ENCODERS[self.output_format]
+        broken = set()
+        previous = None  # (start, last hash) of the previous chunk
+        # instances splitting a backfill each stitch the same file; theirs must not collide
+        partial = self.output_path + (".part" if self.coordinator is None else f".{os.getpid()}.part")
+        with open(partial, "wb") as out:
+            for chunk_start, chunk_end in self.manifest.chunks():
+                with open(self._chunk_path(chunk_start), "rb") as f:
+                    data = f.read()
+                if len(data) != (chunk_end - chunk_start + 1) * WIRE_FORMAT.size \
+                        or WIRE_FORMAT.unpack_from(data, 0)[1] != chunk_start:
+                    broken.add(chunk_start)
+                    previous = None
+                    continue
+                parent_hash = WIRE_FORMAT.unpack_from(data, 0)[3]
+                if previous is not None and parent_hash != previous[1]:
+                    broken.update((previous[0], chunk_start))
+                previous = chunk_start, WIRE_FORMAT.unpack_from(data, len(data) - WIRE_FORMAT.size)[2]
+                if broken:
+                    continue
+                # chunk files are already wire records: binary output is a plain copy
+                out.write(data if self.output_format == "binary" else b"".join(map(encode, unpack_records(data))))
+        if broken:
+            os.remove(partial)
+            return sorted(broken)
+        os.replace(partial, self.output_path)
+        return []
+
+    def _chunk_path(self, chunk_start):
+        return os.path.join(self.chunk_directory, f"{chunk_start}.bin")
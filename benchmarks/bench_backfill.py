@@ -0,0 +1,94 @@
+"""Backfill blocks/sec with JSON decoding on the event loop vs in a process pool.
+
+First prints what one block costs the event loop to decode and what it costs to hand its
+response body to a worker instead. Then backfills `--blocks` blocks from `--providers` fake
+providers that answer each JSON-RPC batch with a raw body (150 transaction hashes per block)
+after an injected delay, and stitches the chunks into NDJSON. Every run starts from an empty
+work directory.
+
+    python -m benchmarks.bench_backfill --blocks 50000 --workers 0 1 2 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from backfill import Backfill, decode_block_range
+from benchmarks.fake_provider import FakeProvider
+from provider_manager import ProviderManager
+
+
+async def run(args, workers):
+    providers = [
+        FakeProvider(name=f"Fake{i}", latency_s=args.latency, jitter_s=args.latency / 2, max_rate_per_sec=args.rate,
+                     seed=i)
+        for i in range(args.providers)
+    ]
+    manager = ProviderManager(providers, lag_thr=30, error_thr=0.5, window_s=10)
+    executor = ProcessPoolExecutor(workers) if workers else None
+    try:
+        if executor is not None:
+            # start the workers outside the timed region
+            await asyncio.gather(*(
+                asyncio.get_running_loop().run_in_executor(executor, time.sleep, 0.01) for _ in range(workers)
+            ))
+        with tempfile.TemporaryDirectory() as directory:
+            backfill = Backfill(
+                manager, 1_000_000, 1_000_000 + args.blocks - 1, directory, chunk_size=args.chunk_size,
+                batch_size=args.batch_size, concurrency=args.concurrency, executor=executor,
+            )
+            started = time.perf_counter()
+            await backfill.fetch_pending()
+            fetched = time.perf_counter()
+            assert not backfill.stitch()
+            stitched = time.perf_counter()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return args.blocks / (fetched - started), stitched - fetched
+
+
+async def per_block_costs(batch_size, repeats=200):
+    body = await FakeProvider(latency_s=0).get_block_range_body(1_000_000, 1_000_000 + batch_size - 1)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        decode_block_range(body, 1_000_000, 1_000_000 + batch_size - 1)
+    decode_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(repeats):
+        pickle.loads(pickle.dumps((body, 1_000_000, 1_000_000 + batch_size - 1, None)))
+    handoff_s = time.perf_counter() - started
+    return decode_s / repeats / batch_size, handoff_s / repeats / batch_size
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=50_000)
+    parser.add_argument("--providers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02, help="injected provider latency in seconds")
+    parser.add_argument("--rate", type=int, default=200, help="requests/s per provider")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    args = parser.parse_args()
+    logging.getLogger("backfill").setLevel(logging.WARNING)
+
+    decode_s, handoff_s = await per_block_costs(args.batch_size)
+    print(f"per block on the event loop: decode {decode_s * 1e6:.1f} us, pickle to a worker {handoff_s * 1e6:.1f} us"
+          f" ({os.cpu_count()} CPUs)")
+
+    print(f"{'workers':>7}  {'blocks/s':>10}  {'speedup':>7}  {'stitch s':>8}")
+    baseline = None
+    for workers in args.workers:
+        rate, stitch_s = await run(args, workers)
+        baseline = baseline or rate
+        print(f"{workers:>7}  {rate:>10.0f}  {rate / baseline:>6.1f}x  {stitch_s:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Per-block cost of validate_block_integrity in a loop versus validate_batch over a BlockBatch.
+
+Times the scalar check the streamer runs per emitted block, building the columnar batch from
+the same blocks as hex dicts and as raw-hash BlockRecords, and validate_batch with each
+available backend (NumPy when installed, and the bytes/array fallback).
+
+    python -m benchmarks.bench_batch_validate --sizes 1000 100000
+"""
+import argparse
+import time
+
+import block_validator
+from block_record import BlockRecord
+from block_validator import BlockBatch, validate_batch, validate_block_integrity
+
+
+def make_chain(count, start=20_000_000):
+    def block_hash(n):
+        return f"0x{n:064x}"
+    return [
+        {"number": n, "hash": block_hash(n), "parentHash": block_hash(n - 1), "timestamp": 1_700_000_000 + n}
+        for n in range(start, start + count)
+    ]
+
+
+def rpc_form(block):
+    return {**block, "number": hex(block["number"]), "timestamp": hex(block["timestamp"]), "transactions": []}
+
+
+def best_of(repeats, fn):
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def scalar(blocks):
+    parent_hash = blocks[0]["parentHash"]
+    for block in blocks:
+        validate_block_integrity(block, parent_hash)
+        parent_hash = block["hash"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100_000])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    numpy = block_validator.np
+    backends = [("numpy", numpy)] if numpy is not None else []
+    backends.append(("bytes", None))
+    print(f"{'blocks':>8}  {'path':<22} {'ns/block':>9} {'vs scalar':>10}")
+    for size in args.sizes:
+        blocks = make_chain(size)
+        batch = BlockBatch.from_blocks(blocks)
+        parent_hash, first_number = blocks[0]["parentHash"], blocks[0]["number"]
+        baseline = best_of(args.repeats, lambda: scalar(blocks))
+        records = [BlockRecord.from_rpc(rpc_form(block)) for block in blocks]
+        rows = [
+            ("scalar loop", baseline),
+            ("build from hex dicts", best_of(args.repeats, lambda: BlockBatch.from_blocks(blocks))),
+            ("build from records", best_of(args.repeats, lambda: BlockBatch.from_records(records))),
+        ]
+        for name, module in backends:
+            block_validator.np = module
+            assert validate_batch(batch, parent_hash, first_number) is None
+            rows.append((f"validate_batch ({name})",
+                         best_of(args.repeats, lambda: validate_batch(batch, parent_hash, first_number))))
+        block_validator.np = numpy
+        for name, elapsed in rows:
+            print(f"{size:>8}  {name:<22} {elapsed / size * 1e9:>9.1f} {baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Per-block CPU time and memory of ProviderClient.get_block versus the lean get_block_record path.
+
+The HTTP transport is replaced by an in-process provider that decodes a canned mainnet-sized
+JSON body, so the numbers isolate JSON decoding, web3 middleware/formatting and record building.
+
+    python -m benchmarks.bench_block_decode --blocks 2000 --txs 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from web3 import AsyncWeb3
+from web3.providers.async_base import AsyncJSONBaseProvider
+
+from config import ProviderConfig
+from provider_client import ProviderClient
+
+
+def mainnet_like_block(block_number, tx_count):
+    word = "0x" + "ab" * 32
+    return {
+        "baseFeePerGas": "0x3b9aca00", "difficulty": "0x0", "extraData": "0x6265617665726275696c642e6f7267",
+        "gasLimit": "0x1c9c380", "gasUsed": "0x1312d00", "hash": f"0x{block_number:064x}",
+        "logsBloom": "0x" + "ff" * 256, "miner": "0x" + "95" * 20, "mixHash": word, "nonce": "0x0000000000000000",
+        "number": hex(block_number), "parentHash": f"0x{block_number - 1:064x}", "receiptsRoot": word,
+        "sha3Uncles": word, "size": "0x2a3b1", "stateRoot": word, "timestamp": hex(1_700_000_000 + block_number),
+        "totalDifficulty": "0xc70d815d562d3cfa955", "transactionsRoot": word, "uncles": [],
+        "withdrawals": [], "withdrawalsRoot": word, "blobGasUsed": "0x0", "excessBlobGas": "0x0",
+        "parentBeaconBlockRoot": word,
+        "transactions": [f"0x{i:064x}" for i in range(tx_count)],
+    }
+
+
+class InMemoryProvider(AsyncJSONBaseProvider):
+    def __init__(self, tx_count):
+        super().__init__()
+        self._bodies = {}
+        self._tx_count = tx_count
+
+    def body_for(self, block_number):
+        if block_number not in self._bodies:
+            self._bodies[block_number] = json.dumps(
+                {"jsonrpc": "2.0", "id": 1, "result": mainnet_like_block(block_number, self._tx_count)}
+            )
+        return self._bodies[block_number]
+
+    async def make_request(self, method, params):
+        return json.loads(self.body_for(int(params[0], 16)))
+
+    async def is_connected(self, show_traceback=False):
+        return True
+
+
+async def measure(fetch, blocks):
+    cpu_start = time.process_time()
+    for block_number in range(1, blocks + 1):
+        await fetch(block_number)
+    cpu = time.process_time() - cpu_start
+
+    # second pass under tracemalloc, keeping every result alive as the streamer's buffers would
+    results = []
+    tracemalloc.start()
+    for block_number in range(1, blocks + 1):
+        results.append(await fetch(block_number))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu / blocks, current / blocks, peak / 1024
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--txs", type=int, default=200, help="transaction hashes per block")
+    args = parser.parse_args()
+
+    provider = InMemoryProvider(args.txs)
+    client = ProviderClient(ProviderConfig(name="InMemory", url="http://127.0.0.1:0"))
+    client.w3 = AsyncWeb3(provider)
+    for block_number in range(1, args.blocks + 1):
+        provider.body_for(block_number)
+    print(f"raw JSON per block: {len(provider.body_for(1)) / 1024:.1f} KiB")
+
+    print(f"{'path':<18} {'cpu us/block':>12} {'retained B/block':>17} {'peak KiB':>9}")
+    for label, fetch in (("get_block", client.get_block), ("get_block_record", client.get_block_record)):
+        cpu, retained, peak = await measure(fetch, args.blocks)
+        print(f"{label:<18} {cpu * 1e6:>12.1f} {retained:>17.0f} {peak:>9.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""Memory per block and per-block emit cost: hex-string dicts vs raw-bytes BlockRecords.
+
+Replays the streamer's emit path on parsed eth_getBlockByNumber results: build the block,
+validate it against the previous hash, keep it in the recent-block cache and encode it for the
+sink. The dict path is the lean path as it was before BlockRecord held raw hashes (hex-string
+record, then a fresh dict per block); the record path is measured with both NDJSON and the
+fixed-width binary encoder.
+
+    python -m benchmarks.bench_block_records --blocks 100000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+import orjson
+
+from block_cache import RecentBlockCache
+from block_record import BlockRecord
+from block_validator import validate_block_integrity, validate_record
+from sinks import encode_binary, encode_ndjson
+
+
+def rpc_result(number):
+    return {
+        "number": hex(number), "hash": f"0x{number:064x}", "parentHash": f"0x{number - 1:064x}",
+        "timestamp": hex(1_700_000_000 + number * 12), "transactions": [],
+    }
+
+
+class HexBlockRecord:
+    """BlockRecord as it was: hex-string hashes, turned into a dict by _serialize_block."""
+
+    __slots__ = ("number", "hash", "parentHash", "timestamp", "tx_count")
+
+    def __init__(self, number, hash, parentHash, timestamp, tx_count):
+        self.number = number
+        self.hash = hash
+        self.parentHash = parentHash
+        self.timestamp = timestamp
+        self.tx_count = tx_count
+
+    @classmethod
+    def from_rpc(cls, result):
+        return cls(
+            int(result["number"], 16), result["hash"], result["parentHash"], int(result["timestamp"], 16),
+            len(result["transactions"]),
+        )
+
+    def to_dict(self):
+        return {
+            "number": self.number,
+            "hash": self.hash,
+            "parentHash": self.parentHash,
+            "timestamp": self.timestamp,
+            "tx_count": self.tx_count,
+        }
+
+
+def dict_block(result):
+    return HexBlockRecord.from_rpc(result).to_dict()
+
+
+def run_dicts(results, encode):
+    last_hash, cache, out = None, RecentBlockCache(256), 0
+    for result in results:
+        block = dict_block(result)
+        validate_block_integrity(block, last_hash)
+        last_hash = block["hash"]
+        cache.put(block["number"], last_hash, block)
+        out += len(encode(block))
+    return out
+
+
+def run_records(results, encode):
+    last_hash, cache, out = None, RecentBlockCache(256), 0
+    for result in results:
+        record = BlockRecord.from_rpc(result)
+        validate_record(record, last_hash)
+        last_hash = record.hash
+        cache.put(record.number, last_hash, record)
+        out += len(encode(record))
+    return out
+
+
+def retained_bytes(build, bodies):
+    """Memory still held per block once the response bodies it was parsed from are gone."""
+    gc.collect()
+    tracemalloc.start()
+    kept = [build(orjson.loads(body)) for body in bodies]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / len(bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    results = [rpc_result(n) for n in range(20_000_000, 20_000_000 + args.blocks)]
+    bodies = [orjson.dumps(result) for result in results]
+
+    print(f"{'retained per block':<26} {'bytes':>8}")
+    print(f"{'hex dict':<26} {retained_bytes(dict_block, bodies):>8.0f}")
+    print(f"{'BlockRecord':<26} {retained_bytes(BlockRecord.from_rpc, bodies):>8.0f}")
+    print()
+
+    paths = {
+        "hex dict -> NDJSON": (run_dicts, encode_ndjson),
+        "BlockRecord -> NDJSON": (run_records, encode_ndjson),
+        "BlockRecord -> binary": (run_records, encode_binary),
+    }
+    print(f"{'emit path':<26} {'ns/block':>8} {'blocks/s':>10} {'out bytes/block':>16}")
+    for name, (run, encode) in paths.items():
+        best = float("inf")
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            out = run(results, encode)
+            best = min(best, time.perf_counter() - started)
+        print(f"{name:<26} {best / args.blocks * 1e9:>8.0f} {args.blocks / best:>10.0f} {out / args.blocks:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Catch-up throughput of BlockStreamService.process_blocks as a function of the fetch window.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_catchup --blocks 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks.fake_provider import FakeProvider
+from block_streamer import BlockStreamService
+
+
+class _SingleProviderManager:
+    def __init__(self, provider):
+        self.active = provider
+
+
+async def run(window, batch_size, blocks, latency_s, jitter_s):
+    start_block = 1_000_000
+    # a generous rate budget so the window, not the rate limiter, is the limit being measured
+    provider = FakeProvider(head=start_block + blocks, latency_s=latency_s, jitter_s=jitter_s, max_rate_per_sec=1024)
+    service = BlockStreamService(
+        _SingleProviderManager(provider), start_block, max_catchup_window=window, catchup_batch_size=batch_size
+    )
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await service.process_blocks(start_block + blocks)
+        await service.output.stop()
+    elapsed = time.perf_counter() - started
+    assert service.last_processed_block == start_block + blocks
+    return blocks / elapsed, provider.calls
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="injected provider latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="uniform extra latency in seconds")
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10], help="blocks per JSON-RPC batch")
+    args = parser.parse_args()
+
+    print(f"{'batch':>5}  {'window':>6}  {'blocks/s':>10}  {'speedup':>7}  {'requests':>8}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        for window in args.windows:
+            rate, requests = await run(window, batch_size, args.blocks, args.latency, args.jitter)
+            baseline = baseline or rate
+            print(f"{batch_size:>5}  {window:>6}  {rate:>10.1f}  {rate / baseline:>6.1f}x  {requests:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,219 @@
+"""Active/standby takeover time and blocks re-emitted when the leader is killed mid-stream.
+
+Serves a SimulatedChain with a block every `--block-time` seconds from one SimulatedNode and
+starts `--instances` copies of main.py on it. They share a checkpoint and a lease database in a
+temporary directory, with lease coordination on, and each run writes its own output file. Every
+round lets the leader stream for `--lead-blocks` blocks, SIGKILLs it, and waits for a standby to
+take the lease and emit a block the leader hadn't; the killed instance then comes back as a
+standby.
+
+Per round:
+- takeover s: from the kill until another instance held the lease
+- 1st block s: how long after the chain produced it the first block the killed leader hadn't
+  emitted reached the new leader's output (a block time or more would mean a block was late
+  because of the failover)
+- re-emitted: blocks the new leader emitted that the killed one already had (the output since
+  its last committed checkpoint)
+Afterwards the outputs of all runs are checked together: blocks any standby emitted while a
+leader was alive, and any gap in the combined block numbers.
+
+    python -m benchmarks.bench_failover --rounds 5 --block-time 2
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import List, NamedTuple
+
+import aiohttp
+import orjson
+import yaml
+
+from benchmarks.chain_simulator import SimulatedChain, SimulatedNode
+from lease_coordinator import SQLiteLeaseCoordinator
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+LEASE_NAME = "stream:1"
+
+
+class FailoverResult(NamedTuple):
+    takeover_s: List[float]
+    first_block_delay_s: List[float]
+    reemitted: List[int]
+    standby_blocks: int  # blocks emitted by an instance while another one led
+    gaps: List[int]  # block numbers missing from the combined output
+    blocks: int  # distinct blocks emitted
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Instance:
+    """One main.py process under lease coordination; every start writes a new output file."""
+
+    def __init__(self, name, directory, url, block_time, ttl_s=None):
+        self.name = name
+        self.directory = directory
+        self.url = url
+        self.block_time = block_time
+        self.ttl_s = ttl_s
+        self.metrics_port = free_port()
+        self.outputs = []
+        self.process = None
+
+    def _write_config(self):
+        output = os.path.join(self.directory, f"{self.name}-{len(self.outputs)}.ndjson")
+        self.outputs.append(output)
+        lease = {"enabled": True, "path": os.path.join(self.directory, "lease.sqlite"), "holder": self.name}
+        if self.ttl_s is not None:
+            lease["ttl_s"] = self.ttl_s
+        config = {
+            "providers": [{"name": "Sim", "url": self.url, "max_rate_per_sec": 1000}],
+            "expected_block_time": self.block_time,
+            "start_confirmations": 0,
+            "push_heads": False,
+            "checkpoint_path": os.path.join(self.directory, "checkpoint.sqlite"),
+            "metrics_host": "127.0.0.1",
+            "metrics_port": self.metrics_port,
+            "output": {"type": "file", "path": output, "flush_interval_s": 0.05},
+            "lease": lease,
+        }
+        path = os.path.join(self.directory, f"{self.name}.yaml")
+        with open(path, "w") as f:
+            yaml.safe_dump(config, f)
+        return path
+
+    async def start(self):
+        config = self._write_config()
+        with open(os.path.join(self.directory, f"{self.name}.log"), "ab") as log:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, MAIN, "--config", config, stdout=asyncio.subprocess.DEVNULL, stderr=log
+            )
+
+    def kill(self):
+        self.process.kill()
+
+    async def stop(self):
+        if self.process.returncode is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        await self.process.wait()
+
+    async def role(self, session):
+        """"leader" or "standby" from the instance's /health, None while it isn't serving."""
+        try:
+            async with session.get(f"http://127.0.0.1:{self.metrics_port}/health") as response:
+                return orjson.loads(await response.read())["chains"]["1"]["role"]
+        except aiohttp.ClientError:
+            return None
+
+    def emitted(self):
+        """Size of the current run's output; grows as blocks are flushed."""
+        path = self.outputs[-1]
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def numbers(self, run=None):
+        runs = self.outputs if run is None else [self.outputs[run]]
+        numbers = []
+        for path in runs:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    numbers.extend(orjson.loads(line)["number"] for line in f)
+        return numbers
+
+
+async def wait_for_leader(instances, session, timeout_s=30):
+    """The leader once one instance leads and every other one is a standby."""
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        roles = [await instance.role(session) for instance in instances]
+        if roles.count("leader") == 1 and roles.count("standby") == len(instances) - 1:
+            return instances[roles.index("leader")]
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"No single leader among {[instance.name for instance in instances]} after {timeout_s}s")
+
+
+async def run_failover(directory, rounds=3, instances=2, block_time=2, lead_blocks=2, ttl_s=None):
+    chain = SimulatedChain(block_time=block_time, history=1000, tx_count=2)
+    node = SimulatedNode(chain, latency_ms=(5, 20))
+    await node.start()
+    fleet = [Instance(f"instance-{n}", directory, node.url, block_time, ttl_s) for n in range(instances)]
+    leases = SQLiteLeaseCoordinator(os.path.join(directory, "lease.sqlite"), holder="bench")
+    takeovers, first_block_delays, reemitted = [], [], []
+    standby_blocks = 0
+    try:
+        async with aiohttp.ClientSession() as session:
+            for instance in fleet:
+                await instance.start()
+            for _ in range(rounds):
+                leader = await wait_for_leader(fleet, session)
+                standbys = [instance for instance in fleet if instance is not leader]
+                counts = [len(standby.numbers(-1)) for standby in standbys]
+                started = leader.emitted()
+                while leader.emitted() == started:
+                    await asyncio.sleep(0.02)
+                await asyncio.sleep(lead_blocks * block_time)
+                standby_blocks += sum(len(standby.numbers(-1)) - count for standby, count in zip(standbys, counts))
+                leader.kill()
+                killed_at = time.monotonic()
+                await leader.process.wait()
+                last = max(leader.numbers(-1))
+                while True:
+                    lease = leases.current(LEASE_NAME)
+                    if lease is not None and lease.holder != leader.name:
+                        break
+                    await asyncio.sleep(0.01)
+                takeovers.append(time.monotonic() - killed_at)
+                successor = next(standby for standby in standbys if standby.name == lease.holder)
+                while max(successor.numbers(-1), default=0) <= last:
+                    await asyncio.sleep(0.01)
+                # blocks come out in order: everything up to `last` was replayed from the checkpoint first
+                emitted = successor.numbers(-1)
+                first_block_delays.append(time.time() - chain.produced_at(min(n for n in emitted if n > last)))
+                reemitted.append(len(set(leader.numbers(-1)).intersection(emitted)))
+                await leader.start()
+            await wait_for_leader(fleet, session)
+    finally:
+        for instance in fleet:
+            if instance.process is not None:
+                await instance.stop()
+        await node.stop()
+        leases.close()
+    numbers = sorted({number for instance in fleet for number in instance.numbers()})
+    gaps = sorted(set(range(numbers[0], numbers[-1] + 1)).difference(numbers)) if numbers else []
+    return FailoverResult(takeovers, first_block_delays, reemitted, standby_blocks, gaps, len(numbers))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--instances", type=int, default=2)
+    parser.add_argument("--block-time", type=int, default=2, help="seconds; also the instances' expected_block_time")
+    parser.add_argument("--lead-blocks", type=int, default=2, help="blocks the leader streams before it is killed")
+    parser.add_argument("--ttl", type=float, help="lease TTL in seconds (default: half the block time)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = await run_failover(
+            directory, args.rounds, args.instances, args.block_time, args.lead_blocks, args.ttl
+        )
+    print(f"{'round':>5} {'takeover s':>10} {'1st block s':>11} {'re-emitted':>10}")
+    for round_number, row in enumerate(zip(result.takeover_s, result.first_block_delay_s, result.reemitted), 1):
+        takeover_s, delay_s, reemitted = row
+        print(f"{round_number:>5} {takeover_s:>10.2f} {delay_s:>11.2f} {reemitted:>10}")
+    print(f"\n{result.blocks} blocks, {len(result.gaps)} missing, {result.standby_blocks} emitted by a standby; "
+          f"takeover max {max(result.takeover_s):.2f}s against a {args.block_time}s block time")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""Load test: emit-to-delivery latency and per-block publish cost with 1..1000 local subscribers.
+
+Streams `--blocks` records at `--rate` blocks/s through a SinkPipeline whose sink is a
+SubscriptionServer, with every subscriber reading over its own localhost TCP connection in this
+process. Latency runs from `SinkPipeline.put` to the subscriber having read the line; publish
+cost is the time the server spends handing each block to all subscribers (what the stream
+pays). Subscribers and the streamer share one event loop, so the latency includes waiting for
+every other subscriber's read.
+
+    python -m benchmarks.bench_fanout --subscribers 1 10 100 1000 --blocks 300 --rate 20
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from block_record import BlockRecord
+from sinks import SinkPipeline
+from subscription_server import SubscriptionServer
+
+
+class TimedServer(SubscriptionServer):
+    publish_s = 0.0
+
+    async def write_records(self, records, frames):
+        started = time.perf_counter()
+        await super().write_records(records, frames)
+        self.publish_s += time.perf_counter() - started
+
+
+def record(number):
+    return BlockRecord(number, number.to_bytes(32, "big"), (number - 1).to_bytes(32, "big"), 1_700_000_000 + number, 150)
+
+
+async def read_blocks(reader, blocks, emitted_at, latencies):
+    for _ in range(blocks):
+        line = await reader.readline()
+        number = int(line[10:line.index(b",")])  # {"number":N,...
+        latencies.append(time.perf_counter() - emitted_at[number])
+
+
+async def run(subscribers, blocks, rate):
+    server = TimedServer(port=0, buffer_size=4096)
+    await server.start()
+    pipeline = SinkPipeline(server, flush_interval_s=0.01)
+    emitted_at, latencies, connections = {}, [], []
+    for _ in range(subscribers):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"{}\n")
+        await reader.readline()
+        connections.append((reader, writer))
+    readers = [asyncio.create_task(read_blocks(reader, blocks, emitted_at, latencies)) for reader, _ in connections]
+
+    put_s = []
+    started = time.perf_counter()
+    for i in range(blocks):
+        # paced like a chain: the i-th block is due at i / rate
+        await asyncio.sleep(max(0.0, started + i / rate - time.perf_counter()))
+        number = 1_000_000 + i
+        emitted_at[number] = time.perf_counter()
+        await pipeline.put(record(number))
+        put_s.append(time.perf_counter() - emitted_at[number])
+    await asyncio.wait_for(asyncio.gather(*readers), 60)
+
+    await pipeline.stop()
+    for _, writer in connections:
+        writer.close()
+    await server.close()
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "max": latencies[-1],
+        "publish": server.publish_s / blocks,
+        "put": statistics.mean(put_s),
+        "disconnects": server.disconnects,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--blocks", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=20, help="blocks per second")
+    args = parser.parse_args()
+    logging.getLogger("subscription_server").setLevel(logging.WARNING)
+
+    print(f"{'subscribers':>11} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'publish us/block':>17} "
+          f"{'put us':>7} {'disconnects':>11}")
+    for subscribers in args.subscribers:
+        result = await run(subscribers, args.blocks, args.rate)
+        print(f"{subscribers:>11} {result['p50'] * 1e3:>8.2f} {result['p99'] * 1e3:>8.2f} {result['max'] * 1e3:>8.2f} "
+              f"{result['publish'] * 1e6:>17.1f} {result['put'] * 1e6:>7.1f} {result['disconnects']:>11}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
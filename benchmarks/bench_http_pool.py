@@ -0,0 +1,119 @@
+"""Latency of the first call after switching to an idle provider: cold vs warm connections.
+
+Serves a local aiohttp JSON-RPC stub over TLS (self-signed, via the openssl CLI; plain HTTP if
+that is missing) behind a proxy that adds `--rtt-ms` of round-trip delay, so handshakes cost
+what they would against a remote node.
+
+    python -m benchmarks.bench_http_pool --rtt-ms 20 --trials 20
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+from aiohttp import web
+
+from config import ProviderConfig
+from http_pool import HttpSessionPool
+from provider_client import ProviderClient
+
+
+async def handle_rpc(request):
+    body = await request.json()
+    return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": "0x3e8"})
+
+
+async def _pipe(reader, writer, delay_s):
+    try:
+        while data := await reader.read(1 << 16):
+            await asyncio.sleep(delay_s)
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_delay_proxy(upstream_port, rtt_s):
+    """TCP proxy adding rtt/2 each way, so every handshake round trip costs one rtt."""
+    async def handle(client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", upstream_port)
+        await asyncio.gather(
+            _pipe(client_reader, upstream_writer, rtt_s / 2),
+            _pipe(upstream_reader, client_writer, rtt_s / 2),
+        )
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def make_tls_contexts(tmp):
+    if shutil.which("openssl") is None:
+        return None, None
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_ctx.load_cert_chain(cert, key)
+    return server_ctx, ssl.create_default_context(cafile=cert)
+
+
+async def switch_latencies(url, mode, client_ssl):
+    """Time the first two head() calls on a provider nobody has talked to yet, as after a failover."""
+    client = ProviderClient(ProviderConfig(name="bench", url=url))
+    pool = None
+    if mode != "web3 default":
+        pool = HttpSessionPool(ssl_context=client_ssl, warm_connections=1)
+        await pool.attach(client)
+        if mode == "pool, warmed":
+            await pool.warm_up([client])
+    elif client_ssl is not None:
+        client.w3.provider._request_kwargs["ssl"] = client_ssl
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        await client.head()
+        timings.append(time.perf_counter() - started)
+    await (pool.close() if pool else client.close())
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rtt-ms", type=float, default=20.0)
+    parser.add_argument("--trials", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server_ssl, client_ssl = make_tls_contexts(tmp)
+        app = web.Application()
+        app.router.add_post("/", handle_rpc)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=server_ssl)
+        await site.start()
+        proxy = await start_delay_proxy(site._server.sockets[0].getsockname()[1], args.rtt_ms / 1000)
+        scheme = "https" if server_ssl else "http"
+        url = f"{scheme}://localhost:{proxy.sockets[0].getsockname()[1]}/"
+
+        print(f"{scheme.upper()} with {args.rtt_ms:.0f} ms RTT, median of {args.trials} switches")
+        print(f"{'connection':<16} {'first call ms':>14} {'second call ms':>15}")
+        for mode in ("web3 default", "pool, cold", "pool, warmed"):
+            samples = [await switch_latencies(url, mode, client_ssl) for _ in range(args.trials)]
+            first, second = (statistics.median(call) * 1000 for call in zip(*samples))
+            print(f"{mode:<16} {first:>14.1f} {second:>15.1f}")
+
+        proxy.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
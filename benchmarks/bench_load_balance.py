@@ -0,0 +1,61 @@
+"""Catch-up throughput with range fetches load-balanced over 1..N rate-limited fake providers.
+
+Each provider allows `--rate` requests/s, so a single provider is budget-bound and adding
+providers should scale throughput roughly linearly.
+
+    python -m benchmarks.bench_load_balance --providers 4 --blocks 2000 --rate 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from benchmarks.fake_provider import FakeProvider
+from block_streamer import BlockStreamService
+from provider_manager import ProviderManager
+
+
+async def run(provider_count, blocks, rate, batch_size, latency_s):
+    start_block = 1_000_000
+    providers = [
+        FakeProvider(name=f"Fake{i}", head=start_block + blocks, latency_s=latency_s, max_rate_per_sec=rate, seed=i)
+        for i in range(provider_count)
+    ]
+    for provider in providers:
+        # start from empty buckets so each provider's one-second burst doesn't flatter larger pools
+        provider.rate_limiter.requests.take(provider.rate_limiter.requests.capacity)
+    manager = ProviderManager(providers, lag_thr=30, error_thr=0.2, window_s=60)
+    service = BlockStreamService(
+        manager, start_block, max_catchup_window=256, catchup_batch_size=batch_size, lean_fetch=True,
+        load_balance=True,
+    )
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await service.process_blocks(start_block + blocks)
+        await service.output.stop()
+    elapsed = time.perf_counter() - started
+    assert service.last_processed_block == start_block + blocks
+    return blocks / elapsed, [provider.calls for provider in providers]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--providers", type=int, default=4)
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=20, help="requests/s budget per provider")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'providers':>9}  {'blocks/s':>9}  {'scaling':>7}  requests per provider")
+    baseline = None
+    for count in range(1, args.providers + 1):
+        rate, calls = await run(count, args.blocks, args.rate, args.batch_size, args.latency)
+        baseline = baseline or rate
+        print(f"{count:>9}  {rate:>9.1f}  {rate / baseline:>6.2f}x  {calls}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
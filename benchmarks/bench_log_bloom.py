@@ -0,0 +1,191 @@
+"""eth_getLogs calls avoided by testing each block's logsBloom before asking for its logs.
+
+Builds a seeded mainnet-like workload: `--blocks` blocks of about `--logs-per-block` logs each.
+Contracts and events are drawn from Zipf distributions, so a few tokens and Transfer dominate.
+Each log carries its event topic plus up to two indexed address topics. The workload is run
+once per density in `--logs-per-block`. With `--trace`, the blocks' logsBloom fields are taken
+from a TraceRecorder trace of a real provider instead (see benchmarks/chain_simulator.py); a
+trace has no logs, so true matches are not known.
+
+For each filter the table shows:
+- blocks that really match, and blocks the bloom lets through (candidates)
+- how many of the candidates are false positives
+- eth_getLogs requests per 1000 blocks when following the head: one per block without the
+  bloom, one per candidate with it ("avoided" is the difference)
+- the same while catching up in ranges of `--batch-size` blocks: one per range without the
+  bloom, one per range with any candidate with it (what LogEnricher sends)
+
+    python -m benchmarks.bench_log_bloom --blocks 2000 --logs-per-block 50 150 400
+"""
+import argparse
+import asyncio
+import functools
+import random
+import time
+from binascii import unhexlify
+
+import orjson
+from eth_utils import keccak
+
+from block_record import BlockRecord
+from log_enrichment import LogEnricher, LogFilter, bloom_bits
+
+CONTRACTS = 5000
+# the most common event signatures first; the long tail is synthetic
+EVENTS = [
+    "Transfer(address,address,uint256)", "Approval(address,address,uint256)",
+    "Swap(address,uint256,uint256,uint256,uint256,address)", "Sync(uint112,uint112)",
+    "Deposit(address,uint256)", "Withdrawal(address,uint256)",
+] + [f"Event{i}(uint256)" for i in range(300)]
+FILTERS = {
+    "top token, Transfer": (1, EVENTS[0]),
+    "rank-50 contract": (50, None),
+    "rank-500 contract, Transfer": (500, EVENTS[0]),
+    "rank-3000 contract": (3000, None),
+}
+
+
+def contract(rank):
+    return "0x" + keccak(b"contract%d" % rank)[:20].hex()
+
+
+def zipf_cum_weights(n, s):
+    cumulative, total = [], 0.0
+    for rank in range(1, n + 1):
+        total += 1 / rank ** s
+        cumulative.append(total)
+    return cumulative
+
+
+def generate(blocks, logs_per_block, seed):
+    """Blocks as (number, [(address, topics)]) with Zipf-distributed contracts and events."""
+    rng = random.Random(seed)
+    addresses = [contract(rank) for rank in range(1, CONTRACTS + 1)]
+    topics0 = ["0x" + keccak(text=event).hex() for event in EVENTS]
+    holders = ["0x" + "00" * 12 + rng.randbytes(20).hex() for _ in range(50_000)]
+    contract_weights, event_weights = zipf_cum_weights(CONTRACTS, 1.1), zipf_cum_weights(len(EVENTS), 1.3)
+    chain = []
+    for number in range(1_000_000, 1_000_000 + blocks):
+        count = rng.randint(logs_per_block // 2, logs_per_block * 3 // 2)
+        logs = [
+            (address, [topic0] + rng.sample(holders, rng.randint(0, 2)))
+            for address, topic0 in zip(
+                rng.choices(addresses, cum_weights=contract_weights, k=count),
+                rng.choices(topics0, cum_weights=event_weights, k=count),
+            )
+        ]
+        chain.append((number, logs))
+    return chain
+
+
+@functools.lru_cache(maxsize=None)
+def cached_bits(value):
+    return bloom_bits(unhexlify(value[2:]))
+
+
+def bloom_of(logs):
+    bloom = bytearray(256)
+    for address, topics in logs:
+        for value in (address, *topics):
+            for index, mask in cached_bits(value):
+                bloom[index] |= mask
+    return bytes(bloom)
+
+
+def records_from_trace(path):
+    blooms = {}
+    with open(path, "rb") as f:
+        for line in f:
+            exchange = orjson.loads(line)
+            responses = exchange["response"] if isinstance(exchange["response"], list) else [exchange["response"]]
+            for response in responses:
+                result = response.get("result") if isinstance(response, dict) else None
+                if isinstance(result, dict) and result.get("logsBloom"):
+                    blooms[int(result["number"], 16)] = unhexlify(result["logsBloom"][2:])
+    return [record(number, bloom) for number, bloom in sorted(blooms.items())]
+
+
+def record(number, bloom):
+    return BlockRecord(number, number.to_bytes(32, "big"), (number - 1).to_bytes(32, "big"), 0, 0, bloom)
+
+
+class CountingProvider:
+    """Answers eth_getLogs from the generated logs (empty for a trace), counting requests."""
+
+    name = "Workload"
+
+    def __init__(self, logs_by_number):
+        self.logs_by_number = logs_by_number
+        self.requests = 0
+
+    async def get_logs(self, log_filter):
+        self.requests += 1
+        if "blockHash" in log_filter:
+            numbers = [int(log_filter["blockHash"], 16)]
+        else:
+            numbers = range(int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16) + 1)
+        addresses, topics = log_filter.get("address"), log_filter.get("topics")
+        return [
+            {
+                "address": address, "topics": log_topics, "data": "0x", "blockNumber": hex(number),
+                "blockHash": "0x" + number.to_bytes(32, "big").hex(), "logIndex": hex(index),
+                "transactionIndex": "0x0", "transactionHash": "0x" + "00" * 32,
+            }
+            for number in numbers
+            for index, (address, log_topics) in enumerate(self.logs_by_number.get(number, ()))
+            if (not addresses or address in addresses) and (not topics or log_topics[0] in topics[0])
+        ]
+
+
+async def run_filter(records, logs_by_number, rank, event, batch_size):
+    log_filter = LogFilter([contract(rank)], events=[event] if event else [])
+    started = time.perf_counter()
+    candidates = sum(log_filter.may_match(r.logs_bloom) for r in records)
+    check_s = (time.perf_counter() - started) / len(records)
+
+    provider = CountingProvider(logs_by_number)
+    enricher = LogEnricher(log_filter)
+    for start in range(0, len(records), batch_size):
+        await enricher.enrich(provider, records[start:start + batch_size])
+    matches = sum(bool(r.logs) for r in records) if logs_by_number else None
+    return candidates, matches, provider.requests, check_s
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--logs-per-block", type=int, nargs="+", default=[50, 150, 400])
+    parser.add_argument("--batch-size", type=int, default=50, help="blocks per catch-up range (catchup_batch_size)")
+    parser.add_argument("--trace", help="take the blooms from a recorded trace instead")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workloads = []
+    if args.trace:
+        workloads.append((f"trace {args.trace}", records_from_trace(args.trace), {}))
+    else:
+        for logs_per_block in args.logs_per_block:
+            chain = generate(args.blocks, logs_per_block, args.seed)
+            records = [record(number, bloom_of(logs)) for number, logs in chain]
+            workloads.append((f"~{logs_per_block} logs/block", records, dict(chain)))
+
+    print(f"{'workload':<20} {'filter':<28} {'match %':>7} {'cand. %':>7} {'false +':>7} "
+          f"{'head/1k':>7} {'+bloom':>6} {'avoided':>7} {'ranges/1k':>9} {'+bloom':>6} {'check us':>8}")
+    for name, records, logs_by_number in workloads:
+        fill = sum(bin(byte).count("1") for r in records for byte in r.logs_bloom) / (2048 * len(records))
+        for label, (rank, event) in FILTERS.items():
+            candidates, matches, requests, check_s = await run_filter(
+                records, logs_by_number, rank, event, args.batch_size
+            )
+            per_1000 = 1000 / len(records)
+            false_positive = f"{(candidates - matches) / candidates:.0%}" if matches is not None and candidates else "-"
+            match_pct = f"{matches / len(records):.1%}" if matches is not None else "-"
+            ranges = -(-len(records) // args.batch_size)
+            print(f"{name:<20} {label:<28} {match_pct:>7} {candidates / len(records):>7.1%} {false_positive:>7} "
+                  f"{1000:>7} {candidates * per_1000:>6.0f} {1 - candidates / len(records):>7.0%} "
+                  f"{ranges * per_1000:>9.0f} {requests * per_1000:>6.0f} {check_s * 1e6:>8.2f}")
+        print(f"{'':<20} (bloom bits set: {fill:.0%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Per-call cost of the instrumentation in ProviderClient._timed.
+
+Times `_timed` around an already-resolved coroutine against `_timed` as it was before: the
+same rate-limiter wait, but only the two recent-window deque appends. The difference is what
+the /metrics counters and the scoring window (RequestStats, which the /metrics latency
+histogram is read from) add per request.
+
+    python -m benchmarks.bench_metrics --calls 20000 --repeats 50
+"""
+import argparse
+import asyncio
+import time
+import timeit
+from collections import deque
+
+from config import ProviderConfig
+from provider_client import ProviderClient
+from windowed_stats import RequestStats
+
+
+class UninstrumentedClient(ProviderClient):
+    """`_timed` as it was before /metrics and the scoring window: recent-window deques only."""
+
+    def __init__(self, cfg, max_rate_per_sec=None):
+        super().__init__(cfg, max_rate_per_sec)
+        self.latencies = deque(maxlen=30)
+        self.errors = deque(maxlen=30)
+
+    async def _timed(self, coro, method=None, calls=1):
+        await self.rate_limiter.acquire(1, calls * self.compute_unit_costs.get(method, 0))
+        start = time.perf_counter()
+        try:
+            result = await coro
+            self.errors.append(0)
+            return result
+        except Exception as e:
+            self.errors.append(1)
+            raise e
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+async def noop():
+    return None
+
+
+async def time_calls(client, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        await client._timed(noop(), "eth_blockNumber")
+    return (time.perf_counter() - started) / calls
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    cfg = ProviderConfig(name="bench", url="http://127.0.0.1:1")
+    # a budget high enough that the limiter never waits, so only bookkeeping is timed
+    instrumented, baseline = ProviderClient(cfg, 1e9), UninstrumentedClient(cfg, 1e9)
+    # best of many short interleaved runs: a run that no other process interrupted is likelier when runs are short
+    with_metrics = without_metrics = float("inf")
+    for _ in range(args.repeats):
+        without_metrics = min(without_metrics, await time_calls(baseline, args.calls))
+        with_metrics = min(with_metrics, await time_calls(instrumented, args.calls))
+
+    stats = RequestStats()
+    record = min(timeit.repeat(lambda: stats.record("eth_blockNumber", 0.042), number=args.calls,
+                               repeat=args.repeats)) / args.calls
+
+    print(f"{'_timed with deques (before)':<28} {without_metrics * 1e9:>8.0f} ns/call")
+    print(f"{'_timed instrumented':<28} {with_metrics * 1e9:>8.0f} ns/call")
+    print(f"{'instrumentation overhead':<28} {(with_metrics - without_metrics) * 1e9:>8.0f} ns/call")
+    print(f"{'RequestStats.record alone':<28} {record * 1e9:>8.0f} ns/call")
+    await instrumented.close()
+    await baseline.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
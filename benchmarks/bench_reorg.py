@@ -0,0 +1,67 @@
+"""Reorg recovery time as a function of reorg depth.
+
+Recovery is measured from the parent-hash mismatch to the new tip being emitted: the walk back
+to the common ancestor, the retractions and the re-stream of the canonical branch.
+
+    python -m benchmarks.bench_reorg --latency 0.02
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import time
+
+from benchmarks.fake_provider import FakeProvider
+from block_cache import RecentBlockCache
+from block_streamer import BlockStreamService
+from block_validator import BlockInconsistentHashError
+
+
+class _SingleProviderManager:
+    def __init__(self, provider):
+        self.active = provider
+
+
+async def recover(depth, batch_size, latency_s):
+    tip = 1_000_000
+    provider = FakeProvider(head=tip, latency_s=latency_s, max_rate_per_sec=1024)
+    service = BlockStreamService(
+        _SingleProviderManager(provider), tip - 128, max_catchup_window=8, catchup_batch_size=batch_size,
+        lean_fetch=True, block_cache=RecentBlockCache(capacity=128),
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        await service.process_blocks(tip)
+        provider.reorg(depth)
+        provider.head_number = tip + 1
+        provider.calls = 0
+
+        started = time.perf_counter()
+        try:
+            await service.process_blocks(tip + 1)
+        except BlockInconsistentHashError:
+            pass
+        assert await service._handle_reorg()
+        await service.process_blocks(tip + 1)
+        elapsed = time.perf_counter() - started
+    assert service.last_processed_block == tip + 1
+    return elapsed, provider.calls
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02, help="injected provider latency in seconds")
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16], help="blocks per walk-back fetch")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'batch':>5}  {'depth':>5}  {'recovery ms':>11}  {'requests':>8}")
+    for batch_size in args.batch_sizes:
+        for depth in args.depths:
+            elapsed, requests = await recover(depth, batch_size, args.latency)
+            print(f"{batch_size:>5}  {depth:>5}  {elapsed * 1000:>11.1f}  {requests:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
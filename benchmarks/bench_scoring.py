@@ -0,0 +1,226 @@
+"""Provider ranking stability and reaction time, and the cost of the windowed scoring.
+
+Three idle providers of equal quality are probed every `--probe-interval` seconds on a simulated
+clock, as ProviderManager.probe_idle_providers does. Each probe sees a provider one block behind
+with probability `--behind`, and its head() latency is lognormal around `--latency-ms`. Halfway
+through, one provider goes bad: `slow` multiplies its latency by 5, `behind` keeps it two blocks
+back (24 s, still under lag_threshold_s).
+
+The table compares the EWMA ranking this replaced (mean lag, then error EWMA, 60 s half-life)
+with the windowed score at several hysteresis margins:
+- reorders/h: how often the order of the healthy providers changed before the fault
+- top/h: how often the best failover candidate changed before the fault
+- react s: seconds from the fault until the bad provider was ranked last for good (- if it
+  was not last at the end)
+
+Below it, the per-call cost of recording a request into RequestStats (alone, and with its
+share of bucketing the buffered latencies when the window is next read), of reading p50/p95/p99
+from a sketch (a pass over its buckets), of a ProviderScore update alone and of scoring a probe
+(the error-rate and p95 reads plus the update), against the deque bookkeeping it replaced.
+
+    python -m benchmarks.bench_scoring --rounds 2000
+"""
+import argparse
+import asyncio
+import math
+import random
+import timeit
+from collections import deque
+
+from provider_manager import ProviderManager, ProviderScore
+from windowed_stats import RequestStats, WindowedQuantiles
+
+BLOCK_TIME = 12
+HEAD = 1_000_000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedProvider:
+    """Just enough of ProviderClient for probing: head() records a simulated latency into RequestStats."""
+
+    def __init__(self, name, clock, rng, behind, latency_ms):
+        self.name = name
+        self.stats = RequestStats(60, clock)
+        self.rng = rng
+        self.behind = behind
+        self.latency_s = latency_ms / 1000
+        self.lag_blocks = 0  # set for the `behind` fault
+        self.last_head = None
+        self.max_rate_per_sec = 10
+
+    async def head(self):
+        self.stats.record("eth_blockNumber", self.latency_s * math.exp(self.rng.gauss(0, 0.3)))
+        self.last_head = HEAD - self.lag_blocks - (self.rng.random() < self.behind)
+        return self.last_head
+
+    def get_error_ratio(self):
+        return self.stats.weighted_error_rate()
+
+    def get_latency_percentile(self, q, method=None):
+        return self.stats.latency_quantile(q, method)
+
+    def rate_headroom(self):
+        return 1.0
+
+
+class Ewma:
+    """The ExponentiallyWeightedMovingAverage ProviderScore used before, on the simulated clock."""
+
+    def __init__(self, half_life_s, clock):
+        self.decay = math.log(2) / half_life_s
+        self.clock = clock
+        self.value = None
+        self.updated = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            weight = math.exp(-self.decay * (self.clock() - self.updated))
+            self.value = weight * self.value + (1 - weight) * sample
+        self.updated = self.clock()
+
+
+def ewma_rank(lags, errors, candidates, lag_thr, error_thr):
+    healthy = {i: lags[i].value < lag_thr and errors[i].value < error_thr for i in candidates}
+    return sorted(candidates, key=lambda i: (not healthy[i], lags[i].value, errors[i].value))
+
+
+async def simulate(args, fault, hysteresis):
+    """Run one scenario; hysteresis None is the old EWMA ranking."""
+    clock, rng = Clock(), random.Random(args.seed)
+    # index 0 is the active provider, never probed; the rest are ranked
+    providers = [SimulatedProvider("active", clock, rng, 0, args.latency_ms)] + [
+        SimulatedProvider(name, clock, rng, args.behind, args.latency_ms) for name in "abc"
+    ]
+    manager = ProviderManager(
+        providers, lag_thr=30, error_thr=0.2, window_s=60, expected_block_time=BLOCK_TIME,
+        probe_interval_s=args.probe_interval, hysteresis=hysteresis or 0.0, clock=clock,
+    )
+    lags = [Ewma(60, clock) for _ in providers]
+    errors = [Ewma(60, clock) for _ in providers]
+    idle = [1, 2, 3]
+    order = list(idle)  # unranked before the first probe, as ProviderManager starts out
+    fault_round = args.rounds // 2
+    bad = None
+    reorders = top_changes = 0
+    previous = None
+    last_not_last = fault_round - 1  # the last round the bad provider was not ranked last
+    for round_number in range(args.rounds):
+        clock.now += args.probe_interval
+        if round_number == fault_round:
+            bad = order[0]  # the current best candidate goes bad
+            if fault == "slow":
+                providers[bad].latency_s *= 5
+            else:
+                providers[bad].lag_blocks = 2
+        await manager.probe_idle_providers()
+        if hysteresis is None:
+            for index in idle:
+                # the baseline scores the same probe answers the manager just got
+                lags[index].update((manager.best_head - providers[index].last_head) * BLOCK_TIME)
+                errors[index].update(providers[index].get_error_ratio())
+            order = ewma_rank(lags, errors, idle, 30, 0.2)
+        else:
+            order = [index for index in manager.ranking if index in idle]
+        if round_number < fault_round and previous is not None:
+            reorders += order != previous
+            top_changes += order[0] != previous[0]
+        if bad is not None and order[-1] != bad:
+            last_not_last = round_number
+        previous = order
+    hours = max(fault_round, 1) * args.probe_interval / 3600  # no rounds before the fault: no reorders
+    reacted = None if last_not_last == args.rounds - 1 else (last_not_last - fault_round + 2) * args.probe_interval
+    return reorders / hours, top_changes / hours, reacted
+
+
+async def run_scenarios(args):
+    rows = []
+    for fault in ("slow", "behind"):
+        for label, hysteresis in [("EWMA (before)", None)] + [(f"score, h={h}", h) for h in args.hysteresis]:
+            rows.append((fault, label, *await simulate(args, fault, hysteresis)))
+    return rows
+
+
+def costs(args):
+    number = args.calls
+    stats = RequestStats(60)
+    record_ns = min(timeit.repeat(lambda: stats.record("eth_blockNumber", 0.042), number=number, repeat=5)) / number
+    latencies, errors = deque(maxlen=30), deque(maxlen=30)
+
+    def deque_record():
+        errors.append(0)
+        latencies.append(0.042)
+
+    deque_ns = min(timeit.repeat(deque_record, number=number, repeat=5)) / number
+    bucketed = RequestStats(60)
+    rng = random.Random(args.seed)
+    samples = [0.05 * math.exp(rng.gauss(0, 0.5)) for _ in range(100)]
+
+    def record_then_read():
+        for latency in samples:
+            bucketed.record("eth_blockNumber", latency)
+        return bucketed.count
+
+    bucketed_ns = min(timeit.repeat(record_then_read, number=number // 100, repeat=5)) / number
+    sketch = WindowedQuantiles(60)
+    for _ in range(1000):
+        sketch.observe(0.05 * math.exp(rng.gauss(0, 0.5)))
+    reads = number // 20
+    read_ns = min(timeit.repeat(lambda: sketch.quantiles(0.5, 0.95, 0.99), number=reads, repeat=5)) / reads
+    latencies.extend(0.05 * math.exp(rng.gauss(0, 0.5)) for _ in range(30))
+
+    def sorted_percentiles():
+        ordered = sorted(latencies)
+        return [ordered[min(29, max(0, math.ceil(q * 30) - 1))] for q in (0.5, 0.95, 0.99)]
+
+    sorted_ns = min(timeit.repeat(sorted_percentiles, number=reads, repeat=5)) / reads
+    score = ProviderScore(30, 0.2)
+    update_ns = min(timeit.repeat(lambda: score.update(3.0, 0.01, 0.05), number=reads, repeat=5)) / reads
+
+    def score_probe():
+        # what ProviderManager._score does per probe: two window reads, then the update
+        score.update(3.0, stats.weighted_error_rate(), stats.latency_quantile(0.95, "eth_blockNumber"))
+
+    probe_ns = min(timeit.repeat(score_probe, number=reads, repeat=5)) / reads
+    return [
+        ("record a request", record_ns, "deque appends", deque_ns),
+        ("record, bucketed on read", bucketed_ns, None, None),
+        ("read p50/p95/p99", read_ns, "sort 30 samples", sorted_ns),
+        ("ProviderScore.update", update_ns, None, None),
+        ("score a probe", probe_ns, None, None),
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000, help="probe rounds; the fault starts halfway")
+    parser.add_argument("--probe-interval", type=float, default=15.0)
+    parser.add_argument("--behind", type=float, default=0.2, help="chance a probe finds a provider a block behind")
+    parser.add_argument("--latency-ms", type=float, default=60.0)
+    parser.add_argument("--hysteresis", type=float, nargs="+", default=[0.0, 0.1, 0.2])
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'fault':<8} {'ranking':<16} {'reorders/h':>10} {'top/h':>6} {'react s':>8}")
+    for fault, label, reorders, top_changes, reacted in await run_scenarios(args):
+        print(f"{fault:<8} {label:<16} {reorders:>10.1f} {top_changes:>6.1f} "
+              f"{'-' if reacted is None else f'{reacted:.0f}':>8}")
+    print()
+    for label, ns, baseline_label, baseline_ns in costs(args):
+        line = f"{label:<22} {ns * 1e9:>8.0f} ns"
+        if baseline_label:
+            line += f"   ({baseline_label}: {baseline_ns * 1e9:.0f} ns)"
+        print(line)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Records/sec through each output sink, against the old print() of a dict repr.
+
+    python -m benchmarks.bench_sinks --records 200000
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+
+from sinks import NdjsonSink, RotatingFileSink, SinkPipeline, SocketSink
+
+
+def make_record(number):
+    return {
+        "number": number,
+        "hash": f"0x{number:064x}",
+        "parentHash": f"0x{number - 1:064x}",
+        "timestamp": 1_700_000_000 + number * 12,
+        "tx_count": 150,
+    }
+
+
+def bench_print(records, path):
+    # line buffering matches PYTHONUNBUFFERED=1 in the Docker image: one write() per block
+    with open(path, "w", buffering=1) as out, contextlib.redirect_stdout(out):
+        started = time.perf_counter()
+        for record in records:
+            print(record)
+        return time.perf_counter() - started
+
+
+async def bench_pipeline(sink, records, batch_size):
+    pipeline = SinkPipeline(sink, queue_size=4096, batch_size=batch_size)
+    started = time.perf_counter()
+    for record in records:
+        await pipeline.put(record)
+    await pipeline.close()
+    return time.perf_counter() - started
+
+
+async def _discard(reader, writer):
+    while await reader.read(1 << 16):
+        pass
+    writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+    records = [make_record(n) for n in range(args.records)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tcp_server = await asyncio.start_server(_discard, "127.0.0.1", 0)
+        unix_path = os.path.join(tmp, "sink.sock")
+        unix_server = await asyncio.start_unix_server(_discard, unix_path)
+        sinks = {
+            "ndjson /dev/null": lambda: NdjsonSink(os.devnull),
+            "ndjson file": lambda: NdjsonSink(os.path.join(tmp, "blocks.ndjson")),
+            "rotating file": lambda: RotatingFileSink(os.path.join(tmp, "rotating.ndjson"), max_bytes=16 << 20),
+            "tcp socket": lambda: SocketSink(host="127.0.0.1", port=tcp_server.sockets[0].getsockname()[1]),
+            "unix socket": lambda: SocketSink(path=unix_path),
+        }
+
+        print(f"{'sink':<20} {'records/s':>12}")
+        print(f"{'print() file':<20} {args.records / bench_print(records, os.path.join(tmp, 'print.txt')):>12,.0f}")
+        for label, make_sink in sinks.items():
+            elapsed = await bench_pipeline(make_sink(), records, args.batch_size)
+            print(f"{label:<20} {args.records / elapsed:>12,.0f}")
+
+        tcp_server.close()
+        unix_server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,479 @@
+"""Deterministic simulated chain served over JSON-RPC, plus recording and replay of real provider traces.
+
+A SimulatedChain produces a block every `block_time` seconds from a fixed start time, so every
+block's hash, parent, timestamp and transactions, and every node's view of the chain at a given
+moment, follow from the scenario alone. Each SimulatedNode serves that chain on its own localhost
+port with its own latency distribution, block visibility delay, lag and injected 429/500 errors,
+so real ProviderClients (web3, aiohttp, rate limiter and all) can be pointed at it. A scenario's
+scripted events stall a node's head, change its behaviour, or reorg the chain at set times.
+
+    python -m benchmarks.chain_simulator serve --scenario failover --port 8545
+    python -m benchmarks.chain_simulator record --upstream https://eth.llamarpc.com --port 8545 --trace trace.ndjson
+    python -m benchmarks.chain_simulator replay --trace trace.ndjson --port 8545
+"""
+import argparse
+import asyncio
+import bisect
+import math
+import random
+import time
+from collections import defaultdict
+
+import aiohttp
+import orjson
+import yaml
+from aiohttp import web
+
+# settings a scenario event may change on a running node
+NODE_SETTINGS = ("latency_ms", "error_rate_429", "error_rate_500", "retry_after_s", "lag_blocks")
+
+
+class SimulatedChain:
+    """A chain with `history` blocks before `start` and a new block every `block_time` seconds after it.
+
+    Block `live_from` is produced at `start`. A block's hash encodes its number and its branch:
+    every `reorg(depth)` starts a new branch at the newest `depth` blocks, which replaces the old
+    ones for every node at once.
+    """
+
+    def __init__(self, block_time=12, history=10_000, first_block=1_000_000, tx_count=150, chain_id=1, start=None,
+                 clock=time.time):
+        self.block_time = block_time
+        self.first_block = first_block
+        self.live_from = first_block + history
+        self.tx_count = tx_count
+        self.chain_id = chain_id
+        self.clock = clock
+        self.start = math.floor(clock()) if start is None else start
+        self.forks = []  # (first block of the branch, branch), oldest first
+
+    @property
+    def head(self):
+        return self.head_at(self.clock())
+
+    def head_at(self, t):
+        return self.live_from + math.floor((t - self.start) / self.block_time)
+
+    def produced_at(self, number):
+        return self.start + (number - self.live_from) * self.block_time
+
+    def branch(self, number, forks=None):
+        for first, branch in reversed(self.forks if forks is None else forks):
+            if number >= first:
+                return branch
+        return 0
+
+    def reorg(self, depth):
+        self.forks.append((self.head - depth + 1, len(self.forks) + 1))
+
+    def block_hash(self, number, forks=None):
+        return f"0x{self.branch(number, forks):02x}{number:062x}"
+
+    def block(self, number, forks=None):
+        """The block as eth_getBlockByNumber returns it, with transaction hashes only.
+
+        `forks` (a prefix of `self.forks`) gives the chain as it was before the later reorgs.
+        """
+        return {
+            "number": hex(number),
+            "hash": self.block_hash(number, forks),
+            "parentHash": self.block_hash(number - 1, forks),
+            "timestamp": hex(int(self.produced_at(number))),
+            "transactions": [f"0x{number:032x}{i:032x}" for i in range(self.tx_count)],
+        }
+
+    def block_by_hash(self, block_hash):
+        """The block with `block_hash` on any branch, orphaned or not; None for a hash never produced."""
+        raw = bytes.fromhex(block_hash[2:])
+        branch, number = raw[0], int.from_bytes(raw[1:], "big")
+        forks = self.forks[:branch]
+        if branch > len(self.forks) or self.branch(number, forks) != branch:
+            return None
+        return self.block(number, forks)
+
+
+class JsonRpcServer:
+    """Serves `respond(request)` for POSTs to / on localhost; `url` is set once started."""
+
+    url = None
+
+    def __init__(self):
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f"http://{host}:{site._server.sockets[0].getsockname()[1]}/"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def respond(self, request):
+        """Answer a JSON-RPC request (a call or a batch) with (HTTP status, payload, headers)."""
+        raise NotImplementedError
+
+    async def _handle(self, http_request):
+        try:
+            request = orjson.loads(await http_request.read())
+        except orjson.JSONDecodeError:
+            return web.Response(status=400)
+        status, payload, headers = await self.respond(request)
+        return web.Response(status=status, body=orjson.dumps(payload), content_type="application/json",
+                            headers=headers)
+
+
+def rpc_error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+class SimulatedNode(JsonRpcServer):
+    """One provider's view of a SimulatedChain, answering eth_blockNumber, eth_getBlockByNumber/ByHash and eth_chainId.
+
+    A block becomes visible to this node a delay drawn uniformly from `visibility_s` after it is
+    produced, and the node reports a head `lag_blocks` behind that. Each request waits a latency
+    drawn from a lognormal with the median and p99 in `latency_ms`, half before the node reads its
+    head and half after, and fails with 429 (carrying Retry-After) or 500 at the given rates.
+    `stall(duration_s)` freezes the head, as a node that stopped syncing would.
+
+    Visibility delays depend only on the seed and block number; latency and error draws come from
+    a generator seeded with `seed`, so the same requests in the same order see the same answers.
+    """
+
+    def __init__(self, chain, name="node", latency_ms=(20, 80), visibility_s=(0.0, 0.0), error_rate_429=0.0,
+                 error_rate_500=0.0, retry_after_s=1, lag_blocks=0, seed=0):
+        super().__init__()
+        if visibility_s[1] - visibility_s[0] >= chain.block_time:
+            raise ValueError("The visibility delay range must be narrower than the block time")
+        self.chain = chain
+        self.name = name
+        self.latency_ms = latency_ms
+        self.visibility_s = visibility_s
+        self.error_rate_429 = error_rate_429
+        self.error_rate_500 = error_rate_500
+        self.retry_after_s = retry_after_s
+        self.lag_blocks = lag_blocks
+        self.seed = seed
+        self.requests = 0
+        self.stalled_until = None
+        self.stalled_head = None
+        self._random = random.Random(seed)
+
+    def visible_at(self, number):
+        """When this node's head reaches `number`, ignoring stalls."""
+        number += self.lag_blocks
+        low, high = self.visibility_s
+        return self.chain.produced_at(number) + random.Random(self.seed * 1_000_003 + number).uniform(low, high)
+
+    def head(self):
+        now = self.chain.clock()
+        if self.stalled_until is not None:
+            if now < self.stalled_until:
+                return self.stalled_head
+            self.stalled_until = None
+        # no block produced after now - min delay is visible yet; the delay range is narrower than a
+        # block, so this walks back at most a block or two
+        number = self.chain.head_at(now - self.visibility_s[0]) - self.lag_blocks
+        while self.visible_at(number) > now:
+            number -= 1
+        return number
+
+    def stall(self, duration_s):
+        self.stalled_head = self.head()
+        self.stalled_until = self.chain.clock() + duration_s
+
+    def latency_s(self):
+        median, p99 = self.latency_ms
+        if not median:
+            return 0.0
+        # lognormal: p99 sits 2.326 standard deviations above the median
+        sigma = math.log(p99 / median) / 2.326 if p99 > median else 0.0
+        return self._random.lognormvariate(math.log(median), sigma) / 1000
+
+    async def respond(self, request):
+        self.requests += 1
+        draw = self._random.random()
+        latency = self.latency_s()
+        await asyncio.sleep(latency / 2)
+        try:
+            if draw < self.error_rate_429:
+                return 429, rpc_error(None, -32005, "rate limit exceeded"), {"Retry-After": str(self.retry_after_s)}
+            if draw < self.error_rate_429 + self.error_rate_500:
+                return 500, rpc_error(None, -32603, "internal error"), {}
+            head = self.head()
+            if isinstance(request, list):
+                return 200, [self._answer(call, head) for call in request], {}
+            return 200, self._answer(request, head), {}
+        finally:
+            await asyncio.sleep(latency / 2)
+
+    def _answer(self, call, head):
+        method, params = call.get("method"), call.get("params") or []
+        if method == "eth_blockNumber":
+            result = hex(head)
+        elif method == "eth_getBlockByNumber":
+            number = head if params[0] == "latest" else int(params[0], 16)
+            result = self.chain.block(number) if number <= head else None
+        elif method == "eth_getBlockByHash":
+            result = self.chain.block_by_hash(params[0])
+            if result is not None and int(result["number"], 16) > head:
+                result = None
+        elif method == "eth_chainId":
+            result = hex(self.chain.chain_id)
+        else:
+            return rpc_error(call.get("id"), -32601, f"method {method} not supported by the simulator")
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+
+
+class ChainSimulator:
+    """A SimulatedChain and its nodes built from a scenario, with the scenario's scripted events.
+
+    A scenario is a dict (or a YAML file holding one)::
+
+        block_time: 12          # seconds
+        history: 10000          # blocks produced before the simulation starts
+        tx_count: 150           # transaction hashes per block
+        seed: 0
+        nodes:
+          - {name: a, latency_ms: [20, 80], visibility_s: [0.1, 1.0], error_rate_429: 0.0, error_rate_500: 0.0}
+          - {name: b, latency_ms: [40, 200], lag_blocks: 1}
+        events:
+          - {at: 10, node: a, set: {error_rate_500: 1.0}}   # change a node's settings
+          - {at: 20, node: b, stall: 30}                    # freeze a node's head for 30 s
+          - {at: 30, reorg: 3}                              # replace the newest 3 blocks
+
+    Event times are seconds after the chain's start. Passing the same `start` to two simulators
+    gives two identical chains, e.g. one serving in another process and one to compute what it
+    served.
+    """
+
+    def __init__(self, scenario, start=None, clock=time.time):
+        self.scenario = scenario
+        self.chain = SimulatedChain(
+            block_time=scenario.get("block_time", 12),
+            history=scenario.get("history", 10_000),
+            tx_count=scenario.get("tx_count", 150),
+            start=start,
+            clock=clock,
+        )
+        seed = scenario.get("seed", 0)
+        self.nodes = [
+            SimulatedNode(self.chain, **{"name": f"node{i}", "seed": seed * 1000 + i, **node})
+            for i, node in enumerate(scenario.get("nodes") or [{}])
+        ]
+        self.events = sorted(scenario.get("events") or [], key=lambda event: event["at"])
+        self._events_task = None
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(yaml.safe_load(f), **kwargs)
+
+    @property
+    def urls(self):
+        return [node.url for node in self.nodes]
+
+    def node(self, name):
+        return next(node for node in self.nodes if node.name == name)
+
+    def apply(self, event):
+        if "reorg" in event:
+            self.chain.reorg(event["reorg"])
+            return
+        node = self.node(event["node"])
+        if "stall" in event:
+            node.stall(event["stall"])
+        for setting, value in (event.get("set") or {}).items():
+            if setting not in NODE_SETTINGS:
+                raise ValueError(f"Unknown node setting {setting}")
+            setattr(node, setting, value)
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Serve every node, on consecutive ports from `port` (or any free ports with 0), and start the events."""
+        for i, node in enumerate(self.nodes):
+            await node.start(host, port + i if port else 0)
+        self._events_task = asyncio.create_task(self._run_events())
+
+    async def stop(self):
+        if self._events_task is not None:
+            self._events_task.cancel()
+            await asyncio.gather(self._events_task, return_exceptions=True)
+        for node in self.nodes:
+            await node.stop()
+
+    async def _run_events(self):
+        for event in self.events:
+            await asyncio.sleep(max(0.0, self.chain.start + event["at"] - self.chain.clock()))
+            self.apply(event)
+
+
+class TraceRecorder(JsonRpcServer):
+    """Proxies JSON-RPC requests to `upstream` and appends each exchange to the NDJSON trace at `path`.
+
+    Each line is `{"t": seconds since start, "latency": seconds, "status": HTTP status, "request": ...,
+    "response": ...}`; point a ProviderClient at the recorder to capture a real provider's behaviour.
+    """
+
+    def __init__(self, upstream, path, clock=time.monotonic):
+        super().__init__()
+        self.upstream = upstream
+        self.path = path
+        self.clock = clock
+        self.exchanges = 0
+        self._session = None
+        self._file = None
+        self._started = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._session = aiohttp.ClientSession()
+        self._file = open(self.path, "ab")
+        self._started = self.clock()
+        await super().start(host, port)
+
+    async def stop(self):
+        await super().stop()
+        if self._session is not None:
+            await self._session.close()
+            self._file.close()
+            self._session = None
+
+    async def respond(self, request):
+        sent = self.clock()
+        async with self._session.post(
+            self.upstream, data=orjson.dumps(request), headers={"Content-Type": "application/json"}
+        ) as response:
+            status = response.status
+            body = await response.read()
+            retry_after = response.headers.get("Retry-After")
+        latency = self.clock() - sent
+        try:
+            payload = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            payload = None
+        self._file.write(orjson.dumps(
+            {"t": sent - self._started, "latency": latency, "status": status, "request": request, "response": payload},
+            option=orjson.OPT_APPEND_NEWLINE,
+        ))
+        self._file.flush()
+        self.exchanges += 1
+        return status, payload, {"Retry-After": retry_after} if retry_after else {}
+
+
+def call_key(call):
+    return call.get("method"), orjson.dumps(call.get("params") or [])
+
+
+class TraceReplayNode(JsonRpcServer):
+    """Serves a TraceRecorder trace back, call by call.
+
+    A call gets the answer recorded for the same method and params at or before the time elapsed
+    since the node started (the first one if it comes earlier), so a polled head advances as it did
+    while recording and an error is served again when it was served then. The reply comes after
+    the slowest matched call's recorded latency; a call that was never recorded gets an error.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        super().__init__()
+        self.clock = clock
+        self.answers = defaultdict(list)  # call key -> [(t, latency, status, response, whole)], by t
+        self.misses = 0
+        self._started = None
+        with open(path, "rb") as f:
+            for line in f:
+                self._index(orjson.loads(line))
+
+    def _index(self, exchange):
+        request, response, status = exchange["request"], exchange["response"], exchange["status"]
+        calls = request if isinstance(request, list) else [request]
+        # a failed request, or a batch rejected with a single error, is replayed as that whole response
+        whole = status != 200 or isinstance(request, list) and not isinstance(response, list)
+        by_id = {} if whole else {
+            item.get("id"): item for item in (response if isinstance(response, list) else [response])
+            if isinstance(item, dict)
+        }
+        for call in calls:
+            self.answers[call_key(call)].append((
+                exchange["t"], exchange["latency"], status, response if whole else by_id.get(call.get("id")), whole
+            ))
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._started = self.clock()
+        await super().start(host, port)
+
+    def lookup(self, call):
+        answers = self.answers.get(call_key(call))
+        if not answers:
+            return None
+        elapsed = self.clock() - self._started
+        return answers[max(0, bisect.bisect_right(answers, elapsed, key=lambda answer: answer[0]) - 1)]
+
+    async def respond(self, request):
+        calls = request if isinstance(request, list) else [request]
+        replies, latency = [], 0.0
+        for call in calls:
+            answer = self.lookup(call)
+            if answer is None:
+                self.misses += 1
+                replies.append(rpc_error(call.get("id"), -32000, "call not in the trace"))
+                continue
+            _, recorded_latency, status, response, whole = answer
+            latency = max(latency, recorded_latency)
+            if whole:
+                await asyncio.sleep(latency)
+                return status, response, {}
+            if response is None:
+                replies.append(rpc_error(call.get("id"), -32000, "no answer for this call in the trace"))
+            else:
+                replies.append({**response, "id": call.get("id")})
+        await asyncio.sleep(latency)
+        return 200, replies if isinstance(request, list) else replies[0], {}
+
+
+async def serve(server_or_simulator, port):
+    await server_or_simulator.start(port=port)
+    urls = getattr(server_or_simulator, "urls", None) or [server_or_simulator.url]
+    for url in urls:
+        print(f"serving on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server_or_simulator.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="serve a scenario, one port per node")
+    serve_parser.add_argument("--scenario", required=True, help="a benchmarks.suite scenario name or a YAML file")
+    serve_parser.add_argument("--port", type=int, default=8545, help="port of the first node")
+    record_parser = commands.add_parser("record", help="proxy to a real provider and record a trace")
+    record_parser.add_argument("--upstream", required=True)
+    record_parser.add_argument("--trace", required=True)
+    record_parser.add_argument("--port", type=int, default=8545)
+    replay_parser = commands.add_parser("replay", help="serve a recorded trace")
+    replay_parser.add_argument("--trace", required=True)
+    replay_parser.add_argument("--port", type=int, default=8545)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from benchmarks.suite import SCENARIOS
+        simulator = (
+            ChainSimulator(SCENARIOS[args.scenario]) if args.scenario in SCENARIOS else ChainSimulator.load(args.scenario)
+        )
+        await serve(simulator, args.port)
+    elif args.command == "record":
+        await serve(TraceRecorder(args.upstream, args.trace), args.port)
+    else:
+        await serve(TraceReplayNode(args.trace), args.port)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+import asyncio
+import random
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from block_record import BlockRecord
+from config import ProviderConfig
+from provider_client import BLOCK_NUMBER, GET_BLOCK_BY_NUMBER, ProviderClient
+
+
+def block_hash(number, branch=0):
+    return HexBytes(bytes([branch]) + number.to_bytes(31, "big"))
+
+
+_TX_HASHES = b"[" + b",".join([b'"0x%064x"' % i for i in range(150)]) + b"]"
+_RPC_RESPONSE = (
+    b'{"jsonrpc":"2.0","id":%d,"result":{"number":"0x%x","hash":"0x%s","parentHash":"0x%s",'
+    b'"timestamp":"0x%x","transactions":%s}}'
+)
+
+
+def make_block(number, tx_count=150, branch=0, parent_branch=None):
+    parent_branch = branch if parent_branch is None else parent_branch
+    return AttributeDict({
+        "number": number,
+        "hash": block_hash(number, branch),
+        "parentHash": block_hash(number - 1, parent_branch),
+        "timestamp": 1_700_000_000 + number * 12,
+        "transactions": [HexBytes(b"\x00" * 32)] * tx_count,
+    })
+
+
+class FakeProvider(ProviderClient):
+    """ProviderClient whose RPC calls are served from memory after an injected delay.
+
+    Calls still go through `_timed`, so the rate limiter and scoring window behave as they
+    do against a real node. `reorg(depth)` replaces the newest `depth` blocks with a new branch.
+    """
+
+    def __init__(self, name="Fake", head=1_000_000, latency_s=0.05, jitter_s=0.0, max_rate_per_sec=10, seed=0):
+        super().__init__(ProviderConfig(name=name, url="http://127.0.0.1:0"), max_rate_per_sec=max_rate_per_sec)
+        self.head_number = head
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.calls = 0
+        self.branch = 0
+        self.fork_from = None
+        self._random = random.Random(seed)
+
+    def reorg(self, depth):
+        self.branch += 1
+        self.fork_from = self.head_number - depth + 1
+
+    def _branch(self, number):
+        return self.branch if self.fork_from is not None and number >= self.fork_from else 0
+
+    def block(self, number):
+        return make_block(number, branch=self._branch(number), parent_branch=self._branch(number - 1))
+
+    def record(self, number):
+        block = self.block(number)
+        return BlockRecord.from_block(block)
+
+    async def _respond(self, value):
+        self.calls += 1
+        delay = self.latency_s
+        if self.jitter_s:
+            delay += self._random.uniform(0, self.jitter_s)
+        await asyncio.sleep(delay)
+        return value
+
+    async def head(self):
+        return await self._timed(self._respond(self.head_number), BLOCK_NUMBER)
+
+    async def get_block(self, block_number):
+        return await self._timed(self._respond(self.block(block_number)), GET_BLOCK_BY_NUMBER)
+
+    async def get_blocks(self, start, end):
+        # one round-trip per batch, as with a JSON-RPC batch POST
+        chunks = []
+        for chunk_start, chunk_end in self._batch_ranges(start, end):
+            blocks = [self.block(n) for n in range(chunk_start, chunk_end + 1)]
+            chunks.extend(await self._timed(self._respond(blocks), GET_BLOCK_BY_NUMBER, len(blocks)))
+        return chunks
+
+    async def get_block_record(self, block_number):
+        return await self._timed(self._respond(self.record(block_number)), GET_BLOCK_BY_NUMBER)
+
+    async def get_block_range_body(self, start, end):
+        # a raw JSON-RPC batch body as a node sends it: 150 transaction hashes per block
+        responses = []
+        for request_id, number in enumerate(range(start, end + 1)):
+            block = self.block(number)
+            responses.append(_RPC_RESPONSE % (
+                request_id, number, block.hash.hex().encode(), block.parentHash.hex().encode(), block.timestamp,
+                _TX_HASHES,
+            ))
+        body = b"[" + b",".join(responses) + b"]"
+        return await self._timed(self._respond(body), GET_BLOCK_BY_NUMBER, end - start + 1)
+
+    async def get_block_records(self, start, end):
+        chunks = []
+        for chunk_start, chunk_end in self._batch_ranges(start, end):
+            records = [self.record(n) for n in range(chunk_start, chunk_end + 1)]
+            chunks.extend(await self._timed(self._respond(records), GET_BLOCK_BY_NUMBER, len(records)))
+        return chunks
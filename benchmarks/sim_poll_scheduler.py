@@ -0,0 +1,106 @@
+"""Head-to-emit latency and head() calls per block: fixed polling vs PollScheduler, on a fake clock.
+
+Simulates a chain with `--block-time` slots, a `--missed` fraction of empty slots and blocks that
+become visible to the provider a random 0.5..`--max-visibility` seconds after their timestamp,
+then replays the stream loop's poll/sleep cycle against it without real sleeping.
+
+    python -m benchmarks.sim_poll_scheduler --blocks 5000 --block-time 12
+"""
+import argparse
+import bisect
+import random
+import statistics
+
+from poll_scheduler import PollScheduler
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedChain:
+    def __init__(self, blocks, block_time, missed, max_visibility, seed):
+        rng = random.Random(seed)
+        self.timestamps = []
+        self.visible_at = []
+        slot = 1_700_000_000
+        while len(self.timestamps) < blocks:
+            slot += block_time
+            if rng.random() < missed:
+                continue
+            self.timestamps.append(slot)
+            self.visible_at.append(slot + rng.uniform(0.5, max_visibility))
+        # a late block can't be visible before its parent
+        for i in range(1, blocks):
+            self.visible_at[i] = max(self.visible_at[i], self.visible_at[i - 1])
+
+    def head(self, now):
+        """Index of the newest block visible at `now`, -1 before the first."""
+        return bisect.bisect_right(self.visible_at, now) - 1
+
+
+def simulate(chain, next_delay_for):
+    """Runs the poll loop until the last block is seen; returns per-block latencies and head() calls."""
+    clock = FakeClock(chain.visible_at[0])
+    next_delay, on_head, on_block = next_delay_for(clock)
+    seen = chain.head(clock.now)
+    on_head(seen)
+    on_block(seen, chain.timestamps[seen])
+    latencies, calls = [], 0
+    last = len(chain.timestamps) - 1
+    while seen < last:
+        clock.now += next_delay()
+        head = chain.head(clock.now)
+        calls += 1
+        on_head(head)
+        for number in range(seen + 1, head + 1):
+            latencies.append(clock.now - chain.visible_at[number])
+            on_block(number, chain.timestamps[number])
+        seen = max(seen, head)
+    return latencies, calls
+
+
+def fixed(interval):
+    def build(clock):
+        return (lambda: interval), (lambda head: None), (lambda number, timestamp: None)
+    return build
+
+
+def adaptive(block_time, min_interval):
+    def build(clock):
+        scheduler = PollScheduler(block_time, min_interval_s=min_interval, clock=clock)
+        return scheduler.next_delay, scheduler.on_head, scheduler.on_block
+    return build
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=5000)
+    parser.add_argument("--block-time", type=int, default=12)
+    parser.add_argument("--missed", type=float, default=0.01, help="fraction of empty slots")
+    parser.add_argument("--max-visibility", type=float, default=2.5, help="seconds until a block is visible")
+    parser.add_argument("--min-interval", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    chain = SimulatedChain(args.blocks, args.block_time, args.missed, args.max_visibility, args.seed)
+    strategies = {
+        "fixed 2s": fixed(2.0),
+        "fixed 1s": fixed(1.0),
+        f"fixed {args.min_interval}s": fixed(args.min_interval),
+        "adaptive": adaptive(args.block_time, args.min_interval),
+    }
+    print(f"{args.blocks} blocks, {args.block_time}s slots, {args.missed:.0%} missed")
+    print(f"{'strategy':<12} {'mean ms':>8} {'p95 ms':>8} {'head()/block':>13}")
+    for name, strategy in strategies.items():
+        latencies, calls = simulate(chain, strategy)
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(f"{name:<12} {statistics.mean(latencies) * 1000:>8.0f} {p95 * 1000:>8.0f} {calls / len(latencies):>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
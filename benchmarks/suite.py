@@ -0,0 +1,261 @@
+"""End-to-end benchmark suite: the streamer against a simulated chain, with results comparable across commits.
+
+Every scenario runs the service as main.py wires it (AppConfig defaults, real ProviderClients
+over a shared HTTP pool, load-balanced catch-up) against ChainSimulator nodes served from a
+child process, so the simulator's work is not timed or traced with the streamer's. The parent
+keeps an identical copy of the simulated chain to know when each node could first serve a block.
+
+- catchup: blocks/s catching up `--catchup-blocks` blocks from two nodes
+- live: head-to-emit latency on a 1 s chain, from the first moment any node served the block to
+  its emission
+- failover: the active node answers every request with HTTP 500 from 5 s in; recovery is how
+  late the first block emitted after the fault is, counted from when the backup node served it
+  (or from the fault, if later), and how many times ProviderManager switched
+- memory: tracemalloc peak while catching up, and bytes retained per block once caught up
+
+`--json` writes the results together with the commit and settings they were measured with, and
+`--compare` prints them next to an earlier results file.
+
+    python -m benchmarks.suite --json results.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import multiprocessing
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from benchmarks.chain_simulator import ChainSimulator
+from block_record import BlockRecord
+from config import AppConfig, ProviderConfig
+from main import build_http_pool, build_streamer
+from sinks import BlockSink, SinkPipeline
+
+NODES = [
+    {"name": "a", "latency_ms": [20, 80], "visibility_s": [0.05, 0.5]},
+    {"name": "b", "latency_ms": [30, 120], "visibility_s": [0.1, 0.6]},
+]
+FAULT_AT_S = 5
+SCENARIOS = {
+    "catchup": {"block_time": 12, "history": 50_000, "nodes": NODES},
+    "live": {"block_time": 1, "history": 1000, "nodes": NODES},
+    "failover": {
+        "block_time": 1, "history": 1000, "nodes": NODES,
+        "events": [{"at": FAULT_AT_S, "node": "a", "set": {"error_rate_500": 1.0}}],
+    },
+}
+
+
+class EmitTimes(BlockSink):
+    """Discards the output, keeping the wall-clock time each block number was first written."""
+
+    def __init__(self):
+        self.at = {}
+
+    async def write(self, chunk: bytes):
+        pass
+
+    async def write_records(self, records, frames):
+        now = time.time()
+        for record in records:
+            if type(record) is BlockRecord:
+                self.at.setdefault(record.number, now)
+
+
+def _serve(scenario, start, connection):
+    async def serve():
+        simulator = ChainSimulator(scenario, start=start)
+        await simulator.start()
+        connection.send(simulator.urls)
+        await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+        await simulator.stop()
+
+    asyncio.run(serve())
+
+
+@contextlib.asynccontextmanager
+async def simulated(name):
+    """Serve scenario `name` from a child process; yields a local copy of its simulator and the node URLs."""
+    scenario = SCENARIOS[name]
+    # start the chain on the next whole second, once the child is likely up
+    start = int(time.time()) + 2
+    context = multiprocessing.get_context("spawn")
+    connection, child_connection = context.Pipe()
+    process = context.Process(target=_serve, args=(scenario, start, child_connection), daemon=True)
+    process.start()
+    loop = asyncio.get_running_loop()
+    try:
+        urls = await loop.run_in_executor(None, connection.recv)
+        await asyncio.sleep(max(0.0, start - time.time()))
+        yield ChainSimulator(scenario, start=start), urls
+    finally:
+        connection.send(None)
+        await loop.run_in_executor(None, process.join, 5)
+
+
+@contextlib.asynccontextmanager
+async def streamer(simulator, urls, rate):
+    app_cfg = AppConfig(
+        expected_block_time=simulator.chain.block_time,
+        providers=[
+            ProviderConfig(name=node.name, url=url, max_rate_per_sec=rate) for node, url in zip(simulator.nodes, urls)
+        ],
+        push_heads=False,
+        checkpoint_path=None,
+        load_balance_catchup=True,
+        metrics_port=None,
+    )
+    service = build_streamer(app_cfg)
+    emitted = EmitTimes()
+    service.output = SinkPipeline(emitted, flush_interval_s=app_cfg.output.flush_interval_s)
+    http_pool = build_http_pool(app_cfg)
+    for provider in service.provider_manager.providers:
+        await http_pool.attach(provider)
+    await http_pool.warm_up(service.provider_manager.providers)
+    try:
+        yield service, emitted
+    finally:
+        await service.output.stop()
+        await http_pool.close()
+        for provider in service.provider_manager.providers:
+            await provider.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_catchup(args, traced=False):
+    async with simulated("catchup") as (simulator, urls):
+        async with streamer(simulator, urls, args.rate) as (service, _):
+            head = simulator.chain.head
+            service.last_processed_block = head - args.catchup_blocks
+            if traced:
+                tracemalloc.start()
+                before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            await service.process_blocks(head)
+            elapsed = time.perf_counter() - started
+            if traced:
+                gc.collect()
+                retained, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                return {
+                    "peak_mib": (peak - before) / 2 ** 20,
+                    "retained_bytes_per_block": (retained - before) / len(service.block_cache),
+                }
+    return {"blocks_per_s": args.catchup_blocks / elapsed}
+
+
+async def follow(service, seconds):
+    task = asyncio.create_task(service.stream())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def run_live(args):
+    async with simulated("live") as (simulator, urls):
+        async with streamer(simulator, urls, args.rate) as (service, emitted):
+            await follow(service, args.live_seconds)
+    latencies = [
+        at - min(node.visible_at(number) for node in simulator.nodes) for number, at in emitted.at.items()
+    ]
+    return {
+        "blocks": len(latencies),
+        "head_to_emit_p50_s": percentile(latencies, 0.5),
+        "head_to_emit_p95_s": percentile(latencies, 0.95),
+        "head_to_emit_p99_s": percentile(latencies, 0.99),
+    }
+
+
+async def run_failover(args):
+    async with simulated("failover") as (simulator, urls):
+        async with streamer(simulator, urls, args.rate) as (service, emitted):
+            await follow(service, FAULT_AT_S + args.failover_seconds - (time.time() - simulator.chain.start))
+    fault = simulator.chain.start + FAULT_AT_S
+    backup = simulator.node("b")
+    after = sorted((number, at) for number, at in emitted.at.items() if at > fault)
+    if not after:
+        return {"recovery_s": None, "switches": service.provider_manager.switch_count}
+    number, at = after[0]
+    return {
+        "recovery_s": at - max(fault, backup.visible_at(number)),
+        "switches": service.provider_manager.switch_count,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.stdout.strip() + ("-dirty" if dirty else "")
+
+
+def print_results(results, baseline=None):
+    print(f"{'metric':<36} {'value':>12}" + (f" {'baseline':>12} {'change':>8}" if baseline else ""))
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            line = f"{scenario + '.' + metric:<36} {format_value(value):>12}"
+            if baseline:
+                before = baseline.get(scenario, {}).get(metric)
+                change = f"{(value - before) / before:+.1%}" if value is not None and before else ""
+                line += f" {format_value(before):>12} {change:>8}"
+            print(line)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=["catchup", "live", "failover", "memory"],
+                        default=["catchup", "live", "failover", "memory"])
+    parser.add_argument("--rate", type=float, default=200, help="requests/s budget per provider")
+    parser.add_argument("--catchup-blocks", type=int, default=10_000)
+    parser.add_argument("--live-seconds", type=float, default=20)
+    parser.add_argument("--failover-seconds", type=float, default=10, help="how long to stream after the fault")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to print next to these")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    results = {}
+    if "catchup" in args.only:
+        results["catchup"] = await run_catchup(args)
+    if "live" in args.only:
+        results["live"] = await run_live(args)
+    if "failover" in args.only:
+        results["failover"] = await run_failover(args)
+    if "memory" in args.only:
+        results["memory"] = await run_catchup(args, traced=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "settings": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+                "scenarios": SCENARIOS,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
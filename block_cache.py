@@ -0,0 +1,83 @@
+def hash_key(block_hash):
+    """Normalise a block hash (bytes, or hex with or without 0x) to its raw 32 bytes."""
+    if isinstance(block_hash, (bytes, bytearray)):
+        return bytes(block_hash)
+    return bytes.fromhex(block_hash[2:] if block_hash.startswith("0x") else block_hash)
+
+
+class RecentBlockCache:
+    """Ring of the last `capacity` emitted blocks, indexed by number and by hash.
+
+    Slots live in preallocated parallel lists addressed by `number % capacity`, so a lookup by
+    number is one index and a comparison; the hash index is a dict bounded by the same capacity.
+    Hashes are kept as raw bytes so entries written from hex strings of either form compare equal.
+    """
+
+    def __init__(self, capacity=256):
+        if capacity < 1:
+            raise ValueError("Cache capacity must be positive")
+        self.capacity = capacity
+        self._numbers = [None] * capacity
+        self._hashes = [None] * capacity
+        self._blocks = [None] * capacity
+        self._by_hash = {}
+        self.latest_number = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._by_hash)
+
+    def put(self, block_number, block_hash, block):
+        slot = block_number % self.capacity
+        evicted = self._hashes[slot]
+        if evicted is not None:
+            self._by_hash.pop(evicted, None)
+        key = hash_key(block_hash)
+        self._numbers[slot] = block_number
+        self._hashes[slot] = key
+        self._blocks[slot] = block
+        self._by_hash[key] = block_number
+        if self.latest_number is None or block_number > self.latest_number:
+            self.latest_number = block_number
+
+    def _slot(self, block_number):
+        slot = block_number % self.capacity
+        if self._numbers[slot] == block_number:
+            self.hits += 1
+            return slot
+        self.misses += 1
+        return None
+
+    def get(self, block_number):
+        slot = self._slot(block_number)
+        return None if slot is None else self._blocks[slot]
+
+    def hash_of(self, block_number):
+        slot = self._slot(block_number)
+        return None if slot is None else self._hashes[slot]
+
+    def get_by_hash(self, block_hash):
+        block_number = self._by_hash.get(hash_key(block_hash))
+        if block_number is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._blocks[block_number % self.capacity]
+
+    def invalidate_from(self, block_number):
+        """Drop every cached block at or above `block_number`, e.g. the orphaned side of a reorg."""
+        if self.latest_number is None or block_number > self.latest_number:
+            return
+        for number in range(max(block_number, self.latest_number - self.capacity + 1), self.latest_number + 1):
+            slot = number % self.capacity
+            if self._numbers[slot] == number:
+                self._by_hash.pop(self._hashes[slot], None)
+                self._numbers[slot] = self._hashes[slot] = self._blocks[slot] = None
+        previous = block_number - 1
+        self.latest_number = previous if self._numbers[previous % self.capacity] == previous else None
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -1,63 +1,443 @@
 import asyncio
 import logging
-import time
-from block_validator import BlockInconsistentHashError, validate_block_integrity, BlockCorruptedDataError
+import math
+from block_cache import hash_key
+from block_record import BlockRecord
+from block_validator import BlockInconsistentHashError, validate_record, BlockCorruptedDataError
+from sinks import NdjsonSink, OutputError, SinkPipeline
 logger = logging.getLogger(__name__)
 
 
 class BlockStreamService:
 
-    def __init__(self, provider_manager, last_processed_block_number=None, poll_interval=12):
+    def __init__(self, provider_manager, last_processed_block_number=None, poll_interval=12, max_catchup_window=1,
+                 catchup_batch_size=1, lean_fetch=False, push_heads=False, last_hash=None, checkpoint_store=None,
+                 block_cache=None, confirmations=0, hedge_requests=False, output=None, load_balance=False,
+                 poll_scheduler=None, log_enricher=None, leadership=None):
         self.provider_manager = provider_manager
         self.last_processed_block = last_processed_block_number
-        self.last_hash = None
+        self.last_hash = hash_key(last_hash) if last_hash else None  # raw bytes
         self.last_block_ts = None
+        self.head_block_number = None
+        self.blocks_emitted = 0
         self.running = False
         self.poll_interval = poll_interval
+        self.poll_scheduler = poll_scheduler
+        self.max_catchup_window = max_catchup_window
+        self.catchup_batch_size = catchup_batch_size
+        self.lean_fetch = lean_fetch
+        self.push_heads = push_heads
+        self.checkpoint_store = checkpoint_store
+        self.block_cache = block_cache
+        self.confirmations = confirmations
+        self.hedge_requests = hedge_requests
+        self.load_balance = load_balance
+        self.log_enricher = log_enricher
+        self.leadership = leadership
+        self.seam_mismatches = 0
+        self.output = output if output is not None else SinkPipeline(NdjsonSink())
+        self._new_heads = asyncio.Queue()
+        self._head_watcher = None
+        self._head_watcher_provider = None
+
+    async def run(self):
+        """Stream; with a `leadership`, only while holding the stream's lease, following the leader otherwise."""
+        if self.leadership is None:
+            await self.stream()
+            return
+
+        async def lead():
+            # from here on, commits of the previous leader (an older token) are dropped
+            self.checkpoint_store.fence(self.leadership.lease.token)
+            # resume exactly where the previous leader's last committed checkpoint left off
+            await self.follow_checkpoint()
+            await self.stream()
+
+        await self.leadership.run(lead, self.follow_checkpoint)
 
     async def stream(self):
         logger.info("Starting block stream service")
         self.running = True
-        active_provider = self.provider_manager.active
-
-        while self.running:
-            try:
-                head_block_number = await active_provider.head()
-                if self.last_processed_block is None:
-                    self.last_processed_block = head_block_number
-
-                await self.process_blocks(head_block_number)
-
-            except (BlockInconsistentHashError, BlockCorruptedDataError):
-                logger.error(f"Incorrect hashes detected, searching for consensus head")
-                await self.provider_manager.switch_provider_consensus_based()
-
-            except Exception as e:
-                logger.error(f"Failed to process block {e}")
-                await self.provider_manager.switch_to_healthy_provider()
-            finally:
-                if self.last_block_ts is not None:
-                    await self.provider_manager.record_metrics(time.time() - self.last_block_ts)
+        pushed_head = None
+        await self._seed_cache()
+
+        try:
+            while self.running:
+                head_block_number = None
+                replay = False
+                active_provider = self.provider_manager.active
+                emitted_before = self.blocks_emitted
+                try:
+                    if pushed_head is not None:
+                        head_block_number = pushed_head
+                    else:
+                        head_block_number = await self._call(active_provider, "head")
+                    self.head_block_number = head_block_number
+                    if self.poll_scheduler is not None:
+                        self.poll_scheduler.on_head(head_block_number)
+                    target_block_number = head_block_number - self.confirmations
+                    if self.last_processed_block is None:
+                        self.last_processed_block = target_block_number
+
+                    await self.process_blocks(target_block_number)
+                    await self.provider_manager.report_success(active_provider)
+
+                except BlockInconsistentHashError:
+                    logger.error(f"Parent hash mismatch at block {self.last_processed_block + 1}, checking for a reorg")
+                    replay = await self._handle_reorg()
+                    if not replay:
+                        logger.error("No common ancestor in recent blocks, searching for consensus head")
+                        await self.provider_manager.switch_provider_consensus_based()
+
+                except BlockCorruptedDataError:
+                    logger.error(f"Incorrect hashes detected, searching for consensus head")
+                    await self.provider_manager.switch_provider_consensus_based()
+
+                except OutputError as e:
+                    # not the provider's fault: the unwritten records are retried on the next round
+                    logger.error(f"Failed to write blocks {e}")
+
+                except Exception as e:
+                    logger.error(f"Failed to process block {e}")
+                    await self.provider_manager.switch_to_healthy_provider()
+                finally:
+                    # head lag, not block age: emitted blocks trail the head by the confirmation depth
+                    await self.provider_manager.record_metrics(active_provider, head_block_number)
+                # after a rewind, re-stream the canonical branch right away
+                pushed_head = (
+                    head_block_number if replay
+                    else await self._wait_for_next_head(catching_up=self.blocks_emitted - emitted_before > 1)
+                )
+        finally:
+            self._stop_head_watcher()
+            await self.output.stop()
+
+    async def _seed_cache(self):
+        """Cache the block a restart resumes from, so a reorg of it can be walked back straight away."""
+        cache = self.block_cache
+        if cache is None or self.last_hash is None or cache.hash_of(self.last_processed_block) == self.last_hash:
+            return
+        try:
+            record = await self.provider_manager.active.get_block_record_by_hash("0x" + self.last_hash.hex())
+        except Exception as e:
+            logger.warning(f"Failed to fetch checkpointed block {self.last_processed_block} {e}")
+            return
+        cache.put(record.number, record.hash, record)
+
+    async def follow_checkpoint(self):
+        """Standby side of active/standby: adopt the leader's last committed checkpoint.
+
+        A standby never commits, so anything this instance buffered while it last led is dropped.
+        The blocks up to the checkpoint are fetched into the recent-block cache (at most its
+        capacity, and only what it doesn't hold yet), which keeps the active provider's connection
+        warm and lets a takeover handle a reorg straight away; a range that doesn't end in the
+        checkpoint's hash is not cached.
+        """
+        store = self.checkpoint_store
+        store.discard()
+        checkpoint = store.load()
+        if checkpoint is None:
+            return
+        block_number, block_hash = checkpoint.block_number, hash_key(checkpoint.block_hash)
+        if block_number == self.last_processed_block and block_hash == self.last_hash:
+            return
+        cache = self.block_cache
+        start = None
+        if cache is not None:
+            # blocks this instance emitted past the checkpoint are not the leader's
+            cache.invalidate_from(block_number + 1)
+            if cache.hash_of(block_number) != block_hash:
+                start = max(block_number - cache.capacity + 1, 0)
+                if self.last_processed_block is not None and self.last_processed_block < block_number \
+                        and cache.hash_of(self.last_processed_block) == self.last_hash:
+                    start = max(start, self.last_processed_block + 1)
+        self.last_processed_block = block_number
+        self.last_hash = block_hash
+        if start is None:
+            return
+        try:
+            records = [self._to_record(block) for block in
+                       await self._fetch_range(self.provider_manager.active, start, block_number)]
+        except Exception as e:
+            logger.warning(f"Failed to fetch blocks {start}-{block_number} behind the leader's checkpoint {e}")
+            return
+        if records[-1].hash != block_hash:
+            return
+        for record in records:
+            cache.put(record.number, record.hash, record)
+        self.last_block_ts = records[-1].timestamp
+        if self.poll_scheduler is not None:
+            self.poll_scheduler.on_block(block_number, self.last_block_ts)
+
+    async def _handle_reorg(self):
+        """Rewind to the common ancestor of the emitted chain and the active provider's chain.
+
+        Orphaned blocks are retracted newest first, and the next process_blocks call re-streams the
+        canonical branch from the ancestor. Returns False when there is no recent-block cache or the
+        fork is deeper than it, in which case the provider rather than the chain is suspect.
+        """
+        if self.block_cache is None:
+            return False
+        try:
+            found = await self._find_common_ancestor(self.provider_manager.active)
+        except Exception as e:
+            logger.error(f"Failed to walk back to common ancestor {e}")
+            return False
+        if found is None:
+            return False
+        await self._rewind_to(*found)
+        return True
+
+    async def _find_common_ancestor(self, provider):
+        """Walk back from the last emitted block to the newest block the provider's chain shares.
+
+        Our side of each height is the parent hash named by our block above it, read from the
+        recent-block cache or, where the cache doesn't hold it (e.g. right after a restart),
+        fetched by hash, which nodes still serve for orphaned blocks. Returns the ancestor's record
+        and the orphaned (number, hash) pairs newest first, or None if the fork is deeper than the
+        cache's capacity.
+        """
+        cache = self.block_cache
+        lowest = max(self.last_processed_block - cache.capacity + 1, 0)
+        high = self.last_processed_block
+        ours = self.last_hash
+        orphans = []
+        while high >= lowest:
+            low = max(high - self.catchup_batch_size + 1, lowest)
+            blocks = await self._fetch_range(provider, low, high)
+            for block in reversed(blocks):
+                record = self._to_record(block)
+                if record.hash == ours:
+                    return record, orphans
+                orphans.append((record.number, ours))
+                orphan = cache.get(record.number)
+                if orphan is None or orphan.hash != ours:
+                    orphan = await provider.get_block_record_by_hash("0x" + ours.hex())
+                ours = orphan.parentHash
+            high = low - 1
+        return None
+
+    async def _rewind_to(self, ancestor, orphans):
+        for block_number, block_hash in orphans:
+            await self.output.put({"event": "retract", "number": block_number, "hash": "0x" + block_hash.hex()})
+        self.block_cache.invalidate_from(ancestor.number + 1)
+        if self.block_cache.hash_of(ancestor.number) != ancestor.hash:
+            self.block_cache.put(ancestor.number, ancestor.hash, ancestor)
+        self.last_processed_block = ancestor.number
+        self.last_hash = ancestor.hash
+        self.last_block_ts = ancestor.timestamp
+        if self.poll_scheduler is not None:
+            self.poll_scheduler.on_block(ancestor.number, self.last_block_ts)
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.record(self.last_processed_block, self.last_hash)
+        await self._commit_checkpoint()
+        logger.warning(f"Reorg of depth {len(orphans)} detected, rewound to common ancestor {ancestor.number}")
+
+    @property
+    def new_heads_depth(self):
+        return self._new_heads.qsize()
+
+    async def _wait_for_next_head(self, catching_up=False):
+        """Wait for the next iteration: a newHeads push when subscribed, else the poll interval.
+
+        Returns the pushed head number, or None when the caller should poll head() itself. While the
+        subscription is down this degrades to plain polling; any heads missed meanwhile are fetched by
+        process_blocks as the gap between last_processed_block and the next head. With a poll
+        scheduler the sleep is its predicted delay, and it is skipped after a catch-up iteration,
+        since more blocks have likely arrived while it ran.
+        """
+        if not self._ensure_head_watcher():
+            if self.poll_scheduler is None:
                 await asyncio.sleep(self.poll_interval)
+            elif not catching_up:
+                await asyncio.sleep(self.poll_scheduler.next_delay())
+            return None
+        try:
+            head_block_number = await asyncio.wait_for(self._new_heads.get(), self.poll_interval)
+        except asyncio.TimeoutError:
+            return None
+        while not self._new_heads.empty():
+            head_block_number = max(head_block_number, self._new_heads.get_nowait())
+        return head_block_number
+
+    def _ensure_head_watcher(self):
+        if not self.push_heads:
+            return False
+        provider = self.provider_manager.active
+        if provider.ws_url is None:
+            self._stop_head_watcher()
+            return False
+        if self._head_watcher is not None:
+            if not self._head_watcher.done() and self._head_watcher_provider is provider:
+                return True
+            if self._head_watcher.done():
+                self._log_head_watcher_exit(self._head_watcher)
+        # (re)subscribe; if the socket is still down this iteration simply times out into a poll
+        self._stop_head_watcher()
+        self._head_watcher_provider = provider
+        self._head_watcher = asyncio.create_task(provider.watch_new_heads(self._new_heads))
+        return True
+
+    def _stop_head_watcher(self):
+        if self._head_watcher is not None:
+            self._head_watcher.cancel()
+            self._head_watcher = None
+
+    @staticmethod
+    def _log_head_watcher_exit(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"newHeads subscription failed, polling until it reconnects: {task.exception()}")
+        else:
+            logger.warning("newHeads subscription ended, polling until it reconnects")
 
     async def process_blocks(self, head_block_number):
-        for _ in range(head_block_number - self.last_processed_block):
-            block = await self.provider_manager.active.get_block(self.last_processed_block + 1)
-            serialize_data = self._serialize_block(block)
-            if validate_block_integrity(serialize_data, self.last_hash):
+        try:
+            pipelined = self.max_catchup_window > 1 or self.catchup_batch_size > 1
+            if pipelined and head_block_number - self.last_processed_block > 1:
+                await self._catch_up(head_block_number)
+                return
+            for _ in range(head_block_number - self.last_processed_block):
+                block = await self._fetch_block(self.provider_manager.active, self.last_processed_block + 1)
+                if self.log_enricher is not None:
+                    block, = await self._enrich(self.provider_manager.active, [block])
+                await self._emit_block(block)
+        finally:
+            await self._commit_checkpoint()
+
+    async def _catch_up(self, head_block_number):
+        """Keep a window of block-range fetches in flight and emit the results strictly in order.
+
+        Each fetch covers up to `catchup_batch_size` blocks and goes out as one JSON-RPC batch.
+        Completed fetches wait in `in_flight` (the reorder buffer) until every lower block has
+        been validated and emitted, so the parent-hash chain is checked exactly as in serial mode.
+        With `load_balance`, ranges are spread over all healthy providers by
+        `ProviderManager.fetch_provider`, and the window is the sum of their windows.
+        """
+        if self.load_balance:
+            providers = self.provider_manager.fetch_providers()
+            pick = self.provider_manager.fetch_provider
+        else:
+            providers = [self.provider_manager.active]
+            pick = lambda: providers[0]
+        next_to_fetch = self.last_processed_block + 1
+        in_flight = {}
+        previous_source = None
+        try:
+            while self.last_processed_block < head_block_number:
+                window = self._catchup_window(providers)
+                while next_to_fetch <= head_block_number and len(in_flight) < window:
+                    range_end = min(next_to_fetch + self.catchup_batch_size - 1, head_block_number)
+                    in_flight[next_to_fetch] = asyncio.create_task(
+                        self._fetch_assigned_range(pick(), next_to_fetch, range_end)
+                    )
+                    next_to_fetch = range_end + 1
+                source, blocks = await in_flight.pop(self.last_processed_block + 1)
+                if previous_source is not None and source is not previous_source:
+                    source, blocks = await self._check_seam(previous_source, source, blocks)
+                for block in blocks:
+                    await self._emit_block(block)
+                previous_source = source
+                # buffered ranges complete without suspending; yield so other chains on the loop get a turn
+                await asyncio.sleep(0)
+        finally:
+            for task in in_flight.values():
+                task.cancel()
+            await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+    async def _fetch_assigned_range(self, provider, start, end):
+        """Fetch a range from its assigned provider, falling back to the active one if that fails."""
+        try:
+            return provider, await self._fetch_output_range(provider, start, end)
+        except Exception as e:
+            active = self.provider_manager.active
+            if provider is active:
+                raise
+            logger.warning(f"Fetching blocks {start}-{end} from {provider.name} failed ({e}), retrying on {active.name}")
+            return active, await self._fetch_output_range(active, start, end)
+
+    async def _check_seam(self, previous_source, source, blocks):
+        """Check that a range from one provider extends the chain served by the previous one.
+
+        On a mismatch the range is fetched again from the previous provider; if its copy doesn't
+        connect either, validation raises as usual and reorg handling takes over.
+        """
+        first = self._to_record(blocks[0])
+        if self.last_hash is None or first.parentHash == self.last_hash:
+            return source, blocks
+        self.seam_mismatches += 1
+        start, end = first.number, first.number + len(blocks) - 1
+        logger.warning(
+            f"Blocks {start}-{end} from {source.name} don't extend the chain from {previous_source.name}, "
+            f"refetching from {previous_source.name}"
+        )
+        return previous_source, await self._fetch_output_range(previous_source, start, end)
+
+    async def _call(self, provider, method, *args):
+        if self.hedge_requests:
+            return await self.provider_manager.hedged(provider, method, *args)
+        return await getattr(provider, method)(*args)
+
+    async def _fetch_block(self, provider, block_number):
+        return await self._call(provider, "get_block_record" if self.lean_fetch else "get_block", block_number)
+
+    async def _fetch_range(self, provider, start, end):
+        if start == end:
+            return [await self._fetch_block(provider, start)]
+        # not hedged: a backup range would cost the whole batch's compute units again
+        if self.lean_fetch:
+            return await provider.get_block_records(start, end)
+        return await provider.get_blocks(start, end)
+
+    async def _fetch_output_range(self, provider, start, end):
+        """_fetch_range for blocks about to be emitted: with a log enricher, as records carrying their logs."""
+        blocks = await self._fetch_range(provider, start, end)
+        if self.log_enricher is None:
+            return blocks
+        return await self._enrich(provider, blocks)
+
+    async def _enrich(self, provider, blocks):
+        return await self.log_enricher.enrich(provider, [self._to_record(block) for block in blocks])
+
+    def _catchup_window(self, providers):
+        # Little's law: sustaining max_rate_per_sec requests/s at the observed latency needs
+        # rate * latency requests in flight; more would only queue on the provider's rate limiter.
+        window = 0
+        for provider in providers:
+            budget = provider.max_rate_per_sec
+            latency = provider.get_average_latency()
+            window += min(math.ceil(budget * latency) if latency else budget, budget)
+        return max(1, min(window, self.max_catchup_window))
+
+    async def _emit_block(self, block):
+        record = self._to_record(block)
+        if validate_record(record, self.last_hash):
+
+            await self.output.put(record)
+            self.blocks_emitted += 1
+            self.last_processed_block += 1
+            self.last_hash = record.hash
+            self.last_block_ts = record.timestamp
+            if self.poll_scheduler is not None:
+                self.poll_scheduler.on_block(self.last_processed_block, self.last_block_ts)
+            if self.block_cache is not None:
+                self.block_cache.put(self.last_processed_block, self.last_hash, record)
+            if self.checkpoint_store is not None:
+                self.checkpoint_store.record(self.last_processed_block, self.last_hash)
+                if self.checkpoint_store.commit_due:
+                    await self._commit_checkpoint()
 
-                print(serialize_data)
-                self.last_processed_block += 1
-                self.last_hash = serialize_data['hash']
-                self.last_block_ts = serialize_data['timestamp']
-        return
+    async def _commit_checkpoint(self):
+        # emitted output must reach the sink before the checkpoint that covers it is stored
+        await self.output.flush()
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.flush()
 
     @staticmethod
-    def _serialize_block(block):
-        return {
-            "number": block.number,
-            "hash": block.hash.hex(),
-            "parentHash": block.parentHash.hex(),
-            "timestamp": block.timestamp,
-            "tx_count": len(block.transactions),
-        }
+    def _to_record(block):
+        if isinstance(block, BlockRecord):
+            return block
+        try:
+            return BlockRecord.from_block(block)
+        except ValueError as e:
+            logger.error(f"Undecodable hash in block {block.number}: {e}")
+            raise BlockCorruptedDataError from e
@@ -0,0 +1,125 @@
+import logging
+import sqlite3
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(NamedTuple):
+    block_number: int
+    block_hash: str
+
+
+class CheckpointStore:
+    """Persists the last emitted block so a restart resumes where the previous run stopped.
+
+    `record` is called after every emitted block and only buffers it; once `commit_due` (after
+    `commit_every_blocks` blocks or `commit_interval_s` seconds: group commit) the caller flushes
+    its output and then calls `flush`. A stored checkpoint therefore never runs ahead of emitted
+    data, so a crash can only cause re-emission, never a gap.
+
+    Under a lease, `fence` sets the lease's fencing token: a commit carrying an older token than
+    the stored checkpoint's is dropped, so a deposed leader cannot overwrite its successor's.
+    """
+
+    def __init__(self, commit_every_blocks=100, commit_interval_s=1.0):
+        self.commit_every_blocks = commit_every_blocks
+        self.commit_interval_s = commit_interval_s
+        self.fencing_token = 0
+        self._pending = None
+        self._pending_count = 0
+        self._last_commit = time.monotonic()
+
+    def load(self):
+        raise NotImplementedError
+
+    def _commit(self, checkpoint):
+        """Store `checkpoint` unless a commit with a newer fencing token got there first; False if so."""
+        raise NotImplementedError
+
+    def fence(self, token):
+        """Commit with fencing token `token` from now on, and drop commits of older tokens."""
+        self.fencing_token = token
+
+    def close(self):
+        self.flush()
+
+    def record(self, block_number, block_hash):
+        # raw hashes are kept as given and only hex-encoded when a commit is due
+        self._pending = Checkpoint(block_number, block_hash)
+        self._pending_count += 1
+
+    def discard(self):
+        """Drop the buffered checkpoint unstored, e.g. once another instance has taken over the stream."""
+        self._pending = None
+        self._pending_count = 0
+
+    @property
+    def commit_due(self):
+        return self._pending is not None and (
+            self._pending_count >= self.commit_every_blocks
+            or time.monotonic() - self._last_commit >= self.commit_interval_s
+        )
+
+    def flush(self):
+        if self._pending is None:
+            return
+        checkpoint = self._pending
+        if isinstance(checkpoint.block_hash, bytes):
+            checkpoint = checkpoint._replace(block_hash="0x" + checkpoint.block_hash.hex())
+        if not self._commit(checkpoint):
+            logger.warning(f"Checkpoint at block {checkpoint.block_number} dropped: fencing token "
+                           f"{self.fencing_token} is stale, another instance has taken over the stream")
+        self._pending = None
+        self._pending_count = 0
+        self._last_commit = time.monotonic()
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Default store: one row per stream in a local SQLite database."""
+
+    def __init__(self, path, stream="default", commit_every_blocks=100, commit_interval_s=1.0):
+        super().__init__(commit_every_blocks, commit_interval_s)
+        self.stream = stream
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "stream TEXT PRIMARY KEY, block_number INTEGER NOT NULL, block_hash TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, token INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(checkpoints)")}
+        if "token" not in columns:  # a database from before fencing
+            self._db.execute("ALTER TABLE checkpoints ADD COLUMN token INTEGER NOT NULL DEFAULT 0")
+        self._db.commit()
+
+    def load(self):
+        row = self._db.execute(
+            "SELECT block_number, block_hash FROM checkpoints WHERE stream = ?", (self.stream,)
+        ).fetchone()
+        return Checkpoint(*row) if row else None
+
+    def _commit(self, checkpoint):
+        with self._db:
+            # the token check and the write are one statement, so a successor's fence can't slip in between
+            cursor = self._db.execute(
+                "INSERT INTO checkpoints (stream, block_number, block_hash, updated_at, token) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(stream) DO UPDATE SET block_number = excluded.block_number, "
+                "block_hash = excluded.block_hash, updated_at = excluded.updated_at, token = excluded.token "
+                "WHERE checkpoints.token <= excluded.token",
+                (self.stream, checkpoint.block_number, checkpoint.block_hash, time.time(), self.fencing_token),
+            )
+        return cursor.rowcount > 0
+
+    def fence(self, token):
+        super().fence(token)
+        with self._db:
+            self._db.execute(
+                "UPDATE checkpoints SET token = ? WHERE stream = ? AND token < ?", (token, self.stream, token)
+            )
+
+    def close(self):
+        super().close()
+        self._db.close()
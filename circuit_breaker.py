@@ -0,0 +1,85 @@
+import random
+import time
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one provider.
+
+    `failure_threshold` consecutive failures open it for a cool-down that doubles on every trip
+    (up to `max_cooldown_s`) with +/-`jitter` spread, so providers that fail together don't
+    come back in lockstep. Once the cool-down has passed it is half-open: `allow_request`
+    admits a single probe, whose outcome closes the breaker or opens it again for longer.
+    All checks are O(1).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, base_cooldown_s=1.0, max_cooldown_s=60.0, jitter=0.2,
+                 clock=time.monotonic, rng=random.random):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown_s = base_cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.jitter = jitter
+        self.trips = 0  # consecutive trips; reset when a request succeeds
+        self._clock = clock
+        self._rng = rng
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and self._clock() >= self._open_until:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    @property
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    @property
+    def ready_in(self):
+        """Seconds until the breaker half-opens; 0.0 unless open."""
+        if self.state != self.OPEN:
+            return 0.0
+        return self._open_until - self._clock()
+
+    def allow_request(self):
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self._state = self.CLOSED
+        self._failures = 0
+        self.trips = 0
+        self._probing = False
+
+    def record_failure(self):
+        state = self.state
+        if state == self.OPEN:
+            return  # stragglers sent before the trip don't extend the cool-down
+        self._failures += 1
+        if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        self.trips += 1
+        cooldown = min(self.max_cooldown_s, self.base_cooldown_s * 2 ** (self.trips - 1))
+        cooldown *= 1 + self.jitter * (2 * self._rng() - 1)
+        self._open_until = self._clock() + cooldown
+        self._state = self.OPEN
+        self._failures = 0
+        self._probing = False
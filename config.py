@@ -1,6 +1,7 @@
 # config.py
 from __future__ import annotations
 
+import logging
 import os
 import pathlib
 import yaml
@@ -12,6 +13,8 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class ProviderConfig:
@@ -20,7 +23,12 @@ class ProviderConfig:
     name: str
     url: str
     timeout_s: float = 8.0
-    window_s: int = 60  # sliding window for health metrics
+    window_s: int = 60  # sliding window for request latency and error scoring
+    max_batch_size: int = 100  # most calls the provider accepts in one JSON-RPC batch
+    ws_url: str | None = None  # optional WebSocket endpoint for newHeads subscriptions
+    max_rate_per_sec: float = 10.0  # request budget (token bucket)
+    compute_units_per_sec: float | None = None  # optional compute-unit budget, e.g. 330 on Alchemy's free tier
+    compute_units: dict = field(default_factory=dict)  # per-method cost overrides, see rate_limiter.DEFAULT_COMPUTE_UNITS
 
     @classmethod
     def from_dict(cls, data: dict) -> "ProviderConfig":
@@ -33,6 +41,9 @@ class ProviderConfig:
         elif 'url' in data:
             # Also substitute in regular URL field
             data['url'] = cls._substitute_env_vars(data['url'])
+        if 'ws_url_template' in data:
+            data = {**data, 'ws_url': cls._substitute_env_vars(data['ws_url_template'])}
+            data.pop('ws_url_template', None)
 
         return cls(**data)
 
@@ -51,27 +62,143 @@ class ProviderConfig:
         return re.sub(r'\$\{([^}]+)\}', replace_var, template)
 
 
+@dataclass
+class OutputConfig:
+    """Where emitted blocks go; `type` is one of stdout, file, rotating_file, tcp, unix."""
+
+    type: str = "stdout"
+    format: str = "ndjson"  # or "binary": fixed-width 85-byte records, see block_record.WIRE_FORMAT
+    path: str | None = None
+    host: str | None = None
+    port: int | None = None
+    max_bytes: int = 100 * 1024 * 1024  # rotating_file only
+    backup_count: int = 5  # rotating_file only
+    queue_size: int = 1024  # records buffered before the fetcher is slowed down
+    batch_size: int = 256
+    flush_interval_s: float = 0.1
+
+
+@dataclass
+class SubscriptionConfig:
+    """Local TCP server fanning the output out to subscribers (see subscription_server.SubscriptionServer)."""
+
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9200  # give each chain its own
+    buffer_size: int = 4096  # records queued per subscriber before slow_consumer applies
+    slow_consumer: str = "disconnect"  # or "drop_oldest"
+    replay_size: int = 10_000  # recent records kept for subscribers resuming from a block number
+
+
+@dataclass
+class LogEnrichmentConfig:
+    """Logs attached to every emitted block (see log_enrichment.LogEnricher); needs the ndjson output format."""
+
+    enabled: bool = False
+    addresses: List[str] = field(default_factory=list)  # contract addresses; empty matches any contract
+    topics: list = field(default_factory=list)  # positional as in eth_getLogs: null, a topic, or a list of topics
+    events: List[str] = field(default_factory=list)  # signatures such as "Transfer(address,address,uint256)" for topic0
+
+
+@dataclass
+class HttpConfig:
+    """Process-wide HTTP connection pool shared by all providers (see http_pool.HttpSessionPool)."""
+
+    limit_per_host: int = 32
+    keepalive_timeout_s: float = 60.0  # keep above probe_interval_s so idle providers stay warm
+    dns_cache_ttl_s: int = 300
+    warm_connections: int = 2  # opened to every provider at startup
+    gzip: bool = True
+
+
+@dataclass
+class LeaseConfig:
+    """Active/standby between instances sharing checkpoint_path: only the lease holder streams (see lease_coordinator.Leadership)."""
+
+    enabled: bool = False
+    path: str = "lease.sqlite"  # SQLite database every instance opens
+    holder: str | None = None  # this instance's name in the lease; None: hostname:pid
+    ttl_s: float | None = None  # None: half of expected_block_time, so a standby takes over within one block
+
+
 @dataclass
 class AppConfig:
     chain_id: int = 1
     expected_block_time: int = 12
-    poll_interval_s: float = 2.0
+    poll_interval_s: float = 2.0  # fixed poll period when adaptive_polling is off
+    adaptive_polling: bool = True  # poll around each block's predicted arrival instead
+    min_poll_interval_s: float = 0.25  # poll period while a block is due
     start_confirmations: int = 0
     providers: List[ProviderConfig] = field(default_factory=list)
     lag_threshold_s: int = 30
     failure_ratio: float = 0.2
-    score_halflife_s: int = 60
+    score_window_s: int = 60  # sliding window for head staleness
+    latency_threshold_s: float = 1.0  # head() p95 that weighs as much in a provider's score as lag_threshold_s of lag
+    score_hysteresis: float = 0.2  # relative score margin needed to reorder providers or to become healthy again
+    catchup_window: int = 16
+    catchup_batch_size: int = 50
+    lean_fetch: bool = True
+    push_heads: bool = True
+    checkpoint_path: str | None = "checkpoint.sqlite"  # None disables resuming
+    checkpoint_every_blocks: int = 100
+    checkpoint_interval_s: float = 1.0
+    block_cache_size: int = 256
+    hedge_requests: bool = False
+    load_balance_catchup: bool = False  # spread catch-up range fetches over all healthy providers
+    hedge_budget_per_minute: int = 60
+    probe_interval_s: float = 15.0
+    breaker_failure_threshold: int = 3  # consecutive failures that open a provider's circuit breaker
+    breaker_base_cooldown_s: float = 1.0  # first open period; doubles on every consecutive trip
+    breaker_max_cooldown_s: float = 60.0
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int | None = 9100  # /metrics and /health; None disables the HTTP server
+    output: OutputConfig = field(default_factory=OutputConfig)
+    subscriptions: SubscriptionConfig = field(default_factory=SubscriptionConfig)
+    log_enrichment: LogEnrichmentConfig = field(default_factory=LogEnrichmentConfig)
+    http: HttpConfig = field(default_factory=HttpConfig)
+    lease: LeaseConfig = field(default_factory=LeaseConfig)
 
     @classmethod
     def load(cls, path: str | pathlib.Path | None = None) -> "AppConfig":
         """Load configuration from YAML file with environment variable substitution."""
+        return cls.load_chains(path)[0]
+
+    @classmethod
+    def load_chains(cls, path: str | pathlib.Path | None = None) -> List["AppConfig"]:
+        """Load one AppConfig per entry of the optional `chains` list.
+
+        Top-level keys are defaults for every chain; each entry overrides them (typically
+        chain_id, providers, poll_interval_s, expected_block_time and output). Without a
+        `chains` list the file describes a single chain.
+        """
         path = path or os.environ.get("APP_CONFIG", "config.yaml")
 
         with open(path, "r", encoding="utf-8") as fh:
             raw = yaml.safe_load(fh)
 
+        chains = raw.pop("chains", None)
+        if not chains:
+            return [cls._from_raw(raw)]
+        configs = [cls._from_raw({**raw, **chain}) for chain in chains]
+        chain_ids = [cfg.chain_id for cfg in configs]
+        if len(set(chain_ids)) != len(chain_ids):
+            raise ValueError(f"Duplicate chain_id in chains: {chain_ids}")
+        return configs
+
+    @classmethod
+    def _from_raw(cls, raw: dict) -> "AppConfig":
+        raw = dict(raw)
         # Create providers with environment variable substitution
         providers = [ProviderConfig.from_dict(p) for p in raw.pop("providers")]
+        output = OutputConfig(**(raw.pop("output", None) or {}))
+        subscriptions = SubscriptionConfig(**(raw.pop("subscriptions", None) or {}))
+        log_enrichment = LogEnrichmentConfig(**(raw.pop("log_enrichment", None) or {}))
+        http = HttpConfig(**(raw.pop("http", None) or {}))
+        lease = LeaseConfig(**(raw.pop("lease", None) or {}))
+        if 'score_halflife_s' in raw or 'SCORE_HALFLIFE_S' in os.environ:
+            # the decaying score averages gave way to a sliding window; its length is the closest equivalent
+            logger.warning("score_halflife_s (SCORE_HALFLIFE_S) is deprecated, use score_window_s (SCORE_WINDOW_S)")
+            raw.setdefault('score_window_s', os.getenv('SCORE_HALFLIFE_S', raw.pop('score_halflife_s', 60)))
 
         # Override other settings from environment variables if available
         config_data = {
@@ -79,8 +206,13 @@ class AppConfig:
             'expected_block_time': int(os.getenv('EXPECTED_BLOCK_TIME', raw.get('expected_block_time', 12))),
             'lag_threshold_s': int(os.getenv('LAG_THRESHOLD_S', raw.get('lag_threshold_s', 30))),
             'failure_ratio': float(os.getenv('FAILURE_RATIO', raw.get('failure_ratio', 0.2))),
-            'score_halflife_s': int(os.getenv('SCORE_HALFLIFE_S', raw.get('score_halflife_s', 60))),
+            'score_window_s': int(os.getenv('SCORE_WINDOW_S', raw.get('score_window_s', 60))),
+            'catchup_window': int(os.getenv('CATCHUP_WINDOW', raw.get('catchup_window', 16))),
+            'catchup_batch_size': int(os.getenv('CATCHUP_BATCH_SIZE', raw.get('catchup_batch_size', 50))),
+            'checkpoint_path': os.getenv('CHECKPOINT_PATH', raw.get('checkpoint_path', 'checkpoint.sqlite')),
+            'metrics_port': int(os.environ['METRICS_PORT']) if 'METRICS_PORT' in os.environ else raw.get('metrics_port', 9100),
             **raw  # Include any other YAML settings
         }
 
-        return cls(providers=providers, **config_data)
\ No newline at end of file
+        return cls(providers=providers, output=output, subscriptions=subscriptions, log_enrichment=log_enrichment,
+                   http=http, lease=lease, **config_data)
\ No newline at end of file
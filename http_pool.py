@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+def host_key(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port
+
+
+class HttpSessionPool:
+    """Keep-alive aiohttp sessions shared by every ProviderClient, one per (scheme, host, port).
+
+    Providers on the same host (e.g. one vendor's endpoints for several chains) share a session
+    and its connection pool, capped at `limit_per_host` connections. `warm_up` opens
+    `warm_connections` connections to every provider at startup so that failing over to an idle
+    provider doesn't pay TCP and TLS handshakes; `keepalive_timeout_s` should exceed the idle
+    probe interval so probes keep those connections open.
+    """
+
+    def __init__(self, limit_per_host=32, keepalive_timeout_s=60.0, dns_cache_ttl_s=300, warm_connections=2,
+                 gzip=True, ssl_context=None):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout_s = keepalive_timeout_s
+        self.dns_cache_ttl_s = dns_cache_ttl_s
+        self.warm_connections = warm_connections
+        self.gzip = gzip
+        self.ssl_context = ssl_context
+        self._sessions = {}
+
+    def session_for(self, url):
+        key = host_key(url)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout_s,
+                ttl_dns_cache=self.dns_cache_ttl_s,
+                ssl=self.ssl_context if self.ssl_context is not None else True,
+            )
+            # aiohttp decompresses gzip/deflate responses itself; identity skips that CPU on fast links
+            headers = {"Accept-Encoding": "gzip, deflate" if self.gzip else "identity"}
+            session = aiohttp.ClientSession(connector=connector, headers=headers, raise_for_status=True)
+            self._sessions[key] = session
+        return session
+
+    async def attach(self, client):
+        await client.use_session(self.session_for(client.url))
+
+    async def warm_up(self, clients):
+        """Open `warm_connections` keep-alive connections to each client's endpoint concurrently."""
+        requests = [
+            self._warm(client) for client in clients for _ in range(self.warm_connections)
+        ]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        if failed:
+            logger.warning(f"{failed} of {len(results)} warm-up connections failed")
+
+    async def _warm(self, client):
+        # a cheap call outside ProviderClient._timed, so warm-up doesn't touch scores or rate limits
+        body = {"jsonrpc": "2.0", "id": 0, "method": "eth_chainId", "params": []}
+        async with self.session_for(client.url).post(client.url, json=body) as response:
+            await response.read()
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in self._sessions.values()))
+        self._sessions.clear()
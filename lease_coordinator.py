@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """The lease could not be kept, so the work done under it was cancelled."""
+
+
+class Lease(NamedTuple):
+    name: str
+    holder: str
+    expires_at: float  # wall-clock seconds, as every instance sees the same time
+    token: int  # fencing token: grows with every change of holder; stores fence writes with it
+
+
+def default_holder():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseCoordinator:
+    """Named leases, each held by at most one instance until it expires.
+
+    `acquire` takes a free or expired lease, or renews one this instance holds, for `ttl_s`
+    seconds. `hold` runs work under a lease, renewing it every `renew_interval_s` (a third of
+    the TTL, so two renewals may fail in a row) and cancelling the work before the lease can
+    expire if it cannot be renewed. Backends implement acquire, release and current; they may
+    block, so the async side runs acquire and release in a worker thread.
+    """
+
+    def __init__(self, holder=None, ttl_s=6.0, clock=time.time):
+        self.holder = holder or default_holder()
+        self.ttl_s = ttl_s
+        self.renew_interval_s = ttl_s / 3
+        self._clock = clock
+
+    def acquire(self, name):
+        """Take or renew lease `name`; None while another holder's lease on it is unexpired."""
+        raise NotImplementedError
+
+    def release(self, name):
+        """Give lease `name` up now if this instance holds it, so another can take it without waiting."""
+        raise NotImplementedError
+
+    def current(self, name):
+        """The unexpired lease on `name`, or None."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def hold(self, name, work):
+        """Await `work` while holding lease `name` (already acquired), then release it.
+
+        Raises LeaseLost, after cancelling `work`, once another holder has the lease or it has
+        gone unrenewed for ttl_s - renew_interval_s, which stops the work before the lease
+        expires for the others.
+        """
+        task = asyncio.ensure_future(work)
+        renewed = self._clock()
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.renew_interval_s)
+                if done:
+                    return task.result()
+                attempted = self._clock()
+                try:
+                    lease = await asyncio.to_thread(self.acquire, name)
+                except Exception as e:
+                    logger.warning(f"Failed to renew lease {name} {e}")
+                else:
+                    if lease is None:
+                        raise LeaseLost(f"Lease {name} was taken by another holder")
+                    renewed = attempted
+                if self._clock() - renewed >= self.ttl_s - self.renew_interval_s:
+                    raise LeaseLost(f"Lease {name} could not be renewed for {self._clock() - renewed:.1f}s")
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            try:
+                await asyncio.to_thread(self.release, name)
+            except Exception as e:
+                logger.warning(f"Failed to release lease {name} {e}")
+
+
+class SQLiteLeaseCoordinator(LeaseCoordinator):
+    """Leases in a SQLite database shared by instances on one host, e.g. next to the checkpoint.
+
+    Every acquire is one IMMEDIATE transaction, so SQLite's file lock serialises concurrent
+    claims. Releasing only expires a lease, keeping its row and so its fencing token. Calls come
+    from worker threads, one at a time on the shared connection.
+    """
+
+    def __init__(self, path, holder=None, ttl_s=6.0, clock=time.time):
+        super().__init__(holder, ttl_s, clock)
+        # transactions are opened explicitly; a busy database is waited on for at most a renewal
+        self._db = sqlite3.connect(path, timeout=self.renew_interval_s, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL, token INTEGER NOT NULL)"
+        )
+
+    def acquire(self, name):
+        with self._lock:
+            return self._acquire(name)
+
+    def _acquire(self, name):
+        self._db.execute("BEGIN IMMEDIATE")  # waits for a concurrent claim to commit
+        try:
+            now = self._clock()
+            row = self._db.execute("SELECT holder, expires_at, token FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                token = 1
+            elif row[0] == self.holder:
+                token = row[2]
+            elif row[1] > now:
+                self._db.execute("COMMIT")
+                return None
+            else:
+                token = row[2] + 1
+            lease = Lease(name, self.holder, now + self.ttl_s, token)
+            self._db.execute(
+                "INSERT INTO leases (name, holder, expires_at, token) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at, "
+                "token = excluded.token",
+                lease,
+            )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return lease
+
+    def release(self, name):
+        with self._lock:
+            self._db.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND holder = ? AND expires_at > ?",
+                (self._clock(), name, self.holder, self._clock()),
+            )
+
+    def current(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, holder, expires_at, token FROM leases WHERE name = ? AND expires_at > ?",
+                (name, self._clock()),
+            ).fetchone()
+        return Lease(*row) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Leadership:
+    """Active/standby between instances running the same stream under lease `name`.
+
+    `run(lead, follow)` calls `lead()` only while this instance holds the lease. Otherwise it
+    awaits `follow()` every renew interval (a standby keeping warm) and tries to take the lease,
+    so a standby takes over at most ttl_s + renew_interval_s after the leader stopped renewing,
+    or one renew interval after it released the lease on a clean shutdown. A leader that loses
+    the lease has `lead` cancelled and goes back to following. Returns what `lead` returned.
+    `lease` is the lease held while leading; its token fences what `lead` writes.
+    """
+
+    def __init__(self, coordinator, name):
+        self.coordinator = coordinator
+        self.name = name
+        self.is_leader = False
+        self.takeovers = 0
+        self.lease = None
+
+    async def run(self, lead, follow):
+        coordinator = self.coordinator
+        while True:
+            try:
+                self.lease = await asyncio.to_thread(coordinator.acquire, self.name)
+            except Exception as e:
+                logger.warning(f"Failed to acquire lease {self.name} {e}")
+                self.lease = None
+            if self.lease is None:
+                try:
+                    await follow()
+                except Exception as e:
+                    logger.warning(f"Standby failed to follow the leader {e}")
+                await asyncio.sleep(coordinator.renew_interval_s)
+                continue
+            self.takeovers += 1
+            self.is_leader = True
+            logger.info(f"Holding lease {self.name} as {coordinator.holder} (token {self.lease.token}), leading")
+            try:
+                return await coordinator.hold(self.name, lead())
+            except LeaseLost as e:
+                logger.warning(f"{e}, standing by")
+            finally:
+                self.is_leader = False
@@ -0,0 +1,136 @@
+import logging
+from binascii import unhexlify
+
+from eth_utils import keccak
+
+logger = logging.getLogger(__name__)
+
+
+def bloom_bits(value: bytes):
+    """The three (byte index, bit mask) pairs `value` sets in a 2048-bit logs bloom.
+
+    Each pair comes from one of the first three 16-bit words of keccak(value), taken mod 2048
+    and counted from the low end of the big-endian 256-byte bloom.
+    """
+    digest = keccak(value)
+    bits = []
+    for i in (0, 2, 4):
+        bit = ((digest[i] << 8) | digest[i + 1]) & 2047
+        bits.append((255 - bit // 8, 1 << (bit % 8)))
+    return tuple(bits)
+
+
+def make_bloom(logs):
+    """The 256-byte logsBloom a node computes for `logs` (raw log dicts): each address and topic added."""
+    bloom = bytearray(256)
+    for log in logs:
+        for value in [log["address"], *log["topics"]]:
+            for index, mask in bloom_bits(unhexlify(value[2:])):
+                bloom[index] |= mask
+    return bytes(bloom)
+
+
+class LogFilter:
+    """Address/topic filter in eth_getLogs form, with the bloom bits to test blocks against it.
+
+    `addresses` matches logs of any of those contracts (none: any contract). `topics` is
+    positional as in eth_getLogs: each entry is None (anything), a topic or a list of
+    alternatives. `events` are event signatures like "Transfer(address,address,uint256)"; their
+    hashes restrict topic0, and matched logs carry the signature as "event".
+    """
+
+    def __init__(self, addresses=(), topics=(), events=()):
+        self.addresses = [address.lower() for address in addresses]
+        topics = [[topic] if isinstance(topic, str) else topic for topic in topics]
+        self.event_names = {"0x" + keccak(text=event).hex(): event for event in events}
+        if self.event_names:
+            topics = topics or [None]
+            topics[0] = list(topics[0] or []) + list(self.event_names)
+        self.topics = [None if topic is None else [t.lower() for t in topic] for topic in topics]
+        # one group per constraint; a block can match only if every group has a value in its bloom
+        self._groups = [[bloom_bits(unhexlify(value[2:])) for value in values]
+                        for values in [self.addresses, *self.topics] if values]
+
+    def params(self):
+        """The filter object for eth_getLogs, without the block range."""
+        params = {}
+        if self.addresses:
+            params["address"] = self.addresses
+        if any(topic is not None for topic in self.topics):
+            params["topics"] = self.topics
+        return params
+
+    def may_match(self, logs_bloom):
+        """False only if no log in a block with this bloom can match; True when the bloom is unknown."""
+        if logs_bloom is None:
+            return True
+        if not self._groups:
+            return any(logs_bloom)
+        return all(
+            any(all(logs_bloom[index] & mask for index, mask in bits) for bits in group) for group in self._groups
+        )
+
+
+class LogEnricher:
+    """Attaches the logs matching `log_filter` to each block's record as `record.logs`.
+
+    Blocks whose logsBloom rules the filter out get an empty list without any RPC call. The
+    remaining candidates of a fetched range are covered by a single eth_getLogs from the first
+    candidate to the last (a lone candidate is asked for by block hash). Logs are matched to
+    records by block hash. If any returned log belongs to a different block than the one fetched,
+    the provider's chain moved between the calls; every candidate is then asked for again by
+    block hash in one JSON-RPC batch.
+    """
+
+    def __init__(self, log_filter):
+        self.log_filter = log_filter
+        self.blocks_checked = 0
+        self.blocks_skipped = 0  # ruled out by their bloom
+        self.requests = 0  # eth_getLogs HTTP requests
+
+    async def enrich(self, provider, records):
+        candidates = []
+        for record in records:
+            record.logs = []
+            if self.log_filter.may_match(record.logs_bloom):
+                candidates.append(record)
+        self.blocks_checked += len(records)
+        self.blocks_skipped += len(records) - len(candidates)
+        if not candidates:
+            return records
+
+        params = self.log_filter.params()
+        by_hash = {record.hash: record for record in candidates}
+        self.requests += 1
+        if len(candidates) == 1:
+            logs = await provider.get_logs({**params, "blockHash": "0x" + candidates[0].hash.hex()})
+        else:
+            logs = await provider.get_logs(
+                {**params, "fromBlock": hex(candidates[0].number), "toBlock": hex(candidates[-1].number)}
+            )
+            if any(unhexlify(log["blockHash"][2:]) not in by_hash for log in logs):
+                logger.warning(
+                    f"Logs for blocks {candidates[0].number}-{candidates[-1].number} from {provider.name} are from "
+                    f"another chain, fetching them by block hash"
+                )
+                self.requests += 1
+                per_block = await provider.get_logs_by_hash(params, ["0x" + record.hash.hex() for record in candidates])
+                logs = [log for block_logs in per_block for log in block_logs]
+        for log in logs:
+            by_hash[unhexlify(log["blockHash"][2:])].logs.append(self._decode(log))
+        return records
+
+    def _decode(self, log):
+        topics = log["topics"]
+        decoded = {
+            "address": log["address"],
+            "topics": topics,
+            "data": log["data"],
+            "logIndex": int(log["logIndex"], 16),
+            "transactionIndex": int(log["transactionIndex"], 16),
+            "transactionHash": log["transactionHash"],
+        }
+        event = self.log_filter.event_names.get(topics[0].lower()) if topics else None
+        if event is not None:
+            decoded["event"] = event
+        return decoded
@@ -1,33 +1,254 @@
 import argparse
 import asyncio
+import contextvars
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+
+from backfill import Backfill
+from block_cache import RecentBlockCache
 from block_streamer import BlockStreamService
+from checkpoint_store import SQLiteCheckpointStore
 from config import AppConfig
+from http_pool import HttpSessionPool
+from lease_coordinator import Leadership, SQLiteLeaseCoordinator
+from log_enrichment import LogEnricher, LogFilter
+from metrics import MetricsServer
+from poll_scheduler import PollScheduler
 from provider_client import ProviderClient
 from provider_manager import ProviderManager
+from sinks import ENCODERS, SinkPipeline, TeeSink, build_encoder, build_sink
+from subscription_server import SubscriptionServer
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [chain %(chain)s] %(message)s")
+
+# set per chain task; tasks spawned by a chain's stream inherit it
+current_chain = contextvars.ContextVar("current_chain", default="-")
+
+
+class ChainLogFilter(logging.Filter):
+    def filter(self, record):
+        record.chain = current_chain.get()
+        return True
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
-def build_streamer(cfg_path):
-    app_cfg = AppConfig.load(cfg_path)
-    providers = [ProviderClient(p) for p in app_cfg.providers]
-    manager = ProviderManager(
-        providers,
+for handler in logging.getLogger().handlers:
+    handler.addFilter(ChainLogFilter())
+
+def build_provider_manager(app_cfg):
+    return ProviderManager(
+        [ProviderClient(p) for p in app_cfg.providers],
         lag_thr=app_cfg.lag_threshold_s,
         error_thr=app_cfg.failure_ratio,
-        halflife=app_cfg.score_halflife_s
+        window_s=app_cfg.score_window_s,
+        hedge_budget_per_minute=app_cfg.hedge_budget_per_minute,
+        probe_interval_s=app_cfg.probe_interval_s,
+        expected_block_time=app_cfg.expected_block_time,
+        breaker_failure_threshold=app_cfg.breaker_failure_threshold,
+        breaker_base_cooldown_s=app_cfg.breaker_base_cooldown_s,
+        breaker_max_cooldown_s=app_cfg.breaker_max_cooldown_s,
+        latency_thr=app_cfg.latency_threshold_s,
+        hysteresis=app_cfg.score_hysteresis,
+    )
+
+def build_http_pool(app_cfg):
+    return HttpSessionPool(
+        limit_per_host=app_cfg.http.limit_per_host,
+        keepalive_timeout_s=app_cfg.http.keepalive_timeout_s,
+        dns_cache_ttl_s=app_cfg.http.dns_cache_ttl_s,
+        warm_connections=app_cfg.http.warm_connections,
+        gzip=app_cfg.http.gzip,
+    )
+
+def build_output_sink(app_cfg):
+    sink = build_sink(app_cfg.output)
+    subscriptions = app_cfg.subscriptions
+    if not subscriptions.enabled:
+        return sink
+    server = SubscriptionServer(
+        host=subscriptions.host,
+        port=subscriptions.port,
+        buffer_size=subscriptions.buffer_size,
+        slow_consumer=subscriptions.slow_consumer,
+        replay_size=subscriptions.replay_size,
     )
-    return BlockStreamService(manager)
+    return TeeSink([sink, server])
+
+def build_log_enricher(app_cfg):
+    enrichment = app_cfg.log_enrichment
+    if not enrichment.enabled:
+        return None
+    if app_cfg.output.format != "ndjson":
+        raise ValueError("log_enrichment needs the ndjson output format; binary records carry no logs")
+    return LogEnricher(LogFilter(enrichment.addresses, enrichment.topics, enrichment.events))
+
+def build_lease_coordinator(app_cfg):
+    lease = app_cfg.lease
+    return SQLiteLeaseCoordinator(
+        lease.path,
+        holder=lease.holder,
+        ttl_s=lease.ttl_s or app_cfg.expected_block_time / 2,
+    )
+
+def build_leadership(app_cfg):
+    if not app_cfg.lease.enabled:
+        return None
+    if not app_cfg.checkpoint_path:
+        raise ValueError("lease needs checkpoint_path: a standby resumes from the leader's checkpoint")
+    return Leadership(build_lease_coordinator(app_cfg), f"stream:{app_cfg.chain_id}")
+
+def build_streamer(app_cfg):
+    block_cache = RecentBlockCache(app_cfg.block_cache_size)
+    manager = build_provider_manager(app_cfg)
+    checkpoint_store = None
+    checkpoint = None
+    if app_cfg.checkpoint_path:
+        checkpoint_store = SQLiteCheckpointStore(
+            app_cfg.checkpoint_path,
+            stream=str(app_cfg.chain_id),
+            commit_every_blocks=app_cfg.checkpoint_every_blocks,
+            commit_interval_s=app_cfg.checkpoint_interval_s,
+        )
+        checkpoint = checkpoint_store.load()
+        if checkpoint:
+            logging.info(f"Chain {app_cfg.chain_id} resuming from checkpoint block {checkpoint.block_number}")
+    return BlockStreamService(
+        manager,
+        last_processed_block_number=checkpoint.block_number if checkpoint else None,
+        last_hash=checkpoint.block_hash if checkpoint else None,
+        checkpoint_store=checkpoint_store,
+        block_cache=block_cache,
+        confirmations=app_cfg.start_confirmations,
+        max_catchup_window=app_cfg.catchup_window,
+        catchup_batch_size=app_cfg.catchup_batch_size,
+        lean_fetch=app_cfg.lean_fetch,
+        push_heads=app_cfg.push_heads,
+        hedge_requests=app_cfg.hedge_requests,
+        load_balance=app_cfg.load_balance_catchup,
+        poll_interval=app_cfg.poll_interval_s,
+        poll_scheduler=PollScheduler(
+            app_cfg.expected_block_time, min_interval_s=app_cfg.min_poll_interval_s
+        ) if app_cfg.adaptive_polling else None,
+        log_enricher=build_log_enricher(app_cfg),
+        leadership=build_leadership(app_cfg),
+        output=SinkPipeline(
+            build_output_sink(app_cfg),
+            queue_size=app_cfg.output.queue_size,
+            batch_size=app_cfg.output.batch_size,
+            flush_interval_s=app_cfg.output.flush_interval_s,
+            encoder=build_encoder(app_cfg.output),
+        ),
+    )
+
+async def run_chain(app_cfg, block_streamer):
+    current_chain.set(str(app_cfg.chain_id))
+    block_streamer.provider_manager.start_probing()
+    try:
+        await block_streamer.output.start()
+        await block_streamer.run()
+    except Exception:
+        # one chain failing must not take the others on the shared loop down with it
+        logging.exception("Block stream stopped")
+    finally:
+        await block_streamer.provider_manager.stop_probing()
+        await block_streamer.output.close()
+        if block_streamer.checkpoint_store is not None:
+            block_streamer.checkpoint_store.close()
+        if block_streamer.leadership is not None:
+            block_streamer.leadership.coordinator.close()
+        for provider in block_streamer.provider_manager.providers:
+            await provider.close()
+
+async def run_backfill(chain_cfgs, args):
+    app_cfg = next((cfg for cfg in chain_cfgs if args.chain is None or str(cfg.chain_id) == args.chain), None)
+    if app_cfg is None:
+        raise SystemExit(f"No chain {args.chain} in {args.config}")
+    current_chain.set(str(app_cfg.chain_id))
+    manager = build_provider_manager(app_cfg)
+    http_pool = build_http_pool(app_cfg)
+    for provider in manager.providers:
+        await http_pool.attach(provider)
+    await http_pool.warm_up(manager.providers)
+    manager.start_probing()
+    executor = ProcessPoolExecutor(args.workers) if args.workers else None
+    coordinator = build_lease_coordinator(app_cfg) if args.partitioned else None
+    try:
+        backfill = Backfill(
+            manager,
+            args.start,
+            args.end,
+            args.dir,
+            chunk_size=args.chunk_size,
+            batch_size=app_cfg.catchup_batch_size,
+            concurrency=args.concurrency or app_cfg.catchup_window,
+            executor=executor,
+            output_format=args.format or app_cfg.output.format,
+            coordinator=coordinator,
+        )
+        path = await backfill.run()
+        logging.info(f"Backfilled blocks {args.start}-{args.end} into {path}")
+    finally:
+        await manager.stop_probing()
+        if executor is not None:
+            executor.shutdown()
+        if coordinator is not None:
+            coordinator.close()
+        await http_pool.close()
+        for provider in manager.providers:
+            await provider.close()
 
 async def main():
     parser = argparse.ArgumentParser(description="Node provider hot‑swap block streamer")
     parser.add_argument("--config", "-c", help="Path to config.yaml", default="config.yaml")
+    commands = parser.add_subparsers(dest="command")
+    backfill = commands.add_parser("backfill", help="Fetch a historical block range into one file and exit")
+    backfill.add_argument("--from", dest="start", type=int, required=True, help="First block number")
+    backfill.add_argument("--to", dest="end", type=int, required=True, help="Last block number (inclusive)")
+    backfill.add_argument("--dir", default="backfill", help="Work directory for the manifest, chunks and output")
+    backfill.add_argument("--chain", help="chain_id to backfill (default: the first chain in the config)")
+    backfill.add_argument("--chunk-size", type=int, default=10_000, help="Blocks per resumable chunk")
+    backfill.add_argument("--concurrency", type=int, help="Chunks fetched at once (default: catchup_window)")
+    # the event loop keeps a core for itself; on a single core decoding in place is cheaper
+    backfill.add_argument("--workers", type=int, default=(os.cpu_count() or 1) - 1,
+                          help="Processes decoding JSON-RPC responses (0: decode on the event loop)")
+    backfill.add_argument("--format", choices=sorted(ENCODERS), help="Output format (default: output.format)")
+    backfill.add_argument("--partitioned", action="store_true",
+                          help="Split the chunks with other instances running this backfill on the same --dir, "
+                               "claiming each through the lease database (lease.path)")
     args = parser.parse_args()
 
-    block_streamer = build_streamer(args.config)
-    block_streamer.running = True
-    await block_streamer.stream()
+    chain_cfgs = AppConfig.load_chains(args.config)
+    if args.command == "backfill":
+        await run_backfill(chain_cfgs, args)
+        return
+    app_cfg = chain_cfgs[0]  # process-wide settings (metrics server) come from the top level
+    streamers = {str(cfg.chain_id): build_streamer(cfg) for cfg in chain_cfgs}
+    # keep-alive pools per host shared by every chain; per-host limits only, so a slow chain's
+    # host cannot tie up connections another chain needs
+    http_pool = build_http_pool(app_cfg)
+    providers = [p for block_streamer in streamers.values() for p in block_streamer.provider_manager.providers]
+    for provider in providers:
+        await http_pool.attach(provider)
+    await http_pool.warm_up(providers)
+    for block_streamer in streamers.values():
+        block_streamer.running = True
+    metrics_server = None
+    if app_cfg.metrics_port is not None:
+        metrics_server = MetricsServer(
+            streamers,
+            host=app_cfg.metrics_host,
+            port=app_cfg.metrics_port,
+            # block timestamps trail wall time by the confirmation depth plus one block
+            stale_after_s=app_cfg.lag_threshold_s + (app_cfg.start_confirmations + 1) * app_cfg.expected_block_time,
+        )
+        await metrics_server.start()
+    try:
+        await asyncio.gather(*(run_chain(cfg, streamers[str(cfg.chain_id)]) for cfg in chain_cfgs))
+    finally:
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await http_pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
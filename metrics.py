@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+
+from circuit_breaker import CircuitBreaker
+from windowed_stats import OUTCOMES
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+WINDOW_QUANTILES = (0.5, 0.95, 0.99)
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+class Histogram:
+    """Fixed-bucket histogram for hot paths.
+
+    `observe` is a bisect over a preallocated tuple and two in-place updates: no locks (the
+    event loop is single-threaded), no label lookups, no per-call objects. Counts are kept
+    per bucket and only made cumulative when rendered.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS_S):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class _Exposition:
+    """Collects samples grouped by metric family and renders Prometheus text format 0.0.4."""
+
+    def __init__(self):
+        self._families = {}
+
+    def add(self, name, kind, help_text, labels, value):
+        family = self._families.setdefault(name, (kind, help_text, []))
+        family[2].append((labels, value))
+
+    def add_histogram(self, name, help_text, labels, histogram):
+        family = self._families.setdefault(name, ("histogram", help_text, []))
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            family[2].append((("_bucket", {**labels, "le": le}), cumulative))
+        family[2].append((("_sum", labels), histogram.sum))
+        family[2].append((("_count", labels), histogram.count))
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                suffix = ""
+                if isinstance(labels, tuple):
+                    suffix, labels = labels
+                lines.append(f"{name}{suffix}{_labels(**labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Minimal asyncio HTTP server exposing /metrics (Prometheus text) and /health (JSON).
+
+    Everything is read from the services' own counters at scrape time, so serving a scrape
+    costs nothing on the streaming hot path. `streamers` maps a chain label to its
+    BlockStreamService.
+    """
+
+    def __init__(self, streamers, host="0.0.0.0", port=9100, stale_after_s=60):
+        self.streamers = streamers
+        self.host = host
+        self.port = port
+        self.stale_after_s = stale_after_s
+        self._server = None
+        self._last_scrape = {}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Serving /metrics and /health on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if path == "/metrics":
+                status, content_type, body = 200, "text/plain; version=0.0.4", self.render_metrics()
+            elif path == "/health":
+                healthy, report = self.health()
+                status, content_type, body = (200 if healthy else 503), "application/json", json.dumps(report)
+            else:
+                status, content_type, body = 404, "text/plain", "not found\n"
+            payload = body.encode()
+            reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Failed to serve metrics request {e}")
+        finally:
+            writer.close()
+
+    def _blocks_per_second(self, chain, streamer):
+        # rate between consecutive scrapes; Prometheus users should prefer rate(blocks_emitted_total)
+        now = time.monotonic()
+        previous = self._last_scrape.get(chain)
+        self._last_scrape[chain] = (now, streamer.blocks_emitted)
+        if previous is None or now <= previous[0]:
+            return 0.0
+        return (streamer.blocks_emitted - previous[1]) / (now - previous[0])
+
+    def render_metrics(self):
+        out = _Exposition()
+        for chain, streamer in self.streamers.items():
+            manager = streamer.provider_manager
+            chain_labels = {"chain": chain}
+            out.add("block_streamer_blocks_emitted_total", "counter", "Blocks emitted to the output sink",
+                    chain_labels, streamer.blocks_emitted)
+            out.add("block_streamer_blocks_per_second", "gauge", "Blocks emitted per second since the last scrape",
+                    chain_labels, self._blocks_per_second(chain, streamer))
+            if streamer.head_block_number is not None and streamer.last_processed_block is not None:
+                out.add("block_streamer_head_lag_blocks", "gauge", "Blocks between the provider head and the last emitted block",
+                        chain_labels, streamer.head_block_number - streamer.last_processed_block)
+            if streamer.last_processed_block is not None:
+                out.add("block_streamer_last_processed_block", "gauge", "Number of the last emitted block",
+                        chain_labels, streamer.last_processed_block)
+            out.add("block_streamer_output_queue_depth", "gauge", "Records waiting in the output pipeline",
+                    chain_labels, streamer.output.depth)
+            out.add("block_streamer_new_heads_queue_depth", "gauge", "Pushed heads waiting to be processed",
+                    chain_labels, streamer.new_heads_depth)
+            out.add("block_streamer_seam_mismatches_total", "counter",
+                    "Load-balanced ranges that did not extend the previous provider's chain",
+                    chain_labels, streamer.seam_mismatches)
+            out.add("block_streamer_provider_switches_total", "counter", "Active provider switches",
+                    chain_labels, manager.switch_count)
+            out.add("block_streamer_hedged_requests_total", "counter", "Requests hedged to a second provider",
+                    chain_labels, manager.hedges_fired)
+            if streamer.leadership is not None:
+                out.add("block_streamer_leader", "gauge", "1 while this instance holds the chain's lease and streams",
+                        chain_labels, int(streamer.leadership.is_leader))
+                out.add("block_streamer_lease_acquisitions_total", "counter", "Times this instance took the chain's lease",
+                        chain_labels, streamer.leadership.takeovers)
+            if streamer.log_enricher is not None:
+                out.add("block_streamer_log_enrichment_blocks_skipped_total", "counter",
+                        "Blocks whose logsBloom ruled out the log filter, so no logs were requested",
+                        chain_labels, streamer.log_enricher.blocks_skipped)
+                out.add("block_streamer_log_enrichment_requests_total", "counter", "eth_getLogs requests sent",
+                        chain_labels, streamer.log_enricher.requests)
+            if streamer.block_cache is not None:
+                out.add("block_streamer_block_cache_hits_total", "counter", "Recent-block cache hits",
+                        chain_labels, streamer.block_cache.hits)
+                out.add("block_streamer_block_cache_misses_total", "counter", "Recent-block cache misses",
+                        chain_labels, streamer.block_cache.misses)
+            for index, (provider, score, breaker) in enumerate(
+                zip(manager.providers, manager.metrics, manager.breakers)
+            ):
+                labels = {"chain": chain, "provider": provider.name}
+                out.add_histogram("block_streamer_provider_request_duration_seconds", "Provider RPC latency",
+                                  labels, provider.latency_histogram)
+                out.add("block_streamer_provider_requests_total", "counter", "Provider RPC calls",
+                        labels, provider.request_count)
+                out.add("block_streamer_provider_errors_total", "counter", "Failed provider RPC calls",
+                        labels, provider.error_count)
+                out.add("block_streamer_provider_rate_headroom", "gauge", "Fraction of the provider's rate budget left",
+                        labels, provider.rate_headroom())
+                out.add("block_streamer_provider_throttled_total", "counter", "Rate-limit responses from the provider",
+                        labels, provider.rate_limiter.throttle_count)
+                out.add("block_streamer_provider_head_staleness_seconds", "gauge",
+                        "Mean provider head lag over the scoring window", labels, score.staleness)
+                out.add("block_streamer_provider_error_ratio", "gauge",
+                        "Class-weighted failed fraction of requests over the scoring window", labels, score.error_ratio)
+                out.add("block_streamer_provider_score", "gauge", "Provider score, 1.0 best", labels, score.score)
+                stats = provider.stats
+                for outcome in OUTCOMES[1:]:
+                    out.add("block_streamer_provider_window_error_rate", "gauge",
+                            "Fraction of requests over the scoring window failing with this error class",
+                            {**labels, "class": outcome}, stats.error_rate(outcome))
+                for method, sketch in stats.latency_by_method.items():
+                    for quantile, value in zip(WINDOW_QUANTILES, sketch.quantiles(*WINDOW_QUANTILES)):
+                        out.add("block_streamer_provider_window_latency_seconds", "gauge",
+                                "Provider RPC latency quantiles over the scoring window",
+                                {**labels, "method": method, "quantile": quantile}, value)
+                out.add("block_streamer_provider_healthy", "gauge", "1 if the provider score is healthy",
+                        labels, int(score.is_healthy))
+                out.add("block_streamer_provider_breaker_state", "gauge",
+                        "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+                        labels, BREAKER_STATES[breaker.state])
+                out.add("block_streamer_provider_breaker_trips", "gauge",
+                        "Consecutive circuit breaker trips; 0 once a request succeeds", labels, breaker.trips)
+                out.add("block_streamer_provider_active", "gauge", "1 for the provider currently streamed from",
+                        labels, int(index == manager.active_index))
+        return out.render()
+
+    def health(self):
+        """Healthy while every chain has emitted a block within `stale_after_s` seconds or is on standby."""
+        report = {}
+        healthy = True
+        for chain, streamer in self.streamers.items():
+            age = None if streamer.last_block_ts is None else time.time() - streamer.last_block_ts
+            leadership = streamer.leadership
+            standby = leadership is not None and not leadership.is_leader
+            chain_healthy = standby or (streamer.running and age is not None and age < self.stale_after_s)
+            healthy = healthy and chain_healthy
+            manager = streamer.provider_manager
+            report[chain] = {
+                "healthy": chain_healthy,
+                "last_processed_block": streamer.last_processed_block,
+                "head_block_number": streamer.head_block_number,
+                "last_block_age_s": age,
+                "active_provider": manager.active.name,
+                "providers": {p.name: m.is_healthy for p, m in zip(manager.providers, manager.metrics)},
+            }
+            if leadership is not None:
+                report[chain]["role"] = "leader" if leadership.is_leader else "standby"
+        return healthy, {"status": "ok" if healthy else "unhealthy", "chains": report}
@@ -0,0 +1,81 @@
+import time
+from collections import deque
+
+
+def _quantile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class PollScheduler:
+    """Decides how long to sleep before the next head() poll.
+
+    The next head is expected at the last emitted block's timestamp plus one median block
+    interval per block still to come, plus the usual delay before a new block is visible from the
+    provider. Both distributions are learned from the last `window` observations. The window
+    between their 10th and 90th percentiles is polled every `min_interval_s`. Before it the
+    scheduler sleeps until it opens, and once the block is overdue the sleep grows with the
+    overdue time. No sleep is ever longer than `max_interval_s`, which defaults to one block time.
+
+    `clock` must be wall-clock seconds, the unit of block timestamps.
+    """
+
+    def __init__(self, expected_block_time, min_interval_s=0.25, max_interval_s=None, window=64, clock=time.time):
+        self.expected_block_time = expected_block_time
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s if max_interval_s is not None else expected_block_time
+        self._clock = clock
+        self._intervals = deque(maxlen=window)
+        self._delays = deque(maxlen=window)
+        self._block = None  # (number, timestamp) of the last emitted block
+        self._head = None
+        self._last_poll = None
+        self.block_time = float(expected_block_time)
+        self._interval_spread = (0.0, 0.0)  # p10 / p90 offsets from block_time
+        self._delay_range = (0.0, min_interval_s)
+
+    def on_block(self, number, timestamp):
+        """An emitted block: anchors predictions and samples the block interval."""
+        if self._block is not None and number > self._block[0]:
+            previous_number, previous_timestamp = self._block
+            self._intervals.append((timestamp - previous_timestamp) / (number - previous_number))
+            ordered = sorted(self._intervals)
+            self.block_time = _quantile(ordered, 0.5)
+            self._interval_spread = (_quantile(ordered, 0.1) - self.block_time, _quantile(ordered, 0.9) - self.block_time)
+        self._block = (number, timestamp)
+
+    def on_head(self, head):
+        """A head() result: when it is new, samples how long after its timestamp it became visible."""
+        now = self._clock()
+        last_poll, self._last_poll = self._last_poll, now
+        if self._head is not None and head <= self._head:
+            return
+        previously_seen = self._head
+        self._head = head
+        if previously_seen is None or head != previously_seen + 1 or self._block is None:
+            return  # a jump says nothing about when each block appeared
+        # It appeared somewhere since the last poll. After a long sleep "just before this poll" is
+        # the only estimate that lets early blocks pull the window earlier again instead of
+        # being recorded as arriving when it opened.
+        since_poll = now - last_poll if last_poll is not None else self.min_interval_s
+        visible_at = now - min(since_poll, self.min_interval_s) / 2
+        self._delays.append(max(0.0, visible_at - self.expected_timestamp(head)))
+        ordered = sorted(self._delays)
+        self._delay_range = (_quantile(ordered, 0.1), _quantile(ordered, 0.9))
+
+    def expected_timestamp(self, number):
+        anchor_number, anchor_timestamp = self._block
+        return anchor_timestamp + (number - anchor_number) * self.block_time
+
+    def next_delay(self):
+        if self._block is None or self._head is None:
+            return self.min_interval_s
+        next_timestamp = self.expected_timestamp(self._head + 1)
+        opens = next_timestamp + self._interval_spread[0] + self._delay_range[0]
+        closes = next_timestamp + self._interval_spread[1] + self._delay_range[1]
+        now = self._clock()
+        if now < opens:
+            return min(opens - now, self.max_interval_s)
+        if now <= closes:
+            return self.min_interval_s
+        # overdue (a missed slot or a stalled provider): back off geometrically
+        return min(max((now - closes) / 2, self.min_interval_s), self.max_interval_s)
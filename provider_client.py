@@ -1,45 +1,284 @@
+import asyncio
 import logging
 import time
-from collections import deque
-
-import asyncio
 
+import aiohttp
+import orjson
 from web3 import AsyncWeb3
+from web3.exceptions import BlockNotFound, Web3RPCError
+
+from block_record import BlockRecord
+from metrics import LATENCY_BUCKETS_S, Histogram
+from rate_limiter import DEFAULT_COMPUTE_UNITS, RateLimiter, is_rate_limited, retry_after_s
+from windowed_stats import RequestStats, error_class
+
+logger = logging.getLogger(__name__)
+
+GET_BLOCK_BY_NUMBER = "eth_getBlockByNumber"
+GET_BLOCK_BY_HASH = "eth_getBlockByHash"
+BLOCK_NUMBER = "eth_blockNumber"
+GET_LOGS = "eth_getLogs"
+# scoring-window keys of the methods sent in JSON-RPC batches, kept apart from single calls (see RequestStats)
+BATCH_KEYS = {method: f"{method} batch" for method in (GET_BLOCK_BY_NUMBER, GET_LOGS)}
 
 class ProviderClient:
-    def __init__(self, cfg, max_rate_per_sec=10):
+    def __init__(self, cfg, max_rate_per_sec=None):
         self.name = cfg.name
-        self.w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(cfg.url, request_kwargs={"timeout": 15}))
-        self.latencies = deque(maxlen=30)
-        self.errors = deque(maxlen=30)
-        self._rate_sem = asyncio.Semaphore(max_rate_per_sec)
+        self.url = cfg.url
+        # no web3-level retries: they would hammer a provider that answered 429 and delay failover
+        self.w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(
+            cfg.url, request_kwargs={"timeout": 15}, exception_retry_configuration=None
+        ))
+        # the scoring window (latency per method, errors per class), which also keeps the lifetime latencies for /metrics
+        self.stats = RequestStats(cfg.window_s, edges=LATENCY_BUCKETS_S)
+        self.max_rate_per_sec = max_rate_per_sec if max_rate_per_sec is not None else cfg.max_rate_per_sec
+        self.max_batch_size = cfg.max_batch_size
+        self.batch_supported = True
+        self.ws_url = cfg.ws_url
+        self._shared_session = None
+        self.rate_limiter = RateLimiter(self.max_rate_per_sec, cfg.compute_units_per_sec)
+        self.compute_unit_costs = {**DEFAULT_COMPUTE_UNITS, **cfg.compute_units}
+        # lifetime totals for /metrics
+        self.request_count = 0
+        self.error_count = 0
 
-    async def _timed(self, coro):
+    async def _timed(self, coro, method=None, calls=1):
+        """Await `coro`, one HTTP request carrying `calls` JSON-RPC calls of `method`, once the rate budget allows.
+
+        A batch costs one request but `calls` times the method's compute units. Latency is measured
+        from when the request is sent, so waiting on our own rate limiter doesn't make the provider
+        look slow; a cancelled request records none.
+        """
+        try:
+            await self.rate_limiter.acquire(1, calls * self.compute_unit_costs.get(method, 0))
+        except BaseException:
+            coro.close()
+            raise
         start = time.perf_counter()
+        outcome = "ok"
         try:
-            async with self._rate_sem:
-                result = await coro
-            self.errors.append(0)
-            return result
+            return await coro
+        except asyncio.CancelledError:
+            # e.g. a hedge's loser: the answer never came, so there is no latency or outcome to keep
+            outcome = None
+            raise
         except Exception as e:
-            self.errors.append(1)
+            outcome = error_class(e)
+            self.error_count += 1
+            if outcome == "rate_limited":
+                logger.warning(f"Provider {self.name} is rate limiting us, slowing down")
+                self.rate_limiter.on_throttled(retry_after_s(e))
             raise e
         finally:
-            self.latencies.append(time.perf_counter() - start)
+            self.request_count += 1
+            if outcome is not None:
+                elapsed = time.perf_counter() - start
+                self.stats.record(method if calls == 1 else BATCH_KEYS[method], elapsed, outcome)
 
     async def head(self):
-        return await self._timed(self.w3.eth.block_number)
+        return await self._timed(self.w3.eth.block_number, BLOCK_NUMBER)
 
     async def get_block(self, block_number):
-        return await self._timed(self.w3.eth.get_block(block_number))
+        return await self._timed(self.w3.eth.get_block(block_number), GET_BLOCK_BY_NUMBER)
+
+    async def get_blocks(self, start, end):
+        """Fetch blocks start..end (inclusive) using JSON-RPC batches of at most max_batch_size calls."""
+        blocks = []
+        for chunk_start, chunk_end in self._batch_ranges(start, end):
+            blocks.extend(await self._get_block_batch(chunk_start, chunk_end))
+        return blocks
+
+    async def get_block_record(self, block_number):
+        """Lean get_block: raw JSON-RPC with transaction hashes only, parsed into a BlockRecord.
+
+        Bypasses the web3 middleware and result formatters, so no AttributeDict/HexBytes is built.
+        """
+        return await self._timed(self._raw_get_block(block_number), GET_BLOCK_BY_NUMBER)
+
+    async def get_block_record_by_hash(self, block_hash):
+        """get_block_record for a block hash (hex); nodes keep serving blocks a reorg orphaned this way."""
+        return await self._timed(self._raw_get_block_by_hash(block_hash), GET_BLOCK_BY_HASH)
+
+    async def get_block_records(self, start, end):
+        records = []
+        for chunk_start, chunk_end in self._batch_ranges(start, end):
+            records.extend(await self._get_block_record_batch(chunk_start, chunk_end))
+        return records
+
+    async def get_block_range_body(self, start, end):
+        """One JSON-RPC batch for blocks start..end, returned as the undecoded response body.
+
+        For callers that parse off the event loop (backfill decodes in a process pool); keep the
+        range within max_batch_size. The body is a single error object if batches are rejected;
+        a rate-limit error is raised instead.
+        """
+        return await self._timed(self._raw_batch_body(start, end), GET_BLOCK_BY_NUMBER, end - start + 1)
+
+    async def get_logs(self, log_filter):
+        """eth_getLogs for a filter object (address/topics plus fromBlock/toBlock or blockHash), as raw log dicts."""
+        return await self._timed(self._raw_get_logs(log_filter), GET_LOGS)
+
+    async def get_logs_by_hash(self, log_filter, block_hashes):
+        """Logs of each of `block_hashes` (hex) matching `log_filter`, one list per hash, in one JSON-RPC batch.
+
+        Scoping by block hash pins the answer to that exact block, whichever chain the provider follows now.
+        """
+        if self.batch_supported and len(block_hashes) > 1:
+            results = await self._timed(self._raw_batch_get_logs(log_filter, block_hashes), GET_LOGS, len(block_hashes))
+            if results is not None:
+                return results
+            logger.warning(f"Provider {self.name} rejected batch request, falling back to single calls")
+            self.batch_supported = False
+        return [await self.get_logs({**log_filter, "blockHash": block_hash}) for block_hash in block_hashes]
+
+    def _batch_ranges(self, start, end):
+        for chunk_start in range(start, end + 1, self.max_batch_size):
+            yield chunk_start, min(chunk_start + self.max_batch_size - 1, end)
+
+    async def _get_block_batch(self, start, end):
+        if self.batch_supported and end > start:
+            try:
+                return await self._timed(self._batch_get_blocks(start, end), GET_BLOCK_BY_NUMBER, end - start + 1)
+            except Web3RPCError as e:
+                # a failed entry echoes its call's id; only a lone error object answering the whole batch
+                # has none (JSON-RPC 2.0), and only that one says the provider doesn't do batches
+                if is_rate_limited(e) or (e.rpc_response or {}).get("id") is not None:
+                    raise
+                logger.warning(f"Provider {self.name} rejected batch request ({e}), falling back to single calls")
+                self.batch_supported = False
+        return [await self.get_block(block_number) for block_number in range(start, end + 1)]
+
+    async def _batch_get_blocks(self, start, end):
+        async with self.w3.batch_requests() as batch:
+            for block_number in range(start, end + 1):
+                batch.add(self.w3.eth.get_block(block_number))
+            return await batch.async_execute()
+
+    async def _get_block_record_batch(self, start, end):
+        if self.batch_supported and end > start:
+            records = await self._timed(self._raw_batch_get_blocks(start, end), GET_BLOCK_BY_NUMBER, end - start + 1)
+            if records is not None:
+                return records
+            logger.warning(f"Provider {self.name} rejected batch request, falling back to single calls")
+            self.batch_supported = False
+        return [await self.get_block_record(block_number) for block_number in range(start, end + 1)]
+
+    async def _raw_get_block(self, block_number):
+        response = await self.w3.provider.make_request(GET_BLOCK_BY_NUMBER, [hex(block_number), False])
+        return self._parse_block_record(block_number, response)
+
+    async def _raw_get_block_by_hash(self, block_hash):
+        response = await self.w3.provider.make_request(GET_BLOCK_BY_HASH, [block_hash, False])
+        return self._parse_block_record(block_hash, response)
+
+    async def _raw_batch_get_blocks(self, start, end):
+        calls = [(GET_BLOCK_BY_NUMBER, [hex(block_number), False]) for block_number in range(start, end + 1)]
+        responses = await self.w3.provider.make_batch_request(calls)
+        if not isinstance(responses, list):
+            return self._rejected_batch(responses)
+        responses.sort(key=lambda response: response["id"])
+        return [self._parse_block_record(start + i, response) for i, response in enumerate(responses)]
+
+    async def _raw_get_logs(self, log_filter):
+        return self._parse_logs(await self.w3.provider.make_request(GET_LOGS, [log_filter]))
+
+    async def _raw_batch_get_logs(self, log_filter, block_hashes):
+        calls = [(GET_LOGS, [{**log_filter, "blockHash": block_hash}]) for block_hash in block_hashes]
+        responses = await self.w3.provider.make_batch_request(calls)
+        if not isinstance(responses, list):
+            return self._rejected_batch(responses)
+        responses.sort(key=lambda response: response["id"])
+        return [self._parse_logs(response) for response in responses]
+
+    @staticmethod
+    def _parse_logs(response):
+        if "error" in response:
+            raise Web3RPCError(str(response["error"]), rpc_response=response)
+        return response["result"]
+
+    async def _raw_batch_body(self, start, end):
+        provider = self.w3.provider
+        calls = [(GET_BLOCK_BY_NUMBER, [hex(block_number), False]) for block_number in range(start, end + 1)]
+        body = await provider._request_session_manager.async_make_post_request(
+            provider.endpoint_uri, provider.encode_batch_rpc_request(calls), **provider.get_request_kwargs()
+        )
+        if body.lstrip()[:1] == b"{":
+            self._rejected_batch(orjson.loads(body))  # a lone error object is small enough to parse here
+        return body
+
+    @staticmethod
+    def _rejected_batch(response):
+        """None for a batch answered with a single error object: the provider doesn't do batches.
+
+        A rate-limit error is raised instead, as the provider does batches but wants fewer
+        requests; raised inside _timed, it makes the RateLimiter back off.
+        """
+        error = Web3RPCError(str(response.get("error")), rpc_response=response)
+        if is_rate_limited(error):
+            raise error
+        return None
+
+    @staticmethod
+    def _parse_block_record(block_number, response):
+        if "error" in response:
+            raise Web3RPCError(str(response["error"]), rpc_response=response)
+        if response.get("result") is None:
+            raise BlockNotFound(f"Block {block_number} not found")
+        return BlockRecord.from_rpc(response["result"])
+
+    async def watch_new_heads(self, queue):
+        """Subscribe to newHeads over the provider's WebSocket and put each new head number on `queue`.
+
+        Runs until the socket closes or fails; the caller decides whether to reconnect.
+        """
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.ws_url, heartbeat=30) as ws:
+                await ws.send_json({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]})
+                async for message in ws:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    data = message.json()
+                    if "error" in data:
+                        raise Web3RPCError(str(data["error"]), rpc_response=data)
+                    if data.get("method") == "eth_subscription":
+                        queue.put_nowait(int(data["params"]["result"]["number"], 16))
+        logger.warning(f"Provider {self.name} newHeads subscription closed")
+
+    async def use_session(self, session):
+        """Send HTTP JSON-RPC through `session`, sharing its connection pool with other clients.
+
+        web3's own per-provider session opens a new connection for every request (force_close);
+        a shared session keeps connections alive. The caller owns and closes it.
+        """
+        await self.w3.provider.cache_async_session(session)
+        self._shared_session = session
+
+    async def close(self):
+        if self._shared_session is None:
+            await self.w3.provider.disconnect()
+
+    @property
+    def latency_histogram(self):
+        """Lifetime request latency as a /metrics Histogram, re-bucketed from `stats` when read."""
+        histogram = Histogram()
+        histogram.counts, histogram.sum, histogram.count = self.stats.histogram(histogram.bounds)
+        return histogram
 
     def get_average_latency(self):
-        if not self.latencies:
-            return 0.0
-        return sum(self.latencies) / len(self.latencies)
+        return self.stats.mean_latency()
+
+    def get_latency_percentile(self, q, method=None):
+        """Nearest-rank percentile (q in 0..1) of the latencies in the scoring window, 0.0 before any sample.
+
+        Over all requests, or over single `method` calls (an RPC method name such as eth_blockNumber).
+        """
+        return self.stats.latency_quantile(q, method)
+
+    def rate_headroom(self):
+        """Fraction (0..1) of the tighter rate budget still available right now."""
+        return self.rate_limiter.headroom
 
     def get_error_ratio(self):
-        if not self.errors:
-            return 0.0
-        return sum(self.errors) / len(self.errors)
+        """Failed fraction of the requests in the scoring window, weighted by error class (see windowed_stats)."""
+        return self.stats.weighted_error_rate()
 
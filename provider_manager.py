@@ -2,46 +2,215 @@ import asyncio
 import logging
 import time
 
-from ewma import ExponentiallyWeightedMovingAverage
+from circuit_breaker import CircuitBreaker
+from provider_client import BLOCK_NUMBER, GET_BLOCK_BY_NUMBER
+from windowed_stats import WindowedCounts
 
 logger = logging.getLogger(__name__)
 
+# single-call methods `hedged` may race, with the RPC method whose latency sets their hedge delay;
+# range batches are never hedged, as a backup would pay the whole batch's compute units again
+HEDGED_METHODS = {"head": BLOCK_NUMBER, "get_block": GET_BLOCK_BY_NUMBER, "get_block_record": GET_BLOCK_BY_NUMBER}
+
 class ProviderScore:
-    def __init__(self, lag_thr: float, error_thr: float, halflife: float):
-        self.lag_ema = ExponentiallyWeightedMovingAverage(halflife)
-        self.err_ema = ExponentiallyWeightedMovingAverage(halflife)
+    """Health and rank of one provider from its last `window_s` seconds.
+
+    Three signals, each relative to its threshold: head staleness (mean head lag in the window),
+    the class-weighted error ratio and the p95 latency of its head() calls, the one request
+    every provider makes, active or idle. The score is 1 / (1 + their sum): 1.0 for a provider
+    at the head with no errors and no latency, comparable across providers. It and the health
+    flag are recomputed on `update`, once per probe, and read in O(1); the p95 passed in is a
+    pass over the provider's used latency buckets (see WindowedQuantiles).
+
+    Health has hysteresis: a provider turns unhealthy once staleness or errors reach their
+    threshold, and healthy again only once both are `hysteresis` below it.
+    """
+
+    def __init__(self, lag_thr: float, error_thr: float, window_s: float = 60.0, latency_thr: float = 1.0,
+                 hysteresis: float = 0.2, clock=time.monotonic):
         self.lag_thr = lag_thr
         self.err_thr = error_thr
+        self.latency_thr = latency_thr
+        self.hysteresis = hysteresis
+        self._lag = WindowedCounts(2, window_s, clock)  # sum and count of head-lag samples
+        self.staleness = 0.0
+        self.error_ratio = 0.0
+        self.latency = 0.0
+        self._score = 1.0
+        self._healthy = True
 
+    def update(self, lag_s: float, err_ratio: float, latency_s: float = 0.0):
+        self._lag.add(0, lag_s)
+        self._lag.add(1)
+        lag_sum, samples = self._lag.totals
+        self.staleness = lag_sum / samples
+        self.error_ratio = err_ratio
+        self.latency = latency_s
+        self._score = 1 / (
+            1 + self.staleness / self.lag_thr + self.error_ratio / self.err_thr + self.latency / self.latency_thr
+        )
+        if self._healthy:
+            self._healthy = self.staleness < self.lag_thr and self.error_ratio < self.err_thr
+        else:
+            recovered = 1 - self.hysteresis
+            self._healthy = self.staleness < self.lag_thr * recovered and self.error_ratio < self.err_thr * recovered
 
-    def update(self, lag_s: float, err_ratio: float):
-        self.lag_ema.update(lag_s)
-        self.err_ema.update(err_ratio)
+    @property
+    def score(self) -> float:
+        return self._score
 
     @property
     def is_healthy(self) -> bool:
-        return (self.lag_ema.value < self.lag_thr) and (self.err_ema.value < self.err_thr)
+        return self._healthy
+
+class HedgeBudget:
+    """Caps hedged requests to `max_per_minute` per fixed one-minute window."""
+
+    def __init__(self, max_per_minute: int):
+        self.max_per_minute = max_per_minute
+        self._window_start = time.monotonic()
+        self._used = 0
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_start >= 60:
+            self._window_start = now
+            self._used = 0
+        if self._used >= self.max_per_minute:
+            return False
+        self._used += 1
+        return True
+
 
 class ProviderManager:
-    def __init__(self, providers, lag_thr, error_thr, halflife) -> None:
+    def __init__(self, providers, lag_thr, error_thr, window_s, hedge_budget_per_minute=60,
+                 probe_interval_s=15.0, expected_block_time=12, breaker_failure_threshold=3,
+                 breaker_base_cooldown_s=1.0, breaker_max_cooldown_s=60.0, latency_thr=1.0, hysteresis=0.2,
+                 clock=time.monotonic) -> None:
         if not providers:
             raise ValueError("At least one provider required")
         self.providers = providers
         self.active_index = 0
         self.last_block_ts = None
-        self.metrics = [ProviderScore(lag_thr, error_thr, halflife) for _ in providers]
+        self.hysteresis = hysteresis
+        self.metrics = [
+            ProviderScore(lag_thr, error_thr, window_s, latency_thr, hysteresis, clock) for _ in providers
+        ]
+        self.breakers = [
+            CircuitBreaker(breaker_failure_threshold, breaker_base_cooldown_s, breaker_max_cooldown_s)
+            for _ in providers
+        ]
+        self._breaker_ready = asyncio.Event()  # set whenever a breaker closes again
+        self.hedge_budget = HedgeBudget(hedge_budget_per_minute)
+        self.hedges_fired = 0
+        self.switch_count = 0
+        self._fetch_credit = [0.0] * len(providers)  # smooth weighted round-robin state
+        self.probe_interval_s = probe_interval_s
+        self.expected_block_time = expected_block_time
+        self.best_head = None
+        self.ranking = None  # provider indices, best first; None until the first probe round
+        self._prober = None
         self._lock = asyncio.Lock()
 
     @property
     def active(self):
         return self.providers[self.active_index]
 
-    async def record_metrics(self, lag_s):
+    async def record_metrics(self, provider, head):
+        """Score `provider`, active for the stream round that just ended, on the head it reported then.
+
+        Its lag is measured as an idle provider's is (see probe_idle_providers): blocks behind the
+        best head seen, in expected block times, so the ranking compares like with like. A round
+        whose head() failed (`head` None) counts as lag_thr behind, as a failed probe does.
+        """
         async with self._lock:
-            self.metrics[self.active_index].update(
-                lag_s,
-                self.active.get_error_ratio(),
-            )
+            index = self.providers.index(provider)
+            if head is None:
+                lag_s = self.metrics[index].lag_thr
+            else:
+                if self.best_head is None or head > self.best_head:
+                    self.best_head = head
+                lag_s = (self.best_head - head) * self.expected_block_time
+            self._score(index, lag_s)
+            if self.ranking is not None:
+                self._rank()
+
+    async def hedged(self, primary, method, *args):
+        """Call `primary.<method>(*args)`, racing the next-best healthy provider if it is slow.
+
+        `method` is one of HEDGED_METHODS. The backup request fires only once the primary has been
+        outstanding for its observed p95 latency of that RPC method and the per-minute hedge budget
+        allows it; the first successful answer wins.
+        """
+        hedge_delay = primary.get_latency_percentile(0.95, HEDGED_METHODS[method])
+        primary_task = asyncio.ensure_future(getattr(primary, method)(*args))
+        backup = self._hedge_target(primary)
+        if not hedge_delay or backup is None:
+            return await primary_task
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_delay)
+        if done or not self.hedge_budget.try_acquire():
+            return await primary_task
+
+        self.hedges_fired += 1
+        logger.info(f"Hedging {method} from {primary.name} to {backup.name} after {hedge_delay:.3f}s")
+        backup_task = asyncio.ensure_future(getattr(backup, method)(*args))
+        return await self._first_success(primary_task, backup_task)
+
+    def _hedge_target(self, primary):
+        candidates = [
+            provider for provider, metric, breaker in zip(self.providers, self.metrics, self.breakers)
+            if provider is not primary and metric.is_healthy and breaker.is_closed and provider.rate_headroom() > 0
+        ]
+        return min(candidates, key=lambda provider: provider.get_average_latency(), default=None)
+
+    @staticmethod
+    async def _first_success(*tasks):
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def fetch_providers(self):
+        """Providers eligible for load-balanced range fetches: the healthy ones with a closed breaker,
+        else just the active one. A half-open provider only gets the prober's single trial request."""
+        healthy = [
+            provider for provider, metric, breaker in zip(self.providers, self.metrics, self.breakers)
+            if metric.is_healthy and breaker.is_closed
+        ]
+        return healthy or [self.active]
+
+    def fetch_weight(self, index):
+        """Share of range fetches for a provider: its request budget, scaled by the rate headroom it
+        has left and by its ProviderScore."""
+        metric = self.metrics[index]
+        if not metric.is_healthy or not self.breakers[index].is_closed:
+            return 0.0
+        provider = self.providers[index]
+        # a floor keeps providers that just spent their burst in rotation at a trickle
+        return metric.score * provider.max_rate_per_sec * max(provider.rate_headroom(), 0.05)
+
+    def fetch_provider(self):
+        """Next provider for a load-balanced range fetch, by smooth weighted round-robin.
+
+        Picks are spread out in proportion to `fetch_weight` instead of bunched, so concurrent
+        ranges land on different providers; falls back to the active provider when none is healthy.
+        """
+        weights = [self.fetch_weight(index) for index in range(len(self.providers))]
+        total = sum(weights)
+        if not total:
+            return self.active
+        for index, weight in enumerate(weights):
+            self._fetch_credit[index] += weight
+        chosen = max((index for index, weight in enumerate(weights) if weight), key=self._fetch_credit.__getitem__)
+        self._fetch_credit[chosen] -= total
+        return self.providers[chosen]
 
     async def switch_provider_consensus_based(self):
         if len(self.providers) < 2:
@@ -59,17 +228,170 @@ class ProviderManager:
                 for i, head in enumerate(heads):
                     if head == consensus_head:
                         self.active_index = i
+                        self.switch_count += 1
                         logger.info(f"Switched to provider {self.providers[i].name} for fork resolution")
                         return
 
+    def start_probing(self):
+        if self._prober is None and len(self.providers) > 1:
+            self._prober = asyncio.create_task(self._probe_loop())
+
+    async def stop_probing(self):
+        if self._prober is not None:
+            self._prober.cancel()
+            await asyncio.gather(self._prober, return_exceptions=True)
+            self._prober = None
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_idle_providers()
+            except Exception as e:
+                logger.error(f"Provider probe round failed {e}")
+            await asyncio.sleep(self.probe_interval_s)
+
+    async def probe_idle_providers(self):
+        """Refresh the scores of every non-active provider with one head() call each.
+
+        Probes go through ProviderClient._timed, so they count against each provider's rate limit
+        and error window. Head lag is measured against the best head seen so far, the active
+        provider's included (see record_metrics), and converted to seconds with the expected block
+        time; record_metrics scores the active provider the same way.
+        Providers whose breaker is open are skipped; a half-open one gets this head() as its single
+        trial request, which closes or re-opens the breaker.
+        """
+        idle = [
+            index for index in range(len(self.providers))
+            if index != self.active_index and self.breakers[index].allow_request()
+        ]
+        heads = await asyncio.gather(*(self.providers[index].head() for index in idle), return_exceptions=True)
+        valid_heads = [head for head in heads if not isinstance(head, Exception)]
+        if valid_heads:
+            self.best_head = max(valid_heads + ([self.best_head] if self.best_head is not None else []))
+
+        async with self._lock:
+            for index, head in zip(idle, heads):
+                if isinstance(head, Exception):
+                    lag_s = self.metrics[index].lag_thr
+                    self.breakers[index].record_failure()
+                else:
+                    lag_s = (self.best_head - head) * self.expected_block_time
+                    self._close_breaker(index)
+                self._score(index, lag_s)
+            self._rank()
+
+    def _score(self, index, lag_s):
+        provider = self.providers[index]
+        self.metrics[index].update(
+            lag_s, provider.get_error_ratio(), provider.get_latency_percentile(0.95, BLOCK_NUMBER)
+        )
+
+    def _rank(self):
+        """Order providers best first: healthy ones, then by score.
+
+        Starts from the previous order and moves a provider ahead of another only when its score
+        is more than `hysteresis` (relative) higher, so providers of about the same score keep
+        their places instead of trading them on every probe round.
+        """
+        ranking = list(self.ranking or range(len(self.providers)))
+        moved = True
+        while moved:
+            moved = False
+            for position in range(len(ranking) - 1):
+                if self._outranks(ranking[position + 1], ranking[position]):
+                    ranking[position], ranking[position + 1] = ranking[position + 1], ranking[position]
+                    moved = True
+        self.ranking = ranking
+
+    def _outranks(self, index, other):
+        metric, other_metric = self.metrics[index], self.metrics[other]
+        if metric.is_healthy != other_metric.is_healthy:
+            return metric.is_healthy
+        return metric.score > other_metric.score * (1 + self.hysteresis)
+
+    def _best_candidate(self):
+        """Best-ranked healthy provider other than the active one, skipping breakers that aren't closed."""
+        for index in self.ranking:
+            if index != self.active_index and self.breakers[index].is_closed:
+                return index if self.metrics[index].is_healthy else None
+        return None
+
+    def _switch_candidate(self):
+        if self.ranking is not None:
+            return self._best_candidate()
+        for index, metric in enumerate(self.metrics):
+            if index != self.active_index and metric.is_healthy and self.breakers[index].is_closed:
+                return index
+        return None
+
+    def _close_breaker(self, index):
+        breaker = self.breakers[index]
+        if breaker.state != CircuitBreaker.CLOSED:
+            logger.info(f"Circuit breaker for provider {self.providers[index].name} closed")
+            self._breaker_ready.set()
+        breaker.record_success()
+
+    def _activate(self, index):
+        self.active_index = index
+        self.switch_count += 1
+        logger.info(f"Switching to provider {self.active.name}")
+
+    async def report_success(self, provider):
+        """Called by the streamer after a successful iteration on `provider`."""
+        index = self.providers.index(provider)
+        if self.breakers[index].state != CircuitBreaker.CLOSED:
+            async with self._lock:
+                self._close_breaker(index)
+        else:
+            self.breakers[index].record_success()
+
+    async def report_failure(self, provider):
+        """Called after a failed request on a provider other than through `switch_to_healthy_provider`."""
+        async with self._lock:
+            self._record_failure(self.providers.index(provider))
+
+    def _record_failure(self, index):
+        breaker = self.breakers[index]
+        was_open = breaker.is_open
+        breaker.record_failure()
+        if breaker.is_open and not was_open:
+            logger.warning(
+                f"Circuit breaker for provider {self.providers[index].name} opened for {breaker.ready_in:.1f}s"
+                f" (trip {breaker.trips})"
+            )
+        return breaker
+
     async def switch_to_healthy_provider(self):
+        """Record a failure on the active provider and move to a healthy one.
+
+        Falls back to any provider whose breaker is not open once the active one trips, and only
+        waits when every breaker is open: on the breaker-ready event, for at most the time until the
+        first cool-down ends.
+        """
+        async with self._lock:
+            breaker = self._record_failure(self.active_index)
+            index = self._switch_candidate()
+            if index is None and breaker.is_open:
+                index = next((i for i, other in enumerate(self.breakers) if not other.is_open), None)
+            if index is not None:
+                self._activate(index)
+                return
+            if not breaker.is_open:
+                logger.info(f"Failed to find healthy provider")
+                return
+            self._breaker_ready.clear()
+        await self.wait_for_ready_provider()
+
+    async def wait_for_ready_provider(self):
+        """Block until some breaker half-opens or closes, then make that provider active."""
+        delay = min(breaker.ready_in for breaker in self.breakers)
+        if delay > 0:
+            logger.warning(f"All provider circuit breakers are open, next one half-opens in {delay:.1f}s")
+            try:
+                await asyncio.wait_for(self._breaker_ready.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
         async with self._lock:
-            for index, metric in enumerate(self.metrics):
-                if index == self.active_index:
-                    continue
-                if metric.is_healthy:
-                    logger.info(f"Switching to provider {self.active.name}")
-                    self.active_index = index
-                    return
-        logger.info(f"Failed to find healthy provider")
-        await asyncio.sleep(2)
+            index = min(range(len(self.providers)), key=lambda i: self.breakers[i].ready_in)
+            if index != self.active_index and not self.breakers[index].is_open:
+                self._activate(index)
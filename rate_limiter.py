@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+import aiohttp
+from web3.exceptions import Web3RPCError
+
+# Per-call compute-unit costs, as published by Alchemy; override per provider with ProviderConfig.compute_units.
+DEFAULT_COMPUTE_UNITS = {
+    "eth_blockNumber": 10,
+    "eth_chainId": 0,
+    "eth_getBlockByHash": 16,
+    "eth_getBlockByNumber": 16,
+    "eth_getLogs": 75,
+}
+
+# JSON-RPC error codes providers use for "slow down" inside an HTTP 200
+RATE_LIMIT_RPC_CODES = (429, -32005)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`.
+
+    Taking more than `capacity` at once (a large JSON-RPC batch) is allowed from a full bucket
+    and leaves it in debt, so the average rate still holds.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "_updated", "_clock")
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, amount):
+        """Seconds until `amount` tokens can be taken."""
+        missing = min(amount, self.capacity) - self.available()
+        # tolerance for float refill error, which would otherwise spin on ever-smaller sleeps
+        return missing / self.rate if missing > 1e-9 else 0.0
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+
+
+class RateLimiter:
+    """Per-provider token buckets for requests/s and, optionally, compute units/s.
+
+    Waiters are served in arrival order. On a rate-limit response (`on_throttled`) both rates
+    are halved, down to `min_rate_fraction` of the configured ones, the buckets are drained and
+    new requests pause for the provider's Retry-After. Rates then climb back linearly to the
+    configured values over `recovery_s` seconds without further throttling.
+    """
+
+    def __init__(self, requests_per_sec, compute_units_per_sec=None, burst_s=1.0, min_rate_fraction=0.1,
+                 recovery_s=30.0, clock=time.monotonic, sleep=asyncio.sleep):
+        self.requests_per_sec = requests_per_sec
+        self.compute_units_per_sec = compute_units_per_sec
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_s = recovery_s
+        self.throttle_count = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = [(TokenBucket(requests_per_sec, max(1.0, requests_per_sec * burst_s), clock), requests_per_sec)]
+        if compute_units_per_sec:
+            self._buckets.append(
+                (TokenBucket(compute_units_per_sec, compute_units_per_sec * burst_s, clock), compute_units_per_sec)
+            )
+        self._paused_until = 0.0
+        self._last_adjust = clock()
+        self._lock = asyncio.Lock()
+
+    @property
+    def requests(self):
+        return self._buckets[0][0]
+
+    @property
+    def compute_units(self):
+        return self._buckets[1][0] if len(self._buckets) > 1 else None
+
+    async def acquire(self, requests=1, compute_units=0):
+        amounts = (requests, compute_units)
+        # fast path: nobody queued ahead of us and the budget is there
+        if not self._lock.locked() and self._wait_time(amounts) <= 0:
+            self._take(amounts)
+            return
+        async with self._lock:
+            while (wait := self._wait_time(amounts)) > 0:
+                await self._sleep(wait)
+            self._take(amounts)
+
+    def _wait_time(self, amounts):
+        self._recover()
+        wait = self._paused_until - self._clock()
+        for (bucket, _), amount in zip(self._buckets, amounts):
+            wait = max(wait, bucket.wait_time(amount))
+        return wait
+
+    def _take(self, amounts):
+        for (bucket, _), amount in zip(self._buckets, amounts):
+            bucket.take(amount)
+
+    def on_throttled(self, retry_after_s=None):
+        self.throttle_count += 1
+        for bucket, configured in self._buckets:
+            bucket.set_rate(max(bucket.rate / 2, configured * self.min_rate_fraction))
+            bucket.tokens = min(bucket.tokens, 0.0)
+        now = self._clock()
+        pause = retry_after_s if retry_after_s is not None else 1 / self.requests.rate
+        self._paused_until = max(self._paused_until, now + pause)
+        self._last_adjust = now
+
+    def _recover(self):
+        now = self._clock()
+        elapsed = now - self._last_adjust
+        self._last_adjust = now
+        for bucket, configured in self._buckets:
+            if bucket.rate < configured:
+                bucket.set_rate(min(configured, bucket.rate + configured * elapsed / self.recovery_s))
+
+    @property
+    def remaining(self):
+        """Tokens left right now per budget, e.g. {"requests": 7.5, "compute_units": 120.0}."""
+        remaining = {"requests": self.requests.available()}
+        if self.compute_units is not None:
+            remaining["compute_units"] = self.compute_units.available()
+        return remaining
+
+    @property
+    def headroom(self):
+        """Fraction (0..1) of the tightest budget that is left; 0 while paused after a 429."""
+        if self._clock() < self._paused_until:
+            return 0.0
+        self._recover()
+        return max(0.0, min(bucket.available() / bucket.capacity for bucket, _ in self._buckets))
+
+
+def is_rate_limited(error):
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429
+    if isinstance(error, Web3RPCError):
+        rpc_error = (error.rpc_response or {}).get("error")
+        return isinstance(rpc_error, dict) and rpc_error.get("code") in RATE_LIMIT_RPC_CODES
+    return False
+
+
+def retry_after_s(error):
+    """Retry-After of a 429 response in seconds, None when absent or given as an HTTP date."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
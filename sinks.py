@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import orjson
+
+from block_cache import hash_key
+from block_record import BlockRecord, pack_retract
+
+logger = logging.getLogger(__name__)
+
+
+def encode_ndjson(record) -> bytes:
+    # BlockRecord hashes are raw bytes; this is the only place they become hex
+    if type(record) is BlockRecord:
+        return record.to_ndjson()
+    return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def encode_binary(record) -> bytes:
+    """Fixed-width wire record (block_record.WIRE_FORMAT); decode with block_record.unpack_records."""
+    if isinstance(record, BlockRecord):
+        return record.pack()
+    if record.get("event") == "retract":
+        return pack_retract(record["number"], hash_key(record["hash"]))
+    raise TypeError(f"Cannot encode {record!r} as a binary record")
+
+
+ENCODERS = {"ndjson": encode_ndjson, "binary": encode_binary}
+
+
+class OutputError(Exception):
+    """The output sink failed. The records it did not take are kept and retried by the next writer."""
+
+
+class BlockSink:
+    """Destination for encoded batches (NDJSON or binary records). Writes may buffer; `flush` makes them visible."""
+
+    async def start(self):
+        """Called once before the stream starts, e.g. to start listening."""
+
+    async def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    async def write_records(self, records, frames):
+        """Write a batch given as its records and their encodings (`frames`, one per record).
+
+        Sinks that need record boundaries override this; the rest get the frames as one chunk.
+        """
+        await self.write(b"".join(frames))
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+
+class TeeSink(BlockSink):
+    """Writes every batch to each of `sinks` in turn, e.g. a file and a SubscriptionServer."""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    async def start(self):
+        for sink in self.sinks:
+            await sink.start()
+
+    async def write_records(self, records, frames):
+        for sink in self.sinks:
+            await sink.write_records(records, frames)
+
+    async def flush(self):
+        for sink in self.sinks:
+            await sink.flush()
+
+    async def close(self):
+        for sink in self.sinks:
+            await sink.close()
+
+
+class NdjsonSink(BlockSink):
+    """NDJSON to a file path, or to the process's stdout when no path is given."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = open(path, "ab") if path else None
+
+    @property
+    def _stream(self):
+        if self._file is not None:
+            return self._file
+        # resolved per call so redirected/captured stdout is honoured
+        return getattr(sys.stdout, "buffer", None) or sys.stdout
+
+    async def write(self, chunk: bytes):
+        stream = self._stream
+        stream.write(chunk if stream is not sys.stdout else chunk.decode())
+
+    async def flush(self):
+        self._stream.flush()
+
+    async def close(self):
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+
+
+class RotatingFileSink(BlockSink):
+    """NDJSON file rolled over to path.1 .. path.<backup_count> once it exceeds max_bytes."""
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+
+    async def write(self, chunk: bytes):
+        if self._size and self._size + len(chunk) > self.max_bytes:
+            self._rotate()
+        self._file.write(chunk)
+        self._size += len(chunk)
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        self._size = 0
+
+    async def flush(self):
+        self._file.flush()
+
+    async def close(self):
+        await self.flush()
+        self._file.close()
+
+
+class SocketSink(BlockSink):
+    """NDJSON over a local TCP (host/port) or Unix (path) stream socket, connected on first write.
+
+    Chunks written since the last successful flush are kept, and sent again first when a failed
+    connection is replaced on the next write.
+    """
+
+    def __init__(self, host=None, port=None, path=None):
+        if path is None and (host is None or port is None):
+            raise ValueError("SocketSink needs either a Unix socket path or a host and port")
+        self.host = host
+        self.port = port
+        self.path = path
+        self._writer = None
+        self._unflushed = []
+
+    async def _connect(self):
+        if self.path is not None:
+            _, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            _, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def write(self, chunk: bytes):
+        if self._writer is None:
+            await self._connect()
+            for unflushed in self._unflushed:
+                self._writer.write(unflushed)
+        self._unflushed.append(chunk)
+        self._writer.write(chunk)
+
+    async def flush(self):
+        if self._writer is not None:
+            # drain applies the consumer's TCP backpressure to the pipeline
+            try:
+                await self._writer.drain()
+            except Exception:
+                # e.g. the consumer restarted: the next write reconnects
+                self._writer.close()
+                self._writer = None
+                raise
+            self._unflushed.clear()
+
+    async def close(self):
+        if self._writer is not None:
+            await self.flush()
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+class SinkPipeline:
+    """Bounded queue between the block fetcher and a sink.
+
+    `put` blocks while `queue_size` records are waiting, so a slow sink slows the fetcher down
+    instead of buffering without limit. A writer task drains up to `batch_size` records at a
+    time, encodes them with `encoder` (NDJSON by default) in one pass and writes them as a single
+    chunk; the sink is flushed at least every `flush_interval_s` and whenever `flush()` is awaited.
+
+    When the sink fails, the writer task ends and the next `put` or `flush` raises OutputError.
+    The batch that failed stays queued ahead of the rest, so the writer the call after starts
+    retries it in order.
+    """
+
+    def __init__(self, sink, queue_size=1024, batch_size=256, flush_interval_s=0.1, encoder=encode_ndjson):
+        self.sink = sink
+        self.encoder = encoder
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.records_written = 0
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._writer = None
+        self._unwritten = None  # the batch a failed writer left, written first by the next one
+        self._last_flush = time.monotonic()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    async def put(self, record):
+        self._ensure_writer()
+        if not self._queue.full():
+            self._queue.put_nowait(record)
+            return
+        # a writer that dies while the queue is full would never make room
+        put = asyncio.ensure_future(self._queue.put(record))
+        try:
+            await asyncio.wait({put, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+        if not put.done():
+            self._raise_writer_failure()
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+        elif self._writer.done():
+            # surface the sink failure to the producer instead of queueing into a dead writer
+            self._raise_writer_failure()
+
+    def _raise_writer_failure(self):
+        writer, self._writer = self._writer, None
+        error = None if writer.cancelled() else writer.exception()
+        raise OutputError(f"Output sink failed: {error!r}") from error
+
+    async def _write_loop(self):
+        if self._unwritten is not None:
+            batch, self._unwritten = self._unwritten, None
+            await self._write_batch(batch)
+        while True:
+            timeout = max(0.0, self.flush_interval_s - (time.monotonic() - self._last_flush))
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._flush_sink()
+                record = await self._queue.get()
+            batch = [record]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch):
+        try:
+            await self.sink.write_records(batch, list(map(self.encoder, batch)))
+        except BaseException:
+            # still unfinished for the queue's join, so flush() waits for the retry
+            self._unwritten = batch
+            raise
+        self.records_written += len(batch)
+        for _ in batch:
+            self._queue.task_done()
+        if time.monotonic() - self._last_flush >= self.flush_interval_s:
+            await self._flush_sink()
+
+    async def _flush_sink(self):
+        await self.sink.flush()
+        self._last_flush = time.monotonic()
+
+    async def start(self):
+        await self.sink.start()
+
+    async def flush(self):
+        """Wait until every queued record is written, then flush the sink."""
+        if self._writer is None:
+            if self._queue.empty() and self._unwritten is None:
+                return
+            self._ensure_writer()  # records a failed writer left
+        join = asyncio.ensure_future(self._queue.join())
+        await asyncio.wait({join, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+        if self._writer.done():
+            join.cancel()
+            self._raise_writer_failure()
+        try:
+            await self._flush_sink()
+        except Exception as e:
+            raise OutputError(f"Output sink failed: {e!r}") from e
+
+    async def stop(self):
+        """Drain and stop the writer task, leaving the sink open."""
+        try:
+            await self.flush()
+        finally:
+            if self._writer is not None:
+                self._writer.cancel()
+                await asyncio.gather(self._writer, return_exceptions=True)
+                self._writer = None
+
+    async def close(self):
+        await self.stop()
+        await self.sink.close()
+
+
+def build_sink(output_cfg):
+    if output_cfg.type == "stdout":
+        return NdjsonSink()
+    if output_cfg.type == "file":
+        return NdjsonSink(output_cfg.path)
+    if output_cfg.type == "rotating_file":
+        return RotatingFileSink(output_cfg.path, output_cfg.max_bytes, output_cfg.backup_count)
+    if output_cfg.type == "tcp":
+        return SocketSink(host=output_cfg.host, port=output_cfg.port)
+    if output_cfg.type == "unix":
+        return SocketSink(path=output_cfg.path)
+    raise ValueError(f"Unknown output type {output_cfg.type}")
+
+
+def build_encoder(output_cfg):
+    try:
+        return ENCODERS[output_cfg.format]
+    except KeyError:
+        raise ValueError(f"Unknown output format {output_cfg.format}") from None
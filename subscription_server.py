@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from collections import deque
+from itertools import islice
+
+import orjson
+
+from block_record import BlockRecord
+from sinks import BlockSink
+
+logger = logging.getLogger(__name__)
+
+DISCONNECT = "disconnect"
+DROP_OLDEST = "drop_oldest"
+
+
+class Subscriber:
+    """One connected consumer: encoded chunks waiting to be written to its socket.
+
+    `pending` counts the records in `chunks`; chunks replayed at subscribe time are not counted.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.chunks = deque()  # (chunk, record count)
+        self.pending = 0
+        self.ready = asyncio.Event()
+        self.task = None
+
+    @property
+    def peer(self):
+        return self.writer.get_extra_info("peername")
+
+    def push(self, chunk, count):
+        transport = self.writer.transport
+        if not self.chunks and transport.get_write_buffer_size() < transport.get_write_buffer_limits()[1]:
+            # nothing queued and the socket keeps up: write now, without waking the send task
+            transport.write(chunk)
+            return
+        self.chunks.append((chunk, count))
+        self.pending += count
+        self.ready.set()
+
+    def drop_oldest(self, room):
+        """Drop queued chunks, oldest first, until at most `room` records are pending; returns how many were dropped."""
+        dropped = 0
+        while self.chunks and self.pending > room:
+            _, count = self.chunks.popleft()
+            self.pending -= count
+            dropped += count
+        return dropped
+
+    def take(self):
+        chunk = b"".join([chunk for chunk, _ in self.chunks])
+        self.chunks.clear()
+        self.pending = 0
+        self.ready.clear()
+        return chunk
+
+
+class SubscriptionServer(BlockSink):
+    """Fans the streamer's output out to local TCP subscribers.
+
+    Used as (part of) a SinkPipeline's sink, so every record is encoded once by the pipeline and
+    the same bytes go to every subscriber. A subscriber connects and sends one JSON line, `{}` to
+    follow the stream live or `{"from_block": N}` to start at block N. The server answers with
+    one JSON line (`{"subscribed": true, ...}` or `{"error": ...}`, after which it closes) and
+    then writes records in the pipeline's encoding.
+
+    Resuming replays from the newest emission of block N in a ring of the last `replay_size`
+    records, retractions included, so the subscriber sees the same sequence a live one did.
+
+    Records go straight to a subscriber's socket while less than `socket_buffer_bytes` are waiting
+    to be sent there; past that they queue in the subscriber's own buffer of `buffer_size`
+    records, which its send task drains as the socket allows. When that buffer is full,
+    `slow_consumer` decides what happens: "disconnect" closes the connection, and "drop_oldest"
+    discards the oldest queued records, which the subscriber sees as a gap in block numbers.
+    Either way a slow subscriber never slows the stream or the other subscribers down.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9200, buffer_size=4096, slow_consumer=DISCONNECT, replay_size=10_000,
+                 socket_buffer_bytes=64 * 1024, handshake_timeout_s=5.0):
+        if slow_consumer not in (DISCONNECT, DROP_OLDEST):
+            raise ValueError(f"Unknown slow_consumer policy {slow_consumer}")
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.slow_consumer = slow_consumer
+        self.socket_buffer_bytes = socket_buffer_bytes
+        self.handshake_timeout_s = handshake_timeout_s
+        self.subscribers = set()
+        self.replay = deque(maxlen=replay_size)  # (number, is_block, frame)
+        self.head_number = None  # number of the newest block still on the canonical chain
+        self.disconnects = 0  # slow subscribers closed by the server
+        self.dropped_records = 0
+        self._server = None
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            logger.info(f"Subscription server listening on {self.host}:{self.port}")
+
+    async def write(self, chunk: bytes):
+        raise TypeError("SubscriptionServer needs record boundaries; write through write_records")
+
+    async def write_records(self, records, frames):
+        for record, frame in zip(records, frames):
+            if type(record) is BlockRecord:
+                self.replay.append((record.number, True, frame))
+                self.head_number = record.number
+            else:
+                self.replay.append((record["number"], False, frame))
+                self.head_number = record["number"] - 1
+        if self.subscribers:
+            self._publish(b"".join(frames), len(frames))
+
+    def _publish(self, chunk, count):
+        room = self.buffer_size - count
+        for subscriber in list(self.subscribers):
+            if subscriber.writer.transport.is_closing():
+                # gone, its handler just hasn't run yet
+                self.subscribers.discard(subscriber)
+                continue
+            if subscriber.pending > room:
+                if self.slow_consumer == DISCONNECT:
+                    logger.warning(f"Subscriber {subscriber.peer} is {subscriber.pending} records behind, disconnecting")
+                    self._disconnect(subscriber)
+                    continue
+                self.dropped_records += subscriber.drop_oldest(room)
+            subscriber.push(chunk, count)
+
+    def replay_from(self, from_block):
+        """Frames a subscriber starting at `from_block` has missed: from the newest emission of that block on.
+
+        Raises LookupError when that block is older than the replay ring or ahead of the stream.
+        """
+        if self.head_number is None or from_block == self.head_number + 1:
+            return []
+        if from_block > self.head_number + 1:
+            raise LookupError(f"Block {from_block} is ahead of the stream head {self.head_number}")
+        for depth, (number, is_block, _) in enumerate(reversed(self.replay)):
+            if is_block and number == from_block:
+                return [frame for _, _, frame in islice(self.replay, len(self.replay) - depth - 1, None)]
+        raise LookupError(f"Block {from_block} is no longer in the replay buffer")
+
+    async def _handle(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.handshake_timeout_s)
+            request = orjson.loads(line or b"{}")
+            from_block = request.get("from_block")
+            # no await between collecting the replay and subscribing, so no record falls in between
+            replay = self.replay_from(from_block) if from_block is not None else []
+        except (asyncio.TimeoutError, orjson.JSONDecodeError, AttributeError, TypeError, LookupError) as e:
+            writer.write(orjson.dumps({"error": str(e) or type(e).__name__}, option=orjson.OPT_APPEND_NEWLINE))
+            await self._close_writer(writer)
+            return
+        writer.transport.set_write_buffer_limits(high=self.socket_buffer_bytes)
+        subscriber = Subscriber(writer)
+        writer.write(orjson.dumps(
+            {"subscribed": True, "from_block": from_block, "replayed": len(replay)}, option=orjson.OPT_APPEND_NEWLINE
+        ))
+        if replay:
+            subscriber.push(b"".join(replay), 0)
+        self.subscribers.add(subscriber)
+        subscriber.task = asyncio.current_task()
+        # a caught-up subscriber is written to directly and its send task sleeps, so only the
+        # reading side notices the subscriber going away
+        sending = asyncio.ensure_future(self._send_loop(subscriber))
+        closed = asyncio.ensure_future(self._wait_for_eof(reader))
+        try:
+            await asyncio.wait({sending, closed}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            for task in (sending, closed):
+                if task.done() and not task.cancelled():
+                    task.exception()  # e.g. a ConnectionError: the subscriber is gone either way
+                task.cancel()
+            await self._close_writer(writer)
+
+    async def _send_loop(self, subscriber):
+        while True:
+            await subscriber.ready.wait()
+            subscriber.writer.write(subscriber.take())
+            # drain applies this subscriber's TCP backpressure to its own buffer only
+            await subscriber.writer.drain()
+
+    @staticmethod
+    async def _wait_for_eof(reader):
+        # nothing is expected after the handshake; whatever arrives is discarded
+        while await reader.read(4096):
+            pass
+
+    def _disconnect(self, subscriber):
+        self.subscribers.discard(subscriber)
+        self.disconnects += 1
+        subscriber.task.cancel()
+
+    @staticmethod
+    async def _close_writer(writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for subscriber in list(self.subscribers):
+                subscriber.task.cancel()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,139 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from config import ProviderConfig
+
+
+class FakeClock:
+    """Stand-in for the `clock=` arguments: time moves only when a test sets `now` or awaits `sleep`."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def rpc_block(block_number, tx_count=3):
+    return {
+        "number": hex(block_number),
+        "hash": f"0x{block_number:064x}",
+        "parentHash": f"0x{block_number - 1:064x}",
+        "timestamp": hex(1000000 + block_number),
+        "transactions": [f"0x{i:064x}" for i in range(tx_count)],
+    }
+
+
+def log_matches(log, log_filter):
+    if "blockHash" in log_filter:
+        in_range = log["blockHash"] == log_filter["blockHash"]
+    else:
+        in_range = int(log_filter["fromBlock"], 16) <= int(log["blockNumber"], 16) <= int(log_filter["toBlock"], 16)
+    return in_range and log["address"] in log_filter.get("address", [log["address"]])
+
+
+class RpcStub:
+    """Minimal JSON-RPC node on localhost answering eth_blockNumber, eth_getBlockByNumber/ByHash and eth_getLogs.
+
+    eth_getLogs serves the raw logs in `logs` by block range or hash and address (topics are not checked).
+
+    WebSocket clients on /ws can eth_subscribe to newHeads, which `push_head` feeds.
+    """
+
+    def __init__(self, head=1000, reject_batches=False):
+        self.head = head
+        self.reject_batches = reject_batches
+        self.batch_error = {"code": -32600, "message": "batch requests not supported"}  # answer to a rejected batch
+        self.posts = []
+        self.logs = []
+        self.blooms = {}  # block number -> logsBloom hex, for blocks that should carry one
+        self.block_errors = {}  # block number -> error object eth_getBlockByNumber answers instead of the block
+        self.subscribers = []
+        self.peers = set()  # client (host, port) per TCP connection seen
+
+    async def push_head(self, block_number):
+        self.head = block_number
+        for ws in list(self.subscribers):
+            await ws.send_json({
+                "jsonrpc": "2.0",
+                "method": "eth_subscription",
+                "params": {"subscription": "0x1", "result": rpc_block(block_number, tx_count=0)},
+            })
+
+    async def drop_subscribers(self):
+        for ws in list(self.subscribers):
+            await ws.close()
+
+    def _answer(self, request):
+        if request["method"] == "eth_blockNumber":
+            result = hex(self.head)
+        elif request["method"] == "eth_getBlockByNumber":
+            block_number = int(request["params"][0], 16)
+            if block_number in self.block_errors:
+                return {"jsonrpc": "2.0", "id": request["id"], "error": self.block_errors[block_number]}
+            result = rpc_block(block_number) if block_number <= self.head else None
+            if result is not None and block_number in self.blooms:
+                result["logsBloom"] = self.blooms[block_number]
+        elif request["method"] == "eth_getBlockByHash":
+            block_number = int(request["params"][0], 16)
+            result = rpc_block(block_number) if block_number <= self.head else None
+        elif request["method"] == "eth_getLogs":
+            result = [log for log in self.logs if log_matches(log, request["params"][0])]
+        else:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": "method not found"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+    async def handle(self, http_request):
+        body = await http_request.json()
+        self.posts.append(body)
+        self.peers.add(http_request.transport.get_extra_info("peername"))
+        if isinstance(body, list):
+            if self.reject_batches:
+                return web.json_response({"jsonrpc": "2.0", "id": None, "error": self.batch_error})
+            return web.json_response([self._answer(request) for request in body])
+        return web.json_response(self._answer(body))
+
+    async def handle_ws(self, http_request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(http_request)
+        async for message in ws:
+            request = message.json()
+            await ws.send_json({"jsonrpc": "2.0", "id": request["id"], "result": "0x1"})
+            self.subscribers.append(ws)
+        self.subscribers.remove(ws)
+        return ws
+
+
+@pytest.fixture
+def rpc_stub():
+    return RpcStub()
+
+
+@pytest_asyncio.fixture
+async def rpc_url(rpc_stub):
+    app = web.Application()
+    app.router.add_post("/", rpc_stub.handle)
+    app.router.add_get("/ws", rpc_stub.handle_ws)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}/"
+    await runner.cleanup()
+
+
+@pytest.fixture
+def provider_config(rpc_url):
+    return ProviderConfig(name="Stub", url=rpc_url, max_batch_size=10, ws_url=rpc_url.replace("http", "ws") + "ws")
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
+import pytest
+import pytest_asyncio
+from web3.exceptions import BlockNotFound
+
+from backfill import Backfill, BackfillProgress, Manifest, decode_block_range
+from block_record import BlockRecord, unpack_records
+from block_validator import BlockInconsistentHashError
+from config import ProviderConfig
+from conftest import FakeClock, rpc_block
+from lease_coordinator import SQLiteLeaseCoordinator
+from provider_client import ProviderClient
+from provider_manager import ProviderManager
+
+
+def batch_body(start, end, first_id=1):
+    return orjson.dumps([
+        {"jsonrpc": "2.0", "id": first_id + i, "result": rpc_block(number)} for i, number in enumerate(range(start, end + 1))
+    ])
+
+
+@pytest_asyncio.fixture
+async def manager(provider_config):
+    providers = [ProviderClient(provider_config)]
+    yield ProviderManager(providers, lag_thr=30, error_thr=0.5, window_s=10)
+    for provider in providers:
+        await provider.close()
+
+
+def read_ndjson(path):
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f]
+
+
+class TestDecodeBlockRange:
+    def test_packs_records_in_id_order(self):
+        responses = orjson.loads(batch_body(100, 104))
+        body = orjson.dumps(list(reversed(responses)))
+
+        records = list(unpack_records(decode_block_range(body, 100, 104)))
+
+        assert [record.number for record in records] == list(range(100, 105))
+        assert records[0] == BlockRecord.from_rpc(rpc_block(100))
+
+    def test_checks_the_link_to_the_previous_batch(self):
+        with pytest.raises(BlockInconsistentHashError):
+            decode_block_range(batch_body(100, 104), 100, 104, parent_hash=b"\x01" * 32)
+
+        assert decode_block_range(batch_body(100, 104), 100, 104, parent_hash=(99).to_bytes(32, "big"))
+
+    def test_missing_block_raises(self):
+        responses = orjson.loads(batch_body(100, 101))
+        responses[1]["result"] = None
+
+        with pytest.raises(BlockNotFound):
+            decode_block_range(orjson.dumps(responses), 100, 101)
+
+    def test_single_error_object_means_no_batch_support(self):
+        body = orjson.dumps({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "no batches"}})
+
+        assert decode_block_range(body, 100, 101) is None
+
+
+class TestManifest:
+    def test_chunks_cover_the_range(self, tmp_path):
+        manifest = Manifest(str(tmp_path / "manifest.json"), 100, 124, 10)
+
+        assert list(manifest.chunks()) == [(100, 109), (110, 119), (120, 124)]
+
+    def test_done_chunks_survive_a_restart(self, tmp_path):
+        path = str(tmp_path / "manifest.json")
+        Manifest(path, 100, 124, 10).mark_done(110)
+
+        assert Manifest(path, 100, 124, 10).done == {110}
+
+    def test_refuses_a_different_range(self, tmp_path):
+        path = str(tmp_path / "manifest.json")
+        Manifest(path, 100, 124, 10).save()
+
+        with pytest.raises(ValueError):
+            Manifest(path, 100, 200, 10)
+
+
+class TestBackfillProgress:
+    def test_rate_and_eta_count_only_this_run(self):
+        clock = FakeClock(0.0)
+        progress = BackfillProgress(1000, done_blocks=400, clock=clock)
+
+        clock.now = 2.0
+        progress.add(200)
+
+        assert progress.rate == 100
+        assert progress.eta_s == 4.0
+        assert str(progress) == "600/1000 blocks (60.0%), 100 blocks/s, ETA 0m04s"
+
+    def test_eta_unknown_before_any_block(self):
+        assert "ETA unknown" in str(BackfillProgress(1000, clock=FakeClock()))
+
+
+class TestBackfill:
+    @pytest.mark.asyncio
+    async def test_fetches_and_stitches_the_range(self, manager, rpc_stub, tmp_path):
+        backfill = Backfill(manager, 100, 124, str(tmp_path), chunk_size=10, concurrency=2)
+
+        path = await backfill.run()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 125))
+        assert read_ndjson(path)[0] == BlockRecord.from_rpc(rpc_block(100)).to_dict()
+        # one batch (max_batch_size 10) per chunk
+        assert [len(post) for post in rpc_stub.posts] == [10, 10, 5]
+        with open(tmp_path / "manifest.json") as f:
+            assert json.load(f)["done"] == [100, 110, 120]
+
+    @pytest.mark.asyncio
+    async def test_binary_output_is_the_joined_chunks(self, manager, tmp_path):
+        backfill = Backfill(manager, 100, 124, str(tmp_path), chunk_size=10, output_format="binary")
+
+        path = await backfill.run()
+
+        with open(path, "rb") as f:
+            records = list(unpack_records(f.read()))
+        assert records == [BlockRecord.from_rpc(rpc_block(number)) for number in range(100, 125)]
+
+    @pytest.mark.asyncio
+    async def test_killed_run_resumes_with_unfinished_chunks(self, manager, rpc_stub, tmp_path):
+        rpc_stub.head = 115  # blocks past the head are missing, so the last chunks fail
+        backfill = Backfill(manager, 100, 124, str(tmp_path), chunk_size=10, concurrency=1, max_attempts=1)
+        with pytest.raises(BlockNotFound):
+            await backfill.run()
+        assert Manifest(str(tmp_path / "manifest.json"), 100, 124, 10).done == {100}
+
+        rpc_stub.head = 1000
+        rpc_stub.posts.clear()
+        resumed = Backfill(manager, 100, 124, str(tmp_path), chunk_size=10)
+        path = await resumed.run()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 125))
+        assert sorted(int(post[0]["params"][0], 16) for post in rpc_stub.posts) == [110, 120]
+        assert resumed.progress.done_blocks == 25
+
+    @pytest.mark.asyncio
+    async def test_broken_chunk_boundary_is_fetched_again(self, manager, rpc_stub, tmp_path):
+        backfill = Backfill(manager, 100, 124, str(tmp_path), chunk_size=10)
+        await backfill.run()
+        # a chunk from another fork: internally consistent, but linked to neither neighbour
+        fork = [BlockRecord(n, b"\x01" + n.to_bytes(31, "big"), b"\x01" + (n - 1).to_bytes(31, "big"), 1, 0)
+                for n in range(110, 120)]
+        with open(tmp_path / "chunks" / "110.bin", "wb") as f:
+            f.write(b"".join(record.pack() for record in fork))
+
+        assert backfill.stitch() == [100, 110, 120]
+
+        rpc_stub.posts.clear()
+        path = await backfill.run()
+
+        assert [block["hash"] for block in read_ndjson(path)] == [f"0x{n:064x}" for n in range(100, 125)]
+        assert sorted(int(post[0]["params"][0], 16) for post in rpc_stub.posts) == [100, 110, 120]
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_single_calls_when_batches_rejected(self, manager, rpc_stub, tmp_path):
+        rpc_stub.reject_batches = True
+
+        path = await Backfill(manager, 100, 114, str(tmp_path), chunk_size=10).run()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 115))
+        assert manager.providers[0].batch_supported is False
+
+    @pytest.mark.asyncio
+    async def test_failed_provider_is_skipped(self, provider_config, rpc_stub, tmp_path):
+        dead = ProviderClient(ProviderConfig(name="Dead", url="http://127.0.0.1:1/", max_batch_size=10))
+        providers = [dead, ProviderClient(provider_config)]
+        manager = ProviderManager(providers, lag_thr=30, error_thr=0.5, window_s=10, breaker_failure_threshold=1,
+                                  breaker_base_cooldown_s=60)
+        try:
+            path = await Backfill(manager, 100, 149, str(tmp_path), chunk_size=10, concurrency=1).run()
+        finally:
+            for provider in providers:
+                await provider.close()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 150))
+        assert manager.breakers[0].is_open
+        assert dead.request_count == 1
+
+    @pytest.mark.asyncio
+    async def test_decodes_in_a_process_pool(self, manager, tmp_path):
+        with ProcessPoolExecutor(1) as executor:
+            path = await Backfill(manager, 100, 124, str(tmp_path), chunk_size=10, executor=executor).run()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 125))
+        assert not os.path.exists(path + ".part")
+
+
+class TestPartitionedBackfill:
+    @pytest.mark.asyncio
+    async def test_instances_split_the_chunks(self, manager, rpc_stub, tmp_path):
+        lease_path = str(tmp_path / "lease.sqlite")
+        directory = str(tmp_path / "backfill")
+        instances = [
+            Backfill(manager, 100, 149, directory, chunk_size=10, concurrency=1,
+                     coordinator=SQLiteLeaseCoordinator(lease_path, holder=holder))
+            for holder in ("a", "b")
+        ]
+
+        paths = await asyncio.gather(*(backfill.run() for backfill in instances))
+
+        assert paths[0] == paths[1]
+        assert [block["number"] for block in read_ndjson(paths[0])] == list(range(100, 150))
+        # every chunk fetched once, by one instance or the other
+        assert sorted(int(post[0]["params"][0], 16) for post in rpc_stub.posts) == [100, 110, 120, 130, 140]
+        assert all(backfill.progress.done_blocks == 50 for backfill in instances)
+        assert all(backfill.progress._fetched > 0 for backfill in instances)
+
+    @pytest.mark.asyncio
+    async def test_chunk_of_a_dead_instance_is_claimed_once_its_lease_expires(self, manager, rpc_stub, tmp_path):
+        lease_path = str(tmp_path / "lease.sqlite")
+        directory = str(tmp_path / "backfill")
+        dead = SQLiteLeaseCoordinator(lease_path, holder="dead", ttl_s=0.3)
+        dead.acquire(f"backfill:{os.path.abspath(directory)}:110")
+        backfill = Backfill(manager, 100, 129, directory, chunk_size=10,
+                            coordinator=SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=0.3))
+
+        path = await backfill.run()
+
+        assert [block["number"] for block in read_ndjson(path)] == list(range(100, 130))
+        assert int(rpc_stub.posts[-1][0]["params"][0], 16) == 110
@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from block_cache import RecentBlockCache, hash_key
+from block_record import BlockRecord
+from block_streamer import BlockStreamService
+
+
+def block_hash(block_number):
+    return f"0x{block_number:064x}"
+
+
+@pytest.fixture
+def cache():
+    cache = RecentBlockCache(capacity=4)
+    for block_number in range(100, 104):
+        cache.put(block_number, block_hash(block_number), {"number": block_number})
+    return cache
+
+
+class TestRecentBlockCache:
+    def test_lookup_by_number_and_hash(self, cache):
+        assert cache.get(102) == {"number": 102}
+        assert cache.get_by_hash(block_hash(102)) == {"number": 102}
+        # hex without the 0x prefix addresses the same entry
+        assert cache.get_by_hash(block_hash(102)[2:]) == {"number": 102}
+        assert cache.hash_of(102) == hash_key(block_hash(102))
+
+    def test_ring_evicts_oldest(self, cache):
+        cache.put(104, block_hash(104), {"number": 104})
+
+        assert cache.get(100) is None
+        assert cache.get_by_hash(block_hash(100)) is None
+        assert len(cache) == 4
+        assert cache.latest_number == 104
+
+    def test_invalidate_from_drops_orphaned_blocks(self, cache):
+        cache.invalidate_from(102)
+
+        assert cache.get(102) is None and cache.get(103) is None
+        assert cache.get_by_hash(block_hash(103)) is None
+        assert cache.get(101) == {"number": 101}
+        assert cache.latest_number == 101
+
+    def test_hit_and_miss_counters(self, cache):
+        cache.get(101)
+        cache.get(99)
+        cache.get_by_hash(block_hash(103))
+        cache.get_by_hash(block_hash(7))
+
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert cache.hit_ratio == 0.5
+
+
+@pytest.mark.asyncio
+async def test_streamer_caches_emitted_blocks():
+    manager = AsyncMock()
+    manager.active.get_block_record.side_effect = lambda n: BlockRecord(
+        n, hash_key(block_hash(n)), hash_key(block_hash(n - 1)), 1000000 + n, 0
+    )
+    cache = RecentBlockCache(capacity=8)
+    service = BlockStreamService(manager, 99, lean_fetch=True, block_cache=cache)
+
+    await service.process_blocks(110)
+
+    assert cache.latest_number == 110
+    assert [cache.get(n).number for n in range(103, 111)] == list(range(103, 111))
+    assert cache.get(102) is None
+
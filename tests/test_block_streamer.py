@@ -1,8 +1,18 @@
+import asyncio
+import json
+import time
+
 import pytest
 from unittest.mock import MagicMock, call, AsyncMock
 
+from block_cache import RecentBlockCache, hash_key
+from block_record import BlockRecord
 from block_streamer import BlockStreamService
 from block_validator import BlockInconsistentHashError, BlockCorruptedDataError
+from poll_scheduler import PollScheduler
+from provider_client import ProviderClient
+from provider_manager import ProviderManager
+from sinks import BlockSink, SinkPipeline
 
 
 @pytest.fixture
@@ -32,10 +42,9 @@ def block_stream_service(mock_provider_manager):
 def create_mock_block(block_number):
     block = MagicMock()
     block.number = block_number
-    block.hash = MagicMock()
-    block.hash.hex.return_value = f"0x{'0' * 62}{block_number:02x}"
-    block.parentHash = MagicMock()
-    block.parentHash.hex.return_value = f"0x{'0' * 62}{block_number-1:02x}"
+    # raw bytes, as web3's HexBytes
+    block.hash = bytes.fromhex(f"{'0' * 62}{block_number:02x}")
+    block.parentHash = bytes.fromhex(f"{'0' * 62}{block_number-1:02x}")
     block.timestamp = 1000000 + block_number
     block.transactions = [f"tx_{i}" for i in range(3)]  # Mock 3 transactions
     return block
@@ -53,7 +62,7 @@ class TestBlockStreamService:
 
         mock_provider.get_block.assert_has_calls(expected_calls)
         assert block_stream_service.last_processed_block == 100
-        assert block_stream_service.last_hash == blocks[-1].hash.hex()
+        assert block_stream_service.last_hash == blocks[-1].hash
         assert block_stream_service.last_block_ts == blocks[-1].timestamp
 
     @pytest.mark.asyncio
@@ -61,7 +70,7 @@ class TestBlockStreamService:
         block_stream_service.last_processed_block = 97
         blocks = [create_mock_block(i) for i in range(97, 100)]
         mock_provider.get_block.side_effect = blocks
-        blocks[1].hash.hex.return_value = None
+        blocks[1].hash = b""
 
         with pytest.raises(BlockCorruptedDataError):
             await block_stream_service.process_blocks(100)
@@ -71,10 +80,407 @@ class TestBlockStreamService:
         block_stream_service.last_processed_block = 97
         blocks = [create_mock_block(i) for i in range(97, 100)]
         mock_provider.get_block.side_effect = blocks
-        blocks[1].hash.hex.return_value = 'not a number'
+        blocks[1].hash = b"\xff" * 32
 
         with pytest.raises(BlockInconsistentHashError):
             await block_stream_service.process_blocks(100)
 
 
+def create_chained_block(block_number):
+    block = create_mock_block(block_number)
+    block.hash = hash_key(f"0x{block_number:064x}")
+    block.parentHash = hash_key(f"0x{block_number - 1:064x}")
+    return block
+
+
+class TestPipelinedCatchUp:
+    @pytest.fixture
+    def pipelined_service(self, mock_provider, mock_provider_manager):
+        mock_provider.max_rate_per_sec = 8
+        mock_provider.get_average_latency = MagicMock(return_value=0.0)
+        return BlockStreamService(mock_provider_manager, last_processed_block_number=99, max_catchup_window=8)
+
+    @pytest.mark.asyncio
+    async def test_out_of_order_responses_are_emitted_in_order(self, mock_provider, pipelined_service, capsys):
+        async def get_block(number):
+            # later blocks answer first so the reorder buffer has to hold them back
+            await asyncio.sleep((120 - number) * 0.001)
+            return create_chained_block(number)
+        mock_provider.get_block.side_effect = get_block
+
+        await pipelined_service.process_blocks(120)
+
+        emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [record["number"] for record in emitted] == list(range(100, 121))
+        assert pipelined_service.last_processed_block == 120
+        assert pipelined_service.last_hash == hash_key(f"0x{120:064x}")
+
+    @pytest.mark.asyncio
+    async def test_window_bounds_in_flight_requests(self, mock_provider, pipelined_service):
+        in_flight = 0
+        peak = 0
+
+        async def get_block(number):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return create_chained_block(number)
+        mock_provider.get_block.side_effect = get_block
+        mock_provider.max_rate_per_sec = 4
+
+        await pipelined_service.process_blocks(140)
+
+        assert peak == 4
+        assert pipelined_service.last_processed_block == 140
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_stops_at_last_valid_block(self, mock_provider, pipelined_service):
+        async def get_block(number):
+            if number == 105:
+                raise Exception("Provider failed")
+            return create_chained_block(number)
+        mock_provider.get_block.side_effect = get_block
+
+        with pytest.raises(Exception, match="Provider failed"):
+            await pipelined_service.process_blocks(120)
+
+        assert pipelined_service.last_processed_block == 104
+        assert pipelined_service.last_hash == hash_key(f"0x{104:064x}")
+
+    @pytest.mark.asyncio
+    async def test_batched_catch_up_fetches_ranges(self, mock_provider, mock_provider_manager):
+        mock_provider.max_rate_per_sec = 8
+        mock_provider.get_average_latency = MagicMock(return_value=0.0)
+        mock_provider.get_blocks.side_effect = lambda start, end: [create_chained_block(n) for n in range(start, end + 1)]
+        service = BlockStreamService(mock_provider_manager, 99, max_catchup_window=2, catchup_batch_size=10)
+
+        await service.process_blocks(125)
+
+        mock_provider.get_blocks.assert_has_calls([call(100, 109), call(110, 119), call(120, 125)])
+        assert service.last_processed_block == 125
+
+    @pytest.mark.asyncio
+    async def test_range_batches_are_not_hedged(self, mock_provider, mock_provider_manager):
+        mock_provider.max_rate_per_sec = 8
+        mock_provider.get_average_latency = MagicMock(return_value=0.0)
+        mock_provider.get_blocks.side_effect = lambda start, end: [create_chained_block(n) for n in range(start, end + 1)]
+        service = BlockStreamService(
+            mock_provider_manager, 99, max_catchup_window=2, catchup_batch_size=5, hedge_requests=True
+        )
+
+        await service.process_blocks(109)
+
+        mock_provider.get_blocks.assert_has_calls([call(100, 104), call(105, 109)])
+        mock_provider_manager.hedged.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_lean_fetch_emits_block_records(self, mock_provider, mock_provider_manager, capsys):
+        mock_provider.max_rate_per_sec = 8
+        mock_provider.get_average_latency = MagicMock(return_value=0.0)
+        mock_provider.get_block_records.side_effect = lambda start, end: [
+            BlockRecord(n, hash_key(f"0x{n:064x}"), hash_key(f"0x{n - 1:064x}"), 1000000 + n, 3) for n in range(start, end + 1)
+        ]
+        service = BlockStreamService(mock_provider_manager, 99, catchup_batch_size=5, lean_fetch=True)
+
+        await service.process_blocks(104)
+
+        mock_provider.get_block.assert_not_called()
+        assert service.last_processed_block == 104
+        assert service.last_hash == hash_key(f"0x{104:064x}")
+        assert json.loads(capsys.readouterr().out.splitlines()[-1])["tx_count"] == 3
+
+
+class TestNewHeadsSubscription:
+    @pytest.fixture
+    def subscribed_service(self, provider_config, rpc_stub):
+        rpc_stub.head = 100
+        manager = ProviderManager([ProviderClient(provider_config)], lag_thr=30, error_thr=0.2, window_s=60)
+        service = BlockStreamService(manager, 100, poll_interval=5, lean_fetch=True, push_heads=True)
+        service.emitted_at = {}
+        emit_block = service._emit_block
+
+        async def record_emit(block):
+            await emit_block(block)
+            service.emitted_at[block.number] = time.perf_counter()
+        service._emit_block = record_emit
+        return service
+
+    @staticmethod
+    async def _wait_until(condition, timeout=2.0):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            assert time.perf_counter() < deadline, "timed out"
+            await asyncio.sleep(0.001)
+
+    @pytest.mark.asyncio
+    async def test_pushed_head_is_emitted_well_under_100ms(self, subscribed_service, rpc_stub):
+        stream_task = asyncio.create_task(subscribed_service.stream())
+        try:
+            await self._wait_until(lambda: rpc_stub.subscribers)
+            latencies = []
+            for block_number in range(101, 111):
+                pushed_at = time.perf_counter()
+                await rpc_stub.push_head(block_number)
+                await self._wait_until(lambda: subscribed_service.last_processed_block == block_number)
+                latencies.append(subscribed_service.emitted_at[block_number] - pushed_at)
+
+            # poll_interval is 5s, so only the push can explain these latencies
+            assert max(latencies) < 0.1
+        finally:
+            subscribed_service.running = False
+            stream_task.cancel()
+            await asyncio.gather(stream_task, return_exceptions=True)
+            await subscribed_service.provider_manager.active.close()
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_polling_and_fills_gap_when_socket_dies(self, subscribed_service, rpc_stub):
+        subscribed_service.poll_interval = 0.05
+        stream_task = asyncio.create_task(subscribed_service.stream())
+        try:
+            await self._wait_until(lambda: rpc_stub.subscribers)
+            await rpc_stub.drop_subscribers()
+            rpc_stub.head = 105  # heads 101..105 are never pushed
+
+            await self._wait_until(lambda: subscribed_service.last_processed_block == 105)
+            assert sorted(subscribed_service.emitted_at) == list(range(101, 106))
+        finally:
+            subscribed_service.running = False
+            stream_task.cancel()
+            await asyncio.gather(stream_task, return_exceptions=True)
+            await subscribed_service.provider_manager.active.close()
+
+
+class FakeChain:
+    """Canonical chain whose blocks from a reorg's `fork_from` on carry that branch's id in their hash."""
+
+    def __init__(self):
+        self.branch = 0
+        self.forks = {0: None}  # branch -> first block of it; every branch forks off branch 0
+
+    def reorg(self, fork_from):
+        self.branch += 1
+        self.forks[self.branch] = fork_from
+
+    def block_hash(self, number, branch=None):
+        branch = self.branch if branch is None else branch
+        fork_from = self.forks[branch]
+        branch = branch if fork_from is not None and number >= fork_from else 0
+        return f"0x{branch:02x}{number:062x}"
+
+    def record(self, number, branch=None):
+        return BlockRecord(
+            number, hash_key(self.block_hash(number, branch)), hash_key(self.block_hash(number - 1, branch)),
+            1000000 + number, 0,
+        )
+
+    def record_by_hash(self, block_hash):
+        """Any branch's block, as nodes keep serving orphaned blocks by hash."""
+        raw = hash_key(block_hash)
+        return self.record(int.from_bytes(raw[1:], "big"), raw[0])
+
+
+class TestReorgHandling:
+    @pytest.fixture
+    def chain(self, mock_provider):
+        chain = FakeChain()
+        mock_provider.get_block_record.side_effect = chain.record
+        mock_provider.get_block_record_by_hash.side_effect = chain.record_by_hash
+        return chain
+
+    @pytest.fixture
+    def reorg_service(self, mock_provider_manager):
+        return BlockStreamService(
+            mock_provider_manager, 99, lean_fetch=True, block_cache=RecentBlockCache(capacity=16)
+        )
+
+    @pytest.mark.asyncio
+    async def test_rewinds_to_common_ancestor_and_restreams(self, chain, reorg_service, capsys):
+        await reorg_service.process_blocks(110)
+        chain.reorg(fork_from=108)
+
+        with pytest.raises(BlockInconsistentHashError):
+            await reorg_service.process_blocks(111)
+        assert await reorg_service._handle_reorg()
+        assert reorg_service.last_processed_block == 107
+
+        capsys.readouterr()
+        await reorg_service.process_blocks(111)
+
+        assert reorg_service.last_hash == hash_key(chain.block_hash(111))
+        assert reorg_service.block_cache.get(108).hash == hash_key(chain.block_hash(108))
+
+    @pytest.mark.asyncio
+    async def test_orphaned_blocks_are_retracted_newest_first(self, chain, reorg_service, capsys):
+        await reorg_service.process_blocks(110)
+        orphaned = {n: chain.block_hash(n) for n in (108, 109, 110)}
+        chain.reorg(fork_from=108)
+        capsys.readouterr()
+
+        with pytest.raises(BlockInconsistentHashError):
+            await reorg_service.process_blocks(111)
+        await reorg_service._handle_reorg()
+
+        retractions = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert retractions == [{"event": "retract", "number": n, "hash": orphaned[n]} for n in (110, 109, 108)]
+
+    @pytest.mark.asyncio
+    async def test_fork_deeper_than_cache_is_not_treated_as_reorg(self, chain, reorg_service):
+        await reorg_service.process_blocks(130)
+        chain.reorg(fork_from=100)
+
+        with pytest.raises(BlockInconsistentHashError):
+            await reorg_service.process_blocks(131)
+        assert not await reorg_service._handle_reorg()
+        assert reorg_service.last_processed_block == 130
+
+    @pytest.mark.asyncio
+    async def test_resumed_stream_walks_back_a_reorg_of_its_first_block(self, chain, mock_provider,
+                                                                        mock_provider_manager, capsys):
+        # the previous run stopped at 100 on branch 0; while it was down, 98.. were replaced
+        orphaned = {n: chain.block_hash(n) for n in (98, 99, 100)}
+        chain.reorg(fork_from=98)
+        mock_provider.head.return_value = 102
+        service = BlockStreamService(
+            mock_provider_manager, 100, poll_interval=0.01, lean_fetch=True, last_hash=orphaned[100],
+            block_cache=RecentBlockCache(capacity=16),
+        )
+
+        stream_task = asyncio.create_task(service.stream())
+        await asyncio.sleep(0.05)
+        service.running = False
+        await asyncio.gather(stream_task, return_exceptions=True)
+
+        lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert lines[:3] == [{"event": "retract", "number": n, "hash": orphaned[n]} for n in (100, 99, 98)]
+        assert [line["hash"] for line in lines[3:]] == [chain.block_hash(n) for n in range(98, 103)]
+        assert service.last_hash == hash_key(chain.block_hash(102))
+        mock_provider_manager.switch_provider_consensus_based.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_stream_holds_back_unconfirmed_blocks(self, chain, mock_provider, mock_provider_manager):
+        mock_provider.head.return_value = 111
+        service = BlockStreamService(mock_provider_manager, 99, poll_interval=0.01, lean_fetch=True, confirmations=6)
+
+        stream_task = asyncio.create_task(service.stream())
+        await asyncio.sleep(0.05)
+        service.running = False
+        stream_task.cancel()
+        await asyncio.gather(stream_task, return_exceptions=True)
+
+        assert service.last_processed_block == 105
+        # the active provider's head goes to the manager, which measures idle providers against it
+        assert mock_provider_manager.record_metrics.await_args.args[1] == 111
+
+    @pytest.mark.asyncio
+    async def test_output_failure_is_retried_without_failing_over(self, chain, mock_provider, mock_provider_manager):
+        class FlakySink(BlockSink):
+            def __init__(self):
+                self.chunks = []
+                self.failures = 1
+
+            async def write(self, chunk):
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionResetError("consumer went away")
+                self.chunks.append(chunk)
+
+        sink = FlakySink()
+        mock_provider.head.return_value = 105
+        service = BlockStreamService(mock_provider_manager, 99, poll_interval=0.01, lean_fetch=True,
+                                     output=SinkPipeline(sink))
+
+        stream_task = asyncio.create_task(service.stream())
+        await asyncio.sleep(0.1)
+        service.running = False
+        stream_task.cancel()
+        await asyncio.gather(stream_task, return_exceptions=True)
+
+        emitted = [json.loads(line)["number"] for chunk in sink.chunks for line in chunk.splitlines()]
+        assert emitted == list(range(100, 106))
+        mock_provider_manager.switch_to_healthy_provider.assert_not_called()
+
+
+
+def chain_provider(name, chain, max_rate_per_sec=10):
+    provider = AsyncMock(spec=ProviderClient)
+    provider.name = name
+    provider.max_rate_per_sec = max_rate_per_sec
+    provider.rate_headroom.return_value = 1.0
+    provider.get_average_latency.return_value = 0.1
+    provider.get_latency_percentile.return_value = 0.1
+    provider.get_error_ratio.return_value = 0
+    provider.get_block_record.side_effect = chain.record
+    provider.get_block_records.side_effect = lambda start, end: [chain.record(n) for n in range(start, end + 1)]
+    return provider
+
+
+class TestLoadBalancedCatchUp:
+    def service(self, providers):
+        manager = ProviderManager(providers, lag_thr=30, error_thr=0.2, window_s=60)
+        return BlockStreamService(
+            manager, 99, lean_fetch=True, max_catchup_window=64, catchup_batch_size=10, load_balance=True
+        )
+
+    @pytest.mark.asyncio
+    async def test_ranges_are_split_by_rate_budget_and_emitted_in_order(self, capsys):
+        chain = FakeChain()
+        providers = [chain_provider("A", chain, 20), chain_provider("B", chain, 10), chain_provider("C", chain, 10)]
+        service = self.service(providers)
+
+        await service.process_blocks(498)
+
+        emitted = [json.loads(line)["number"] for line in capsys.readouterr().out.splitlines()]
+        assert emitted == list(range(100, 499))
+        assert [p.get_block_records.await_count for p in providers] == [20, 10, 10]
+        assert service.seam_mismatches == 0
+
+    @pytest.mark.asyncio
+    async def test_range_that_does_not_connect_is_refetched_from_previous_provider(self, capsys):
+        canonical, stale = FakeChain(), FakeChain()
+        stale.reorg(fork_from=0)
+        providers = [chain_provider("A", canonical), chain_provider("B", stale)]
+        service = self.service(providers)
+
+        await service.process_blocks(139)
+
+        emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [record["hash"] for record in emitted] == [canonical.block_hash(n) for n in range(100, 140)]
+        assert service.seam_mismatches == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_range_is_retried_on_the_active_provider(self, capsys):
+        chain = FakeChain()
+        providers = [chain_provider("A", chain), chain_provider("B", chain)]
+        providers[1].get_block_records.side_effect = Exception("provider down")
+        service = self.service(providers)
+
+        await service.process_blocks(139)
+
+        emitted = [json.loads(line)["number"] for line in capsys.readouterr().out.splitlines()]
+        assert emitted == list(range(100, 140))
+        assert providers[0].get_block_records.await_count == 4
+
+
+class TestAdaptivePolling:
+
+    @pytest.mark.asyncio
+    async def test_catch_up_skips_the_sleep_then_uses_the_scheduled_delay(self, mock_provider, mock_provider_manager):
+        chain = FakeChain()
+        mock_provider.get_block_record.side_effect = chain.record
+        mock_provider.head.return_value = 111
+        scheduler = MagicMock(spec=PollScheduler)
+        scheduler.next_delay.return_value = 60
+        service = BlockStreamService(mock_provider_manager, 99, lean_fetch=True, poll_scheduler=scheduler)
+
+        stream_task = asyncio.create_task(service.stream())
+        await asyncio.sleep(0.05)
+        stream_task.cancel()
+        await asyncio.gather(stream_task, return_exceptions=True)
 
+        assert service.last_processed_block == 111
+        assert mock_provider.head.await_count == 2
+        scheduler.next_delay.assert_called_once()
+        scheduler.on_head.assert_called_with(111)
+        scheduler.on_block.assert_called_with(111, chain.record(111).timestamp)
@@ -0,0 +1,82 @@
+import pytest
+
+import block_validator
+from block_cache import hash_key
+from block_record import BlockRecord
+from block_validator import BlockBatch, validate_batch
+
+
+@pytest.fixture(params=["bytes", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(block_validator, "np", None)
+    return request.param
+
+
+def block_hash(number):
+    return f"0x{number + 1:064x}"
+
+
+def chain(start, count):
+    return [
+        {"number": n, "hash": block_hash(n), "parentHash": block_hash(n - 1), "timestamp": 1_700_000_000 + n}
+        for n in range(start, start + count)
+    ]
+
+
+class TestValidateBatch:
+
+    def test_valid_chain_passes(self, backend):
+        blocks = chain(100, 1000)
+        assert validate_batch(BlockBatch.from_blocks(blocks), parent_hash=block_hash(99), first_number=100) is None
+
+    def test_empty_batch_passes(self, backend):
+        assert validate_batch(BlockBatch.from_blocks([])) is None
+
+    @pytest.mark.parametrize("index", [1, 517, 999])
+    def test_broken_link_reports_first_failing_index(self, backend, index):
+        blocks = chain(100, 1000)
+        blocks[index]["parentHash"] = block_hash(10**6)
+        blocks[index + 1 if index < 999 else index]["parentHash"] = block_hash(10**6)
+        assert validate_batch(BlockBatch.from_blocks(blocks)) == index
+
+    def test_first_block_must_extend_parent_hash(self, backend):
+        batch = BlockBatch.from_blocks(chain(100, 10))
+        assert validate_batch(batch, parent_hash=block_hash(98)) == 0
+
+    def test_gap_in_numbers(self, backend):
+        blocks = chain(100, 50)
+        blocks[30]["number"] += 1
+        assert validate_batch(BlockBatch.from_blocks(blocks)) == 30
+        assert validate_batch(BlockBatch.from_blocks(chain(100, 5)), first_number=101) == 0
+
+    @pytest.mark.parametrize("field", ["hash", "parentHash", "timestamp", "number"])
+    def test_missing_field(self, backend, field):
+        blocks = chain(100, 50)
+        blocks[20][field] = None
+        # a missing hash also breaks the next block's link, but 20 fails first
+        assert validate_batch(BlockBatch.from_blocks(blocks)) == 20
+
+    def test_earliest_of_several_failures_wins(self, backend):
+        blocks = chain(100, 50)
+        blocks[40]["timestamp"] = 0
+        blocks[12]["parentHash"] = block_hash(5000)
+        blocks[25]["number"] = 7
+        assert validate_batch(BlockBatch.from_blocks(blocks)) == 12
+
+    def test_zero_bytes_straddling_hashes_are_not_a_missing_hash(self, backend):
+        blocks = chain(100, 3)
+        blocks[1]["hash"] = "0x" + "11" * 16 + "00" * 16
+        blocks[2]["parentHash"] = blocks[1]["hash"]
+        blocks[2]["hash"] = "0x" + "00" * 16 + "11" * 16
+        assert validate_batch(BlockBatch.from_blocks(blocks)) is None
+
+    def test_records_with_raw_hashes(self, backend):
+        records = [
+            BlockRecord(b["number"], hash_key(b["hash"]), hash_key(b["parentHash"]), b["timestamp"], 0)
+            for b in chain(100, 100)
+        ]
+        records[60].parentHash = b""
+        assert validate_batch(BlockBatch.from_records(records)) == 60
@@ -0,0 +1,198 @@
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from benchmarks.chain_simulator import ChainSimulator, SimulatedChain, SimulatedNode, TraceRecorder, TraceReplayNode
+from block_validator import validate_record
+from config import ProviderConfig
+from conftest import FakeClock
+from provider_client import ProviderClient
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(1000.0)
+
+
+@pytest.fixture
+def chain(clock):
+    return SimulatedChain(block_time=12, history=100, first_block=1000, tx_count=2, clock=clock)
+
+
+@pytest_asyncio.fixture
+async def served():
+    servers, clients = [], []
+
+    async def serve(server):
+        await server.start()
+        servers.append(server)
+        client = ProviderClient(ProviderConfig(name="Sim", url=server.url, max_batch_size=10, max_rate_per_sec=1000))
+        clients.append(client)
+        return client
+
+    yield serve
+    for client in clients:
+        await client.close()
+    for server in reversed(servers):
+        await server.stop()
+
+
+class TestSimulatedChain:
+    def test_produces_a_block_every_block_time(self, chain, clock):
+        assert chain.head == 1100
+        clock.now += 11.9
+        assert chain.head == 1100
+        clock.now += 0.1
+        assert chain.head == 1101
+        assert chain.block(1101)["timestamp"] == hex(1012)
+
+    def test_reorg_replaces_the_newest_blocks(self, chain):
+        before = [chain.block_hash(number) for number in range(1097, 1101)]
+
+        chain.reorg(2)
+
+        after = [chain.block_hash(number) for number in range(1097, 1101)]
+        assert after[:2] == before[:2] and after[2] != before[2] and after[3] != before[3]
+        assert chain.block(1099)["parentHash"] == after[1]
+        assert chain.block(1100)["parentHash"] == after[2]
+
+    def test_orphaned_blocks_are_still_found_by_hash(self, chain):
+        orphan = chain.block(1100)
+        chain.reorg(2)
+        chain.reorg(1)
+
+        assert chain.block_by_hash(orphan["hash"]) == orphan
+        assert chain.block_by_hash(chain.block_hash(1100)) == chain.block(1100)
+        assert chain.block_by_hash(f"0x{3:02x}{1100:062x}") is None  # no third branch yet
+        assert chain.block_by_hash(f"0x{1:02x}{1098:062x}") is None  # below where branch 1 starts
+
+
+class TestSimulatedNode:
+    def test_block_becomes_visible_after_its_delay(self, chain, clock):
+        node = SimulatedNode(chain, visibility_s=(0.5, 2.0), seed=3)
+        clock.now += 12
+        visible_at = node.visible_at(1101)
+
+        assert 1012.5 <= visible_at <= 1014
+        clock.now = visible_at - 0.01
+        assert node.head() == 1100
+        clock.now = visible_at
+        assert node.head() == 1101
+        # same seed, same delay
+        assert SimulatedNode(chain, visibility_s=(0.5, 2.0), seed=3).visible_at(1101) == visible_at
+
+    def test_lagging_node_reports_an_older_head(self, chain):
+        assert SimulatedNode(chain, lag_blocks=2).head() == 1098
+
+    def test_stalled_head_resumes_at_the_chain_head(self, chain, clock):
+        node = SimulatedNode(chain)
+        node.stall(30)
+        clock.now += 24
+
+        assert node.head() == 1100
+        clock.now += 6
+        assert node.head() == 1102
+
+    def test_visibility_range_wider_than_a_block_is_rejected(self, chain):
+        with pytest.raises(ValueError):
+            SimulatedNode(chain, visibility_s=(0.0, 12.0))
+
+    def test_scenario_events_change_nodes_and_chain(self, clock):
+        simulator = ChainSimulator(
+            {"block_time": 12, "history": 100, "nodes": [{"name": "a"}, {"name": "b"}]}, start=1000, clock=clock
+        )
+        head = simulator.chain.head
+        first_hash = simulator.chain.block_hash(head)
+
+        simulator.apply({"at": 0, "node": "a", "set": {"error_rate_500": 1.0}})
+        simulator.apply({"at": 0, "reorg": 1})
+
+        assert simulator.node("a").error_rate_500 == 1.0
+        assert simulator.chain.block_hash(head) != first_hash
+        with pytest.raises(ValueError):
+            simulator.apply({"at": 0, "node": "b", "set": {"head": 5}})
+
+
+class TestServedNode:
+    @pytest.mark.asyncio
+    async def test_provider_client_streams_the_simulated_chain(self, served):
+        chain = SimulatedChain(block_time=12, history=100, tx_count=3)
+        provider = await served(SimulatedNode(chain, latency_ms=(0, 0)))
+
+        head = await provider.head()
+        records = await provider.get_block_records(head - 24, head)
+
+        assert head == chain.head
+        assert [record.number for record in records] == list(range(head - 24, head + 1))
+        last_hash = records[0].hash
+        for record in records[1:]:
+            assert validate_record(record, last_hash)
+            last_hash = record.hash
+        assert records[0].tx_count == 3
+
+    @pytest.mark.asyncio
+    async def test_blocks_past_the_head_are_missing(self, served):
+        chain = SimulatedChain(block_time=12, history=100)
+        provider = await served(SimulatedNode(chain, latency_ms=(0, 0)))
+
+        assert await provider.get_block_records(chain.head, chain.head)
+        with pytest.raises(Exception):
+            await provider.get_block_record(chain.head + 1)
+
+    @pytest.mark.asyncio
+    async def test_injected_429_throttles_the_client(self, served):
+        chain = SimulatedChain(block_time=12, history=100)
+        provider = await served(SimulatedNode(chain, latency_ms=(0, 0), error_rate_429=1.0, retry_after_s=2))
+
+        with pytest.raises(aiohttp.ClientResponseError) as raised:
+            await provider.head()
+
+        assert raised.value.status == 429
+        assert provider.rate_limiter.throttle_count == 1
+
+    @pytest.mark.asyncio
+    async def test_injected_500_fails_the_request(self, served):
+        chain = SimulatedChain(block_time=12, history=100)
+        provider = await served(SimulatedNode(chain, latency_ms=(0, 0), error_rate_500=1.0))
+
+        with pytest.raises(aiohttp.ClientResponseError) as raised:
+            await provider.head()
+
+        assert raised.value.status == 500
+        assert provider.get_error_ratio() == 1.0
+
+
+class TestTraces:
+    @pytest.mark.asyncio
+    async def test_recorded_trace_replays_the_same_answers(self, served, tmp_path):
+        trace = str(tmp_path / "trace.ndjson")
+        chain = SimulatedChain(block_time=12, history=100)
+        node = SimulatedNode(chain, latency_ms=(0, 0))
+        await node.start()
+        recording = await served(TraceRecorder(node.url, trace))
+        head = await recording.head()
+        recorded = await recording.get_block_records(head - 4, head)
+
+        replaying = await served(TraceReplayNode(trace))
+
+        assert await replaying.head() == head
+        assert await replaying.get_block_records(head - 4, head) == recorded
+        with pytest.raises(Exception):
+            await replaying.get_block_record(head - 5)
+        await node.stop()
+
+    @pytest.mark.asyncio
+    async def test_recorded_error_is_replayed(self, served, tmp_path):
+        trace = str(tmp_path / "trace.ndjson")
+        node = SimulatedNode(SimulatedChain(block_time=12, history=100), latency_ms=(0, 0), error_rate_500=1.0)
+        await node.start()
+        recording = await served(TraceRecorder(node.url, trace))
+        with pytest.raises(aiohttp.ClientResponseError):
+            await recording.head()
+
+        replaying = await served(TraceReplayNode(trace))
+
+        with pytest.raises(aiohttp.ClientResponseError) as raised:
+            await replaying.head()
+        assert raised.value.status == 500
+        await node.stop()
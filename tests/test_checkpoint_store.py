@@ -0,0 +1,153 @@
+import json
+import sqlite3
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from block_cache import RecentBlockCache
+from block_streamer import BlockStreamService
+from block_validator import BlockInconsistentHashError
+from checkpoint_store import Checkpoint, SQLiteCheckpointStore
+
+
+def create_chained_block(block_number, parent_number=None):
+    parent_number = block_number - 1 if parent_number is None else parent_number
+    block = MagicMock()
+    block.number = block_number
+    block.hash.hex.return_value = f"0x{block_number:064x}"
+    block.parentHash.hex.return_value = f"0x{parent_number:064x}"
+    block.timestamp = 1000000 + block_number
+    block.transactions = []
+    return block
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "checkpoint.sqlite")
+
+
+@pytest.fixture
+def mock_provider_manager():
+    manager = AsyncMock()
+    manager.active.get_block.side_effect = create_chained_block
+    return manager
+
+
+class TestSQLiteCheckpointStore:
+    def test_empty_store_has_no_checkpoint(self, db_path):
+        assert SQLiteCheckpointStore(db_path).load() is None
+
+    def test_group_commit_only_writes_when_due(self, db_path):
+        store = SQLiteCheckpointStore(db_path, commit_every_blocks=3, commit_interval_s=3600)
+        reader = SQLiteCheckpointStore(db_path)
+
+        store.record(1, "0x01")
+        store.record(2, "0x02")
+        assert not store.commit_due
+        assert reader.load() is None
+
+        store.record(3, "0x03")
+        assert store.commit_due
+        store.flush()
+        assert reader.load() == Checkpoint(3, "0x03")
+
+    def test_streams_are_isolated(self, db_path):
+        mainnet = SQLiteCheckpointStore(db_path, stream="1")
+        mainnet.record(10, "0x0a")
+        mainnet.close()
+
+        assert SQLiteCheckpointStore(db_path, stream="137").load() is None
+        assert SQLiteCheckpointStore(db_path, stream="1").load() == Checkpoint(10, "0x0a")
+
+    def test_commit_of_a_deposed_leader_is_dropped(self, db_path):
+        deposed = SQLiteCheckpointStore(db_path)
+        deposed.fence(1)
+        deposed.record(10, "0x0a")
+        deposed.flush()
+        successor = SQLiteCheckpointStore(db_path)
+        successor.fence(2)
+
+        # e.g. the deposed leader's stream flushing on its way out after the takeover
+        deposed.record(12, "0x0c")
+        deposed.flush()
+        assert successor.load() == Checkpoint(10, "0x0a")
+
+        successor.record(11, "0x0b")
+        successor.flush()
+        assert successor.load() == Checkpoint(11, "0x0b")
+
+    def test_database_from_before_fencing_is_upgraded(self, db_path):
+        db = sqlite3.connect(db_path)
+        db.execute("CREATE TABLE checkpoints (stream TEXT PRIMARY KEY, block_number INTEGER NOT NULL, "
+                   "block_hash TEXT NOT NULL, updated_at REAL NOT NULL)")
+        db.execute("INSERT INTO checkpoints VALUES ('default', 10, '0x0a', 0)")
+        db.commit()
+        db.close()
+
+        store = SQLiteCheckpointStore(db_path)
+        store.fence(1)
+        store.record(11, "0x0b")
+        store.flush()
+
+        assert store.load() == Checkpoint(11, "0x0b")
+
+
+class TestResumeFromCheckpoint:
+    @pytest.mark.asyncio
+    async def test_restart_resumes_without_gap(self, db_path, mock_provider_manager, capsys):
+        store = SQLiteCheckpointStore(db_path, commit_every_blocks=4, commit_interval_s=3600)
+        service = BlockStreamService(mock_provider_manager, 100, checkpoint_store=store)
+        await service.process_blocks(110)
+        # simulated crash: no close(), only what process_blocks committed survives
+
+        checkpoint = SQLiteCheckpointStore(db_path).load()
+        assert checkpoint == Checkpoint(110, f"0x{110:064x}")
+
+        restarted = BlockStreamService(
+            mock_provider_manager, checkpoint.block_number, last_hash=checkpoint.block_hash,
+            checkpoint_store=SQLiteCheckpointStore(db_path),
+        )
+        await restarted.process_blocks(115)
+
+        emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [record["number"] for record in emitted] == list(range(101, 116))
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_hash_validates_first_block_after_restart(self, db_path, mock_provider_manager):
+        mock_provider_manager.active.get_block.side_effect = lambda n: create_chained_block(n, parent_number=999)
+        restarted = BlockStreamService(
+            mock_provider_manager, 110, last_hash=f"0x{110:064x}", checkpoint_store=SQLiteCheckpointStore(db_path)
+        )
+
+        with pytest.raises(BlockInconsistentHashError):
+            await restarted.process_blocks(111)
+        assert SQLiteCheckpointStore(db_path).load() is None
+
+
+class TestFollowCheckpoint:
+    @pytest.mark.asyncio
+    async def test_standby_adopts_the_leaders_checkpoint_and_caches_behind_it(self, db_path, mock_provider_manager):
+        mock_provider_manager.active.get_blocks.side_effect = \
+            lambda start, end: [create_chained_block(n) for n in range(start, end + 1)]
+        leader = SQLiteCheckpointStore(db_path)
+        leader.record(110, f"0x{110:064x}")
+        leader.flush()
+        store = SQLiteCheckpointStore(db_path)
+        store.record(90, f"0x{90:064x}")  # buffered while this instance last led
+        standby = BlockStreamService(mock_provider_manager, 90, checkpoint_store=store, block_cache=RecentBlockCache(16))
+
+        await standby.follow_checkpoint()
+
+        assert (standby.last_processed_block, standby.last_hash) == (110, bytes.fromhex(f"{110:064x}"))
+        mock_provider_manager.active.get_blocks.assert_awaited_once_with(95, 110)
+        assert standby.block_cache.hash_of(95) == bytes.fromhex(f"{95:064x}")
+        store.flush()
+        assert store.load() == Checkpoint(110, f"0x{110:064x}")
+
+        leader.record(112, f"0x{112:064x}")
+        leader.flush()
+        await standby.follow_checkpoint()
+
+        # only the blocks it doesn't hold yet
+        mock_provider_manager.active.get_blocks.assert_awaited_with(111, 112)
+        assert standby.last_processed_block == 112
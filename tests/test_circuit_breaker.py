@@ -0,0 +1,70 @@
+import pytest
+
+from circuit_breaker import CircuitBreaker
+
+
+def breaker(clock, rng=lambda: 0.5, **kwargs):
+    # rng 0.5 is the middle of the jitter range, i.e. no jitter
+    return CircuitBreaker(clock=clock, rng=rng, **kwargs)
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_consecutive_failures_only(self, clock):
+        cb = breaker(clock, failure_threshold=3)
+        cb.record_failure()
+        cb.record_failure()
+        cb.record_success()
+        cb.record_failure()
+        cb.record_failure()
+        assert cb.state == CircuitBreaker.CLOSED and cb.allow_request()
+
+        cb.record_failure()
+
+        assert cb.state == CircuitBreaker.OPEN
+        assert not cb.allow_request()
+        assert cb.ready_in == pytest.approx(1.0)
+
+    def test_half_open_admits_a_single_probe(self, clock):
+        cb = breaker(clock, failure_threshold=1)
+        cb.record_failure()
+        clock.now = 1.0
+
+        assert cb.state == CircuitBreaker.HALF_OPEN
+        assert cb.allow_request()
+        assert not cb.allow_request()
+
+        cb.record_success()
+
+        assert cb.state == CircuitBreaker.CLOSED
+        assert cb.trips == 0
+        assert all(cb.allow_request() for _ in range(5))
+
+    def test_cooldown_doubles_per_trip_up_to_the_cap(self, clock):
+        cb = breaker(clock, failure_threshold=1, base_cooldown_s=1.0, max_cooldown_s=5.0)
+        cooldowns = []
+        for _ in range(5):
+            cb.record_failure()
+            cooldowns.append(cb.ready_in)
+            clock.now += cb.ready_in
+            assert cb.allow_request()  # the half-open probe, which fails again
+
+        assert cooldowns == pytest.approx([1.0, 2.0, 4.0, 5.0, 5.0])
+
+    def test_failures_while_open_do_not_extend_the_cooldown(self, clock):
+        cb = breaker(clock, failure_threshold=1)
+        cb.record_failure()
+        clock.now = 0.5
+        cb.record_failure()
+
+        assert cb.trips == 1
+        assert cb.ready_in == pytest.approx(0.5)
+
+    def test_jitter_spreads_cooldowns(self, clock):
+        low, high = breaker(clock, rng=lambda: 0.0, jitter=0.2), breaker(clock, rng=lambda: 1.0, jitter=0.2)
+        for cb in (low, high):
+            for _ in range(cb.failure_threshold):
+                cb.record_failure()
+
+        assert low.ready_in == pytest.approx(0.8)
+        assert high.ready_in == pytest.approx(1.2)
@@ -0,0 +1,85 @@
+import pytest
+
+from config import AppConfig
+
+MULTI_CHAIN = """
+poll_interval_s: 2
+catchup_window: 8
+providers:
+  - name: Default
+    url: http://default
+chains:
+  - chain_id: 1
+    expected_block_time: 12
+  - chain_id: 137
+    expected_block_time: 2
+    poll_interval_s: 0.5
+    providers:
+      - name: Polygon
+        url: http://polygon
+    output:
+      type: file
+      path: polygon.ndjson
+"""
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    def write(text):
+        path = tmp_path / "config.yaml"
+        path.write_text(text)
+        return str(path)
+    return write
+
+
+class TestLoadChains:
+    def test_chains_override_top_level_defaults(self, write_config):
+        mainnet, polygon = AppConfig.load_chains(write_config(MULTI_CHAIN))
+
+        assert (mainnet.chain_id, mainnet.expected_block_time, mainnet.poll_interval_s) == (1, 12, 2)
+        assert [p.name for p in mainnet.providers] == ["Default"]
+        assert mainnet.output.type == "stdout"
+        assert (polygon.chain_id, polygon.expected_block_time, polygon.poll_interval_s) == (137, 2, 0.5)
+        assert [p.name for p in polygon.providers] == ["Polygon"]
+        assert polygon.output.path == "polygon.ndjson"
+        assert polygon.catchup_window == mainnet.catchup_window == 8
+
+    def test_file_without_chains_is_a_single_chain(self, write_config):
+        path = write_config("chain_id: 10\nproviders:\n  - name: Only\n    url: http://only\n")
+
+        assert [cfg.chain_id for cfg in AppConfig.load_chains(path)] == [10]
+        assert AppConfig.load(path).providers[0].name == "Only"
+
+    def test_duplicate_chain_ids_are_rejected(self, write_config):
+        path = write_config("providers: []\nchains:\n  - chain_id: 1\n  - chain_id: 1\n")
+
+        with pytest.raises(ValueError, match="Duplicate chain_id"):
+            AppConfig.load_chains(path)
+
+    def test_subscriptions_section(self, write_config):
+        path = write_config(
+            "providers: []\nsubscriptions:\n  enabled: true\n  port: 9300\n  slow_consumer: drop_oldest\n"
+        )
+
+        subscriptions = AppConfig.load(path).subscriptions
+        assert (subscriptions.enabled, subscriptions.port, subscriptions.slow_consumer) == (True, 9300, "drop_oldest")
+        assert subscriptions.replay_size == 10_000
+
+    def test_log_enrichment_section(self, write_config):
+        path = write_config(
+            "providers: []\nlog_enrichment:\n  enabled: true\n  addresses: ['0xdac17f958d2ee523a2206206994597c13d831ec7']\n"
+            "  events: ['Transfer(address,address,uint256)']\n"
+        )
+
+        log_enrichment = AppConfig.load(path).log_enrichment
+        assert log_enrichment.enabled
+        assert log_enrichment.addresses == ["0xdac17f958d2ee523a2206206994597c13d831ec7"]
+        assert log_enrichment.topics == []
+
+    def test_deprecated_score_halflife_sets_the_score_window(self, write_config, caplog):
+        halflife_only = write_config("providers: []\nscore_halflife_s: 90\n")
+        assert AppConfig.load(halflife_only).score_window_s == 90
+        assert "use score_window_s" in caplog.text
+
+        both = write_config("providers: []\nscore_halflife_s: 90\nscore_window_s: 30\n")
+        assert AppConfig.load(both).score_window_s == 30
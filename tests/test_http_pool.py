@@ -0,0 +1,48 @@
+import pytest
+import pytest_asyncio
+
+from config import ProviderConfig
+from http_pool import HttpSessionPool
+from provider_client import ProviderClient
+
+
+@pytest_asyncio.fixture
+async def pool():
+    pool = HttpSessionPool(warm_connections=3)
+    yield pool
+    await pool.close()
+
+
+class TestHttpSessionPool:
+    @pytest.mark.asyncio
+    async def test_providers_on_one_host_share_a_session(self, pool):
+        mainnet = pool.session_for("https://eth-mainnet.example.com/v2/key")
+        mainnet_other_key = pool.session_for("https://eth-mainnet.example.com/v2/other")
+        polygon = pool.session_for("https://polygon-mainnet.example.com/v2/key")
+
+        assert mainnet is mainnet_other_key
+        assert polygon is not mainnet
+
+    @pytest.mark.asyncio
+    async def test_warm_up_opens_connections_that_requests_reuse(self, pool, provider_config, rpc_stub):
+        clients = [ProviderClient(provider_config), ProviderClient(ProviderConfig(name="Same", url=provider_config.url))]
+        for client in clients:
+            await pool.attach(client)
+
+        await pool.warm_up(clients)
+        warmed = set(rpc_stub.peers)
+        for client in clients:
+            await client.head()
+            await client.get_block_record(999)
+
+        assert len(warmed) == 6
+        assert rpc_stub.peers == warmed  # no new connection after warm-up
+        assert [client.request_count for client in clients] == [2, 2]  # warm-up isn't scored
+
+    @pytest.mark.asyncio
+    async def test_gzip_is_negotiated_by_default(self, pool):
+        identity = HttpSessionPool(gzip=False)
+
+        assert pool.session_for("http://a")._default_headers["Accept-Encoding"] == "gzip, deflate"
+        assert identity.session_for("http://b")._default_headers["Accept-Encoding"] == "identity"
+        await identity.close()
@@ -14,6 +14,7 @@ def healthy_mock_providers():
         provider.name = f"Provider{i}"
         provider.head.return_value = 111
         provider.get_average_latency.return_value = 0.1
+        provider.get_latency_percentile.return_value = 0.1
         provider.get_error_ratio.return_value = 0.05  # Healthy: 5% error rate
         provider.get_block.return_value = create_mock_block(100)
         providers.append(provider)
@@ -26,7 +27,7 @@ async def test_provider_switches_on_failure(healthy_mock_providers):
         providers=healthy_mock_providers,
         lag_thr=1.0,
         error_thr=0.1,  # 10% threshold
-        halflife=60.0
+        window_s=60.0
     )
     original_provider = provider_manager.active
     original_provider.get_block.side_effect = Exception("Provider failed")
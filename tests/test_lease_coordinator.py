@@ -0,0 +1,142 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from benchmarks.bench_failover import run_failover
+from conftest import FakeClock
+from lease_coordinator import Leadership, LeaseLost, SQLiteLeaseCoordinator
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(1000.0)
+
+
+@pytest.fixture
+def lease_path(tmp_path):
+    return str(tmp_path / "lease.sqlite")
+
+
+class TestSQLiteLeaseCoordinator:
+    def test_one_holder_until_the_lease_expires(self, lease_path, clock):
+        a = SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=6, clock=clock)
+        b = SQLiteLeaseCoordinator(lease_path, holder="b", ttl_s=6, clock=clock)
+
+        assert a.acquire("stream:1").token == 1
+        assert b.acquire("stream:1") is None
+        clock.now += 5
+        assert a.acquire("stream:1").expires_at == 1011  # renewed
+        clock.now += 5
+        assert b.acquire("stream:1") is None
+
+        clock.now += 1
+        lease = b.acquire("stream:1")
+        assert (lease.holder, lease.token) == ("b", 2)
+        assert a.acquire("stream:1") is None
+        assert a.current("stream:1") == lease
+
+    def test_release_hands_over_at_once_and_keeps_the_token(self, lease_path, clock):
+        a = SQLiteLeaseCoordinator(lease_path, holder="a", clock=clock)
+        b = SQLiteLeaseCoordinator(lease_path, holder="b", clock=clock)
+        a.acquire("stream:1")
+        b.release("stream:1")  # not b's to release
+        assert b.acquire("stream:1") is None
+
+        a.release("stream:1")
+
+        assert a.current("stream:1") is None
+        assert b.acquire("stream:1").token == 2
+        assert b.acquire("other").token == 1
+
+
+class TestHold:
+    @pytest.mark.asyncio
+    async def test_releases_the_lease_when_the_work_is_done(self, lease_path):
+        a = SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=0.15)
+        a.acquire("chunk")
+
+        async def work():
+            await asyncio.sleep(0.2)  # outlives the TTL, so it takes renewals
+            return "done"
+
+        assert await a.hold("chunk", work()) == "done"
+        assert a.current("chunk") is None
+
+    @pytest.mark.asyncio
+    async def test_work_is_cancelled_when_another_holder_takes_over(self, lease_path):
+        a = SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=0.15)
+        # b's clock runs ahead, so it sees a's lease expired
+        b = SQLiteLeaseCoordinator(lease_path, holder="b", ttl_s=0.15, clock=lambda: time.time() + 10)
+        a.acquire("stream:1")
+        work = asyncio.ensure_future(asyncio.sleep(10))
+        b.acquire("stream:1")
+
+        with pytest.raises(LeaseLost):
+            await a.hold("stream:1", work)
+        assert work.cancelled()
+        assert b.current("stream:1").holder == "b"
+
+    @pytest.mark.asyncio
+    async def test_work_stops_before_an_unrenewable_lease_expires(self, lease_path):
+        a = SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=0.3)
+        acquired = a.acquire("stream:1")
+
+        def locked(name):
+            raise sqlite3.OperationalError("database is locked")
+
+        a.acquire = locked
+        with pytest.raises(LeaseLost):
+            await a.hold("stream:1", asyncio.sleep(10))
+        assert time.time() < acquired.expires_at
+
+
+class TestLeadership:
+    @pytest.mark.asyncio
+    async def test_standby_follows_then_takes_over_from_a_dead_leader(self, lease_path):
+        ttl_s = 0.3
+        leader = Leadership(SQLiteLeaseCoordinator(lease_path, holder="a", ttl_s=ttl_s), "stream:1")
+        standby = Leadership(SQLiteLeaseCoordinator(lease_path, holder="b", ttl_s=ttl_s), "stream:1")
+        followed = []
+        took_over = asyncio.Event()
+
+        async def follow():
+            followed.append(time.monotonic())
+
+        async def lead_forever():
+            await asyncio.sleep(3600)
+
+        async def lead_standby():
+            took_over.set()
+
+        leading = asyncio.create_task(leader.run(lead_forever, follow))
+        await asyncio.sleep(0.05)
+        following = asyncio.create_task(standby.run(lead_standby, follow))
+        await asyncio.sleep(ttl_s)
+        assert leader.is_leader and not standby.is_leader
+        assert followed
+        # crash: the leader stops without releasing its lease
+        leader.coordinator.release = lambda name: None
+        leading.cancel()
+        killed_at = time.monotonic()
+
+        await asyncio.wait_for(took_over.wait(), 2 * ttl_s)
+
+        assert time.monotonic() - killed_at <= ttl_s + standby.coordinator.renew_interval_s + 0.1
+        await following
+        assert standby.takeovers == 1
+
+
+class TestFailover:
+    @pytest.mark.asyncio
+    async def test_killed_leader_is_replaced_within_a_block_without_a_gap(self, tmp_path):
+        block_time = 2
+
+        # two main.py processes; the leader is SIGKILLed mid-stream
+        result = await run_failover(str(tmp_path), rounds=1, instances=2, block_time=block_time)
+
+        assert result.gaps == []
+        assert result.standby_blocks == 0
+        assert result.takeover_s[0] < block_time
+        assert result.first_block_delay_s[0] < block_time
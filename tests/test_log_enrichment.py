@@ -0,0 +1,191 @@
+import orjson
+import pytest
+
+from block_record import BlockRecord
+from block_streamer import BlockStreamService
+from conftest import log_matches
+from log_enrichment import LogEnricher, LogFilter, make_bloom
+from provider_client import ProviderClient
+from provider_manager import ProviderManager
+from sinks import BlockSink, SinkPipeline
+
+USDT = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+WETH = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
+TRANSFER = "Transfer(address,address,uint256)"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+APPROVAL_TOPIC = "0x8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925"
+
+
+def block_hash(number, branch=0):
+    return f"0x{branch:02x}{number:062x}"
+
+
+def rpc_log(number, address=USDT, topic=TRANSFER_TOPIC, log_index=0, branch=0):
+    return {
+        "address": address,
+        "topics": [topic, "0x" + "00" * 12 + "11" * 20],
+        "data": "0x" + f"{number:064x}",
+        "blockNumber": hex(number),
+        "blockHash": block_hash(number, branch),
+        "logIndex": hex(log_index),
+        "transactionIndex": hex(log_index),
+        "transactionHash": f"0x{number:032x}{log_index:032x}",
+    }
+
+
+def record(number, logs=()):
+    return BlockRecord(
+        number, bytes.fromhex(block_hash(number)[2:]), bytes.fromhex(block_hash(number - 1)[2:]), 1000 + number, 1,
+        make_bloom(logs),
+    )
+
+
+class LogsProvider:
+    """Serves `logs` for eth_getLogs like a node would, counting the calls."""
+
+    name = "Logs"
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.filters = []
+
+    async def get_logs(self, log_filter):
+        self.filters.append(log_filter)
+        return [log for log in self.logs if log_matches(log, log_filter)]
+
+    async def get_logs_by_hash(self, log_filter, block_hashes):
+        self.filters.append({**log_filter, "blockHashes": block_hashes})
+        return [[log for log in self.logs if log_matches(log, {**log_filter, "blockHash": h})] for h in block_hashes]
+
+
+class TestLogFilter:
+    def test_bloom_rules_out_blocks_without_the_contract_or_event(self):
+        log_filter = LogFilter(addresses=[USDT], events=[TRANSFER])
+
+        assert log_filter.may_match(make_bloom([rpc_log(1)]))
+        assert not log_filter.may_match(make_bloom([rpc_log(1, address=WETH)]))
+        assert not log_filter.may_match(make_bloom([rpc_log(1, topic=APPROVAL_TOPIC)]))
+        assert not log_filter.may_match(make_bloom([]))
+
+    def test_unknown_bloom_may_match(self):
+        assert LogFilter(addresses=[USDT]).may_match(None)
+
+    def test_topics_are_positional_and_events_restrict_topic0(self):
+        recipient = "0x" + "00" * 12 + "11" * 20
+        log_filter = LogFilter(topics=[None, [recipient]], events=[TRANSFER])
+
+        assert log_filter.params() == {"topics": [[TRANSFER_TOPIC], [recipient]]}
+        assert log_filter.may_match(make_bloom([rpc_log(1)]))
+        assert not log_filter.may_match(make_bloom([rpc_log(1, topic=APPROVAL_TOPIC)]))
+
+    def test_addresses_are_lowercased_for_the_request(self):
+        assert LogFilter(addresses=[USDT.upper().replace("0X", "0x")]).params() == {"address": [USDT]}
+
+
+class TestLogEnricher:
+    @pytest.mark.asyncio
+    async def test_one_range_call_covers_the_candidates(self):
+        logs = [rpc_log(102), rpc_log(104, log_index=3), rpc_log(105, address=WETH)]
+        records = [record(n, [log for log in logs if int(log["blockNumber"], 16) == n]) for n in range(100, 106)]
+        provider = LogsProvider(logs)
+        enricher = LogEnricher(LogFilter(addresses=[USDT], events=[TRANSFER]))
+
+        await enricher.enrich(provider, records)
+
+        assert provider.filters == [{
+            "address": [USDT], "topics": [[TRANSFER_TOPIC]], "fromBlock": hex(102), "toBlock": hex(104),
+        }]
+        assert [len(r.logs) for r in records] == [0, 0, 1, 0, 1, 0]
+        assert records[4].logs[0] == {
+            "address": USDT, "topics": logs[1]["topics"], "data": logs[1]["data"], "logIndex": 3,
+            "transactionIndex": 3, "transactionHash": logs[1]["transactionHash"], "event": TRANSFER,
+        }
+        assert (enricher.blocks_checked, enricher.blocks_skipped, enricher.requests) == (6, 4, 1)
+
+    @pytest.mark.asyncio
+    async def test_no_candidates_no_calls(self):
+        provider = LogsProvider([])
+        records = [record(n, [rpc_log(n, address=WETH)]) for n in range(100, 103)]
+
+        await LogEnricher(LogFilter(addresses=[USDT])).enrich(provider, records)
+
+        assert provider.filters == []
+        assert [r.logs for r in records] == [[], [], []]
+
+    @pytest.mark.asyncio
+    async def test_lone_candidate_is_asked_for_by_hash(self):
+        provider = LogsProvider([rpc_log(100)])
+        records = [record(100, [rpc_log(100)])]
+
+        await LogEnricher(LogFilter(addresses=[USDT])).enrich(provider, records)
+
+        assert provider.filters == [{"address": [USDT], "blockHash": block_hash(100)}]
+        assert len(records[0].logs) == 1
+
+    @pytest.mark.asyncio
+    async def test_logs_from_another_chain_are_refetched_by_hash(self):
+        ours = [rpc_log(100), rpc_log(101)]
+        # the provider reorged block 101 after we fetched it
+        provider = LogsProvider([ours[0], rpc_log(101, branch=1)] + [ours[1]])
+        records = [record(100, ours[:1]), record(101, ours[1:])]
+        enricher = LogEnricher(LogFilter(addresses=[USDT]))
+
+        await enricher.enrich(provider, records)
+
+        assert provider.filters[1]["blockHashes"] == [block_hash(100), block_hash(101)]
+        assert [[log["transactionHash"] for log in r.logs] for r in records] == [
+            [ours[0]["transactionHash"]], [ours[1]["transactionHash"]]
+        ]
+        assert enricher.requests == 2
+
+
+class TestEnrichedOutput:
+    def test_ndjson_line_carries_the_logs(self):
+        enriched = record(100)
+        enriched.logs = [{"address": USDT, "logIndex": 0}]
+
+        assert enriched.to_ndjson() == orjson.dumps(enriched.to_dict(), option=orjson.OPT_APPEND_NEWLINE)
+        assert orjson.loads(enriched.to_ndjson())["logs"] == enriched.logs
+
+    def test_bloom_and_logs_are_not_part_of_equality(self):
+        enriched = record(100, [rpc_log(100)])
+        enriched.logs = []
+
+        assert enriched == BlockRecord(enriched.number, enriched.hash, enriched.parentHash, enriched.timestamp, 1)
+
+    @pytest.mark.asyncio
+    async def test_streamer_emits_blocks_with_their_logs(self, provider_config, rpc_stub):
+        stub_logs = [
+            {**rpc_log(103), "blockHash": f"0x{103:064x}"},
+            {**rpc_log(107), "blockHash": f"0x{107:064x}"},
+        ]
+        rpc_stub.logs = stub_logs
+        for number in range(101, 111):
+            block_logs = [log for log in stub_logs if log["blockNumber"] == hex(number)]
+            rpc_stub.blooms[number] = "0x" + make_bloom(block_logs).hex()
+
+        class Collect(BlockSink):
+            def __init__(self):
+                self.lines = []
+
+            async def write(self, chunk):
+                self.lines.extend(orjson.loads(line) for line in chunk.splitlines())
+
+        client = ProviderClient(provider_config)
+        manager = ProviderManager([client], lag_thr=30, error_thr=0.5, window_s=10)
+        sink = Collect()
+        service = BlockStreamService(
+            manager, 100, max_catchup_window=2, catchup_batch_size=5, lean_fetch=True, output=SinkPipeline(sink),
+            log_enricher=LogEnricher(LogFilter(addresses=[USDT], events=[TRANSFER])),
+        )
+        try:
+            await service.process_blocks(110)
+            await service.output.stop()
+        finally:
+            await client.close()
+
+        assert [line["number"] for line in sink.lines] == list(range(101, 111))
+        assert {line["number"]: len(line["logs"]) for line in sink.lines if line["logs"]} == {103: 1, 107: 1}
+        # one eth_getLogs per 5-block range, each for its lone candidate
+        get_logs = [post for post in rpc_stub.posts if isinstance(post, dict) and post["method"] == "eth_getLogs"]
+        assert [call["params"][0]["blockHash"] for call in get_logs] == [f"0x{103:064x}", f"0x{107:064x}"]
@@ -0,0 +1,113 @@
+import json
+import time
+
+import aiohttp
+import pytest
+import pytest_asyncio
+
+from block_streamer import BlockStreamService
+from lease_coordinator import Leadership, SQLiteLeaseCoordinator
+from metrics import Histogram, MetricsServer
+from provider_client import ProviderClient
+from provider_manager import ProviderManager
+from sinks import BlockSink, SinkPipeline
+
+
+class DiscardSink(BlockSink):
+    async def write(self, chunk):
+        pass
+
+
+@pytest_asyncio.fixture
+async def streamer(provider_config):
+    client = ProviderClient(provider_config)
+    manager = ProviderManager([client], lag_thr=30, error_thr=0.2, window_s=60)
+    yield BlockStreamService(manager, 100, lean_fetch=True, output=SinkPipeline(DiscardSink()))
+    await client.close()
+
+
+@pytest_asyncio.fixture
+async def server(streamer):
+    server = MetricsServer({"1": streamer}, host="127.0.0.1", port=0, stale_after_s=60)
+    await server.start()
+    yield server
+    await server.stop()
+
+
+async def fetch(server, path):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{server.port}{path}") as response:
+            return response.status, await response.text()
+
+
+class TestHistogram:
+    def test_observations_land_in_their_bucket(self):
+        histogram = Histogram((0.1, 1.0))
+
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert histogram.sum == pytest.approx(3.65)
+
+
+class TestMetricsServer:
+    @pytest.mark.asyncio
+    async def test_metrics_exposes_provider_and_stream_counters(self, server, streamer):
+        streamer.head_block_number = 110
+        await streamer.process_blocks(105)
+        with pytest.raises(Exception):
+            await streamer.provider_manager.active.get_block_record(5000)
+
+        status, body = await fetch(server, "/metrics")
+
+        assert status == 200
+        lines = body.splitlines()
+        assert 'block_streamer_blocks_emitted_total{chain="1"} 5' in lines
+        assert 'block_streamer_head_lag_blocks{chain="1"} 5' in lines
+        assert 'block_streamer_provider_requests_total{chain="1",provider="Stub"} 6' in lines
+        assert 'block_streamer_provider_errors_total{chain="1",provider="Stub"} 1' in lines
+        assert 'block_streamer_provider_request_duration_seconds_count{chain="1",provider="Stub"} 6' in lines
+        assert 'block_streamer_provider_request_duration_seconds_bucket{chain="1",provider="Stub",le="+Inf"} 6' in lines
+        assert 'block_streamer_provider_active{chain="1",provider="Stub"} 1' in lines
+        assert f'block_streamer_provider_window_error_rate{{chain="1",provider="Stub",class="rpc"}} {1 / 6}' in lines
+        assert any(line.startswith(
+            'block_streamer_provider_window_latency_seconds{chain="1",provider="Stub",method="eth_getBlockByNumber",'
+            'quantile="0.95"}'
+        ) for line in lines)
+        assert "# TYPE block_streamer_provider_request_duration_seconds histogram" in lines
+
+    @pytest.mark.asyncio
+    async def test_health_tracks_block_freshness(self, server, streamer):
+        streamer.running = True
+        streamer.last_block_ts = time.time()
+
+        status, body = await fetch(server, "/health")
+        assert status == 200
+        assert json.loads(body)["chains"]["1"]["active_provider"] == "Stub"
+
+        streamer.last_block_ts = time.time() - 120
+        status, body = await fetch(server, "/health")
+        assert status == 503
+        assert json.loads(body)["status"] == "unhealthy"
+
+    @pytest.mark.asyncio
+    async def test_standby_is_healthy_without_emitting(self, server, streamer, tmp_path):
+        streamer.leadership = Leadership(SQLiteLeaseCoordinator(str(tmp_path / "lease.sqlite")), "stream:1")
+
+        status, body = await fetch(server, "/health")
+        assert status == 200
+        assert json.loads(body)["chains"]["1"]["role"] == "standby"
+        _, body = await fetch(server, "/metrics")
+        assert 'block_streamer_leader{chain="1"} 0' in body.splitlines()
+
+        streamer.leadership.is_leader = True
+        status, body = await fetch(server, "/health")
+        assert status == 503
+        assert json.loads(body)["chains"]["1"]["role"] == "leader"
+
+    @pytest.mark.asyncio
+    async def test_unknown_path_is_not_found(self, server):
+        status, _ = await fetch(server, "/")
+        assert status == 404
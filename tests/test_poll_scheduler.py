@@ -0,0 +1,67 @@
+import pytest
+
+from conftest import FakeClock
+from poll_scheduler import PollScheduler
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(1000.0)
+
+
+def see_block(scheduler, clock, number, timestamp, visible_after=1.0):
+    clock.now = timestamp + visible_after
+    scheduler.on_head(number)
+    scheduler.on_block(number, timestamp)
+
+
+@pytest.fixture
+def steady(clock):
+    """12 s blocks, each seen 1 s after its timestamp, so estimated visible 0.875 s after it
+    (half a fast-poll interval before it was seen)."""
+    scheduler = PollScheduler(expected_block_time=12, min_interval_s=0.25, clock=clock)
+    for number in range(100, 120):
+        see_block(scheduler, clock, number, 1000 + (number - 100) * 12)
+    return scheduler
+
+
+class TestPollScheduler:
+
+    def test_polls_fast_until_anchored(self, clock):
+        scheduler = PollScheduler(expected_block_time=12, clock=clock)
+        assert scheduler.next_delay() == 0.25
+
+    def test_learns_block_time_and_visibility_delay(self, steady):
+        assert steady.block_time == 12
+        assert steady.expected_timestamp(120) == 1000 + 20 * 12
+        assert steady._delay_range == (0.875, 0.875)
+
+    def test_sleeps_until_the_predicted_arrival(self, steady, clock):
+        # last block 119 at t=1228 seen at 1229; block 120 is due at 1240 + 0.875 s visibility
+        assert steady.next_delay() == pytest.approx(11.875)
+
+    def test_polls_aggressively_while_the_block_is_due(self, steady, clock):
+        clock.now = 1240.875
+        assert steady.next_delay() == 0.25
+
+    def test_backs_off_when_overdue_but_at_most_one_block_time(self, steady, clock):
+        clock.now = 1245.0
+        assert steady.next_delay() == pytest.approx(2.0625)
+        clock.now = 1300.0
+        assert steady.next_delay() == 12
+
+    def test_window_widens_with_block_time_jitter(self, clock):
+        scheduler = PollScheduler(expected_block_time=2, min_interval_s=0.1, clock=clock)
+        timestamp = 1000
+        for number, interval in enumerate([2, 3, 2, 1, 2, 3, 2, 1, 2, 2, 3, 1]):
+            timestamp += interval
+            see_block(scheduler, clock, number, timestamp, visible_after=0.5)
+
+        # block due at timestamp + 2 (seen at timestamp + 0.5); the window opens a p10 interval
+        # (1 s) earlier, and p10 visibility delay is 0 since short intervals arrive "early"
+        assert scheduler.next_delay() == pytest.approx(0.5)
+
+    def test_head_jumps_are_not_taken_as_visibility_delay(self, steady, clock):
+        clock.now = 5000.0
+        steady.on_head(150)
+        assert steady._delay_range == (0.875, 0.875)
@@ -0,0 +1,168 @@
+import asyncio
+
+import aiohttp
+import orjson
+import pytest
+import pytest_asyncio
+
+from web3.exceptions import BlockNotFound, Web3RPCError
+
+from block_record import BlockRecord
+from provider_client import ProviderClient
+
+
+@pytest_asyncio.fixture
+async def client(provider_config):
+    client = ProviderClient(provider_config)
+    yield client
+    await client.close()
+
+
+class TestGetBlocks:
+    @pytest.mark.asyncio
+    async def test_range_is_split_into_batches(self, client, rpc_stub):
+        blocks = await client.get_blocks(100, 124)
+
+        assert [block.number for block in blocks] == list(range(100, 125))
+        assert [len(post) for post in rpc_stub.posts] == [10, 10, 5]
+        assert blocks[1].parentHash == blocks[0].hash
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_single_calls_when_batches_rejected(self, client, rpc_stub):
+        rpc_stub.reject_batches = True
+
+        blocks = await client.get_blocks(100, 104)
+        await client.get_blocks(105, 109)
+
+        assert [block.number for block in blocks] == list(range(100, 105))
+        assert client.batch_supported is False
+        # one rejected batch, then single calls only
+        assert isinstance(rpc_stub.posts[0], list)
+        assert all(isinstance(post, dict) for post in rpc_stub.posts[1:])
+        assert len(rpc_stub.posts) == 11
+
+
+class TestBlockRecords:
+    @pytest.mark.asyncio
+    async def test_get_block_record_parses_raw_json(self, client):
+        record = await client.get_block_record(100)
+
+        assert isinstance(record, BlockRecord)
+        assert record.to_dict() == {
+            "number": 100,
+            "hash": f"0x{100:064x}",
+            "parentHash": f"0x{99:064x}",
+            "timestamp": 1000100,
+            "tx_count": 3,
+        }
+
+    @pytest.mark.asyncio
+    async def test_get_block_records_batches_and_keeps_order(self, client, rpc_stub):
+        records = await client.get_block_records(100, 114)
+
+        assert [record.number for record in records] == list(range(100, 115))
+        assert [len(post) for post in rpc_stub.posts] == [10, 5]
+        assert all(call["params"][1] is False for post in rpc_stub.posts for call in post)
+        assert client.stats.latency_by_method["eth_getBlockByNumber batch"].count == 2
+
+    @pytest.mark.asyncio
+    async def test_get_block_records_falls_back_when_batches_rejected(self, client, rpc_stub):
+        rpc_stub.reject_batches = True
+
+        records = await client.get_block_records(100, 104)
+
+        assert [record.number for record in records] == list(range(100, 105))
+        assert client.batch_supported is False
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("method", ["get_blocks", "get_block_records", "get_block_range_body"])
+    async def test_rate_limited_batch_is_raised_and_batches_stay_on(self, client, rpc_stub, method):
+        rpc_stub.reject_batches = True
+        rpc_stub.batch_error = {"code": -32005, "message": "limit exceeded"}
+
+        with pytest.raises(Web3RPCError):
+            await getattr(client, method)(100, 104)
+
+        assert client.batch_supported is True
+        assert client.rate_limiter.throttle_count == 1
+        assert client.stats.error_rate("rate_limited") == 1.0
+        assert len(rpc_stub.posts) == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("method", ["get_blocks", "get_block_records"])
+    async def test_failed_entry_is_raised_and_batches_stay_on(self, client, rpc_stub, method):
+        rpc_stub.block_errors[103] = {"code": -32000, "message": "header not found"}
+
+        with pytest.raises(Web3RPCError, match="header not found"):
+            await getattr(client, method)(100, 105)
+
+        assert client.batch_supported is True
+        assert len(rpc_stub.posts) == 1
+
+    @pytest.mark.asyncio
+    async def test_get_block_range_body_is_one_undecoded_batch(self, client, rpc_stub):
+        body = await client.get_block_range_body(100, 104)
+
+        assert isinstance(body, bytes)
+        assert [int(response["result"]["number"], 16) for response in orjson.loads(body)] == list(range(100, 105))
+        assert [len(post) for post in rpc_stub.posts] == [5]
+        assert client.request_count == 1
+
+    @pytest.mark.asyncio
+    async def test_get_logs_by_hash_is_one_batch(self, client, rpc_stub):
+        rpc_stub.logs = [{"address": "0x01", "blockNumber": hex(n), "blockHash": f"0x{n:064x}"} for n in (100, 101)]
+
+        logs = await client.get_logs_by_hash({"address": ["0x01"]}, [f"0x{100:064x}", f"0x{102:064x}"])
+
+        assert [[log["blockNumber"] for log in block_logs] for block_logs in logs] == [["0x64"], []]
+        assert [len(post) for post in rpc_stub.posts] == [2]
+
+    @pytest.mark.asyncio
+    async def test_error_response_is_counted_and_raised(self, client):
+        with pytest.raises(BlockNotFound):
+            await client.get_block_record(10_000)
+
+        assert client.get_error_ratio() == 1.0
+        assert client.stats.error_rate("rpc") == 1.0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_request_records_no_latency_or_outcome(self, client):
+        request = asyncio.create_task(client._timed(asyncio.sleep(1), "eth_getBlockByNumber"))
+        await asyncio.sleep(0.01)
+
+        request.cancel()  # as when a hedge loses the race
+        await asyncio.gather(request, return_exceptions=True)
+
+        assert client.request_count == 1
+        assert client.stats.count == 0
+        assert client.get_error_ratio() == 0.0
+
+
+def test_latency_percentiles_use_nearest_rank(provider_config):
+    client = ProviderClient(provider_config)
+    for i in range(1, 21):
+        client.stats.record("eth_getBlockByNumber", i / 100)
+    client.stats.record("eth_blockNumber", 5.0)
+
+    # within the sketch's relative error
+    assert client.get_latency_percentile(0.5, "eth_getBlockByNumber") == pytest.approx(0.10, rel=0.05)
+    assert client.get_latency_percentile(0.95, "eth_getBlockByNumber") == pytest.approx(0.19, rel=0.05)
+    assert client.get_latency_percentile(1.0, "eth_getBlockByNumber") == pytest.approx(0.20, rel=0.05)
+    assert client.get_latency_percentile(1.0) == pytest.approx(5.0, rel=0.05)
+
+
+class TestSharedSession:
+    @pytest.mark.asyncio
+    async def test_clients_share_one_pool_and_leave_it_open(self, provider_config):
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        clients = [ProviderClient(provider_config), ProviderClient(provider_config)]
+        for client in clients:
+            await client.use_session(session)
+
+        assert [await client.head() for client in clients] == [1000, 1000]
+        assert len(session.connector._conns) == 1  # the second call reused the kept-alive connection
+
+        for client in clients:
+            await client.close()
+        assert not session.closed
+        await session.close()
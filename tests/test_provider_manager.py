@@ -1,7 +1,11 @@
+import asyncio
+import time
+
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
+from circuit_breaker import CircuitBreaker
 from provider_manager import ProviderManager, ProviderScore
-from provider_client import ProviderClient
+from provider_client import GET_BLOCK_BY_NUMBER, ProviderClient
 
 
 @pytest.fixture
@@ -12,6 +16,7 @@ def multiple_mock_providers():
         provider.name = f"Provider{i}"
         provider.head.return_value = 111
         provider.get_average_latency.return_value = 0.1
+        provider.get_latency_percentile.return_value = 0.1
         provider.get_error_ratio.return_value = 1
         providers.append(provider)
     return providers
@@ -23,7 +28,7 @@ def provider_manager(multiple_mock_providers):
         providers=multiple_mock_providers,
         lag_thr=1.0,
         error_thr=0.1,
-        halflife=60.0
+        window_s=60.0
     )
 
 @pytest.fixture
@@ -61,11 +66,381 @@ class TestProviderManager:
 
     def test_provider_manager_empty_providers_raises_error(self):
         with pytest.raises(ValueError, match="At least one provider required"):
-            ProviderManager(providers=[], lag_thr=1.0, error_thr=0.1, halflife=60.0)
+            ProviderManager(providers=[], lag_thr=1.0, error_thr=0.1, window_s=60.0)
+
+
+@pytest.fixture
+def hedging_manager():
+    providers = []
+    for i in range(3):
+        provider = AsyncMock(spec=ProviderClient)
+        provider.name = f"Provider{i}"
+        provider.get_latency_percentile.return_value = 0.01
+        provider.get_average_latency.return_value = 0.1 * (i + 1)
+        provider.get_error_ratio.return_value = 0
+        provider.rate_headroom.return_value = 1.0
+        provider.get_block.return_value = f"block from Provider{i}"
+        providers.append(provider)
+    return ProviderManager(providers=providers, lag_thr=1.0, error_thr=0.1, window_s=60.0, hedge_budget_per_minute=1)
+
+
+async def slow_block(*args):
+    await asyncio.sleep(1)
+    return "slow block"
+
+
+class TestHedgedRequests:
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self, hedging_manager):
+        result = await hedging_manager.hedged(hedging_manager.active, "get_block", 100)
+
+        assert result == "block from Provider0"
+        assert hedging_manager.hedges_fired == 0
+        hedging_manager.providers[1].get_block.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_raced_against_fastest_healthy_provider(self, hedging_manager):
+        hedging_manager.active.get_block.side_effect = slow_block
+
+        result = await asyncio.wait_for(hedging_manager.hedged(hedging_manager.active, "get_block", 100), 0.5)
+
+        assert result == "block from Provider1"
+        assert hedging_manager.hedges_fired == 1
+        hedging_manager.providers[2].get_block.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_hedge_delay_is_the_methods_own_p95(self, hedging_manager):
+        primary = hedging_manager.active
+        # slow range batches must not delay hedging single calls
+        primary.get_latency_percentile.side_effect = lambda q, method=None: 0.01 if method == GET_BLOCK_BY_NUMBER else 2
+        primary.get_block.side_effect = slow_block
+
+        result = await asyncio.wait_for(hedging_manager.hedged(primary, "get_block", 100), 0.5)
+
+        assert result == "block from Provider1"
+        primary.get_latency_percentile.assert_called_with(0.95, GET_BLOCK_BY_NUMBER)
+
+    @pytest.mark.asyncio
+    async def test_provider_without_rate_budget_is_not_hedged_to(self, hedging_manager):
+        hedging_manager.active.get_block.side_effect = slow_block
+        hedging_manager.providers[1].rate_headroom.return_value = 0.0
+
+        result = await asyncio.wait_for(hedging_manager.hedged(hedging_manager.active, "get_block", 100), 0.5)
+
+        assert result == "block from Provider2"
+        hedging_manager.providers[1].get_block.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_failed_hedge_falls_back_to_primary_answer(self, hedging_manager):
+        async def slow_but_ok(*args):
+            await asyncio.sleep(0.05)
+            return "block from Provider0"
+        hedging_manager.active.get_block.side_effect = slow_but_ok
+        hedging_manager.providers[1].get_block.side_effect = Exception("Provider failed")
+
+        assert await hedging_manager.hedged(hedging_manager.active, "get_block", 100) == "block from Provider0"
+
+    @pytest.mark.asyncio
+    async def test_budget_caps_hedges_per_minute(self, hedging_manager):
+        async def slowish(*args):
+            await asyncio.sleep(0.05)
+            return "block from Provider0"
+        hedging_manager.active.get_block.side_effect = slowish
+        hedging_manager.providers[1].get_block.side_effect = slowish
+
+        await hedging_manager.hedged(hedging_manager.active, "get_block", 100)
+        await hedging_manager.hedged(hedging_manager.active, "get_block", 101)
+
+        assert hedging_manager.hedges_fired == 1
+        assert hedging_manager.providers[1].get_block.await_count == 1
+
+
+class TestIdleProviderProbing:
+
+    @pytest.fixture
+    def probed_manager(self, multiple_mock_providers):
+        for provider in multiple_mock_providers:
+            provider.get_error_ratio.return_value = 0
+        return ProviderManager(
+            providers=multiple_mock_providers, lag_thr=30, error_thr=0.1, window_s=60.0, expected_block_time=12
+        )
+
+    @pytest.mark.asyncio
+    async def test_probe_scores_idle_providers_by_head_lag(self, probed_manager):
+        probed_manager.providers[1].head.return_value = 105
+        probed_manager.providers[2].head.return_value = 111
+
+        await probed_manager.probe_idle_providers()
+
+        probed_manager.providers[0].head.assert_not_called()
+        assert probed_manager.best_head == 111
+        assert probed_manager.metrics[1].staleness == 72
+        assert probed_manager.metrics[2].staleness == 0
+        assert probed_manager.ranking.index(2) < probed_manager.ranking.index(1)
+
+    @pytest.mark.asyncio
+    async def test_active_provider_is_scored_on_head_lag_like_idle_ones(self, multiple_mock_providers):
+        for provider in multiple_mock_providers:
+            provider.get_error_ratio.return_value = 0
+        manager = ProviderManager(
+            providers=multiple_mock_providers[:2], lag_thr=30, error_thr=0.1, window_s=60.0, expected_block_time=12
+        )
+        manager.providers[1].head.return_value = 111
+        await manager.probe_idle_providers()
+
+        # at the head: emitted blocks trailing it by the confirmation depth don't make it stale
+        await manager.record_metrics(manager.providers[0], 111)
+        assert manager.metrics[0].staleness == 0
+        assert manager.fetch_providers() == manager.providers
+        await manager.record_metrics(manager.providers[0], 109)
+        assert manager.metrics[0].staleness == 12  # mean of 0 and 24 s behind
+        await manager.record_metrics(manager.providers[0], None)  # head() failed
+        assert manager.metrics[0].staleness == 18
+
+    @pytest.mark.asyncio
+    async def test_stalled_idle_provider_is_measured_against_the_active_head(self, multiple_mock_providers):
+        for provider in multiple_mock_providers:
+            provider.get_error_ratio.return_value = 0
+        manager = ProviderManager(
+            providers=multiple_mock_providers[:2], lag_thr=30, error_thr=0.1, window_s=60.0, expected_block_time=12
+        )
+        manager.providers[1].head.return_value = 100
+
+        await manager.record_metrics(manager.providers[0], 200)  # the active provider's head, as the streamer saw it
+        await manager.probe_idle_providers()
+
+        assert manager.best_head == 200
+        assert manager.metrics[1].staleness == 1200
+        assert not manager.metrics[1].is_healthy
+        await manager.switch_to_healthy_provider()
+        assert manager.active_index == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_probe_marks_provider_unhealthy(self, probed_manager):
+        probed_manager.providers[2].head.side_effect = Exception("Provider failed")
+        probed_manager.providers[2].get_error_ratio.return_value = 1
+
+        await probed_manager.probe_idle_providers()
+
+        assert not probed_manager.metrics[2].is_healthy
+        assert probed_manager.ranking[-1] == 2
+
+    @pytest.mark.asyncio
+    async def test_switch_picks_best_ranked_provider(self, probed_manager):
+        probed_manager.providers[1].head.return_value = 100
+        await probed_manager.probe_idle_providers()
 
-    
+        await probed_manager.switch_to_healthy_provider()
 
-    
+        assert probed_manager.active_index == 2
 
+    @pytest.mark.asyncio
+    async def test_background_prober_runs_at_cadence(self, probed_manager):
+        probed_manager.probe_interval_s = 0.01
+        probed_manager.start_probing()
+        await asyncio.sleep(0.05)
+        await probed_manager.stop_probing()
+
+        assert probed_manager.providers[1].head.await_count >= 3
+
+
+
+class TestFetchDistribution:
+    @pytest.fixture
+    def balanced_manager(self, multiple_mock_providers):
+        for provider, rate in zip(multiple_mock_providers, (30, 10, 10)):
+            provider.max_rate_per_sec = rate
+            provider.rate_headroom.return_value = 1.0
+        return ProviderManager(multiple_mock_providers, lag_thr=1.0, error_thr=0.1, window_s=60.0)
+
+    def test_picks_are_proportional_to_weight_and_interleaved(self, balanced_manager):
+        picks = [balanced_manager.fetch_provider().name for _ in range(10)]
+
+        assert picks.count("Provider0") == 6
+        assert picks.count("Provider1") == picks.count("Provider2") == 2
+        assert "Provider0Provider0Provider0Provider0" not in "".join(picks)
+
+    def test_unhealthy_and_exhausted_providers_get_less_or_no_work(self, balanced_manager, metrics_moc):
+        balanced_manager.metrics[0] = metrics_moc
+        balanced_manager.providers[2].rate_headroom.return_value = 0.0
+
+        picks = [balanced_manager.fetch_provider().name for _ in range(21)]
+
+        assert picks.count("Provider0") == 0
+        assert picks.count("Provider1") == 20
+        assert balanced_manager.fetch_providers() == balanced_manager.providers[1:]
+
+
+class TestCircuitBreakers:
+
+    @pytest.fixture
+    def breaker_manager(self, multiple_mock_providers):
+        for provider in multiple_mock_providers:
+            provider.get_error_ratio.return_value = 0
+        return ProviderManager(
+            providers=multiple_mock_providers, lag_thr=30, error_thr=0.1, window_s=60.0,
+            breaker_failure_threshold=1, breaker_base_cooldown_s=10.0,
+        )
+
+    @pytest.mark.asyncio
+    async def test_open_provider_is_skipped_by_switch_and_probe(self, breaker_manager):
+        breaker_manager.breakers[1].record_failure()
+
+        await breaker_manager.switch_to_healthy_provider()
+        await breaker_manager.probe_idle_providers()
+
+        assert breaker_manager.active_index == 2
+        breaker_manager.providers[1].head.assert_not_called()
+        assert breaker_manager.breakers[0].is_open
+
+    @pytest.mark.asyncio
+    async def test_half_open_provider_gets_one_probe_that_closes_it(self, breaker_manager):
+        breaker = breaker_manager.breakers[1]
+        breaker.record_failure()
+        breaker._open_until = 0.0  # cool-down over
+
+        await asyncio.gather(breaker_manager.probe_idle_providers(), breaker_manager.probe_idle_providers())
+
+        assert breaker_manager.providers[1].head.await_count == 1
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_half_open_provider_gets_no_other_traffic_until_it_closes(self, breaker_manager):
+        for provider in breaker_manager.providers:
+            provider.max_rate_per_sec = 10
+            provider.rate_headroom.return_value = 1.0
+        breaker = breaker_manager.breakers[1]
+        breaker.record_failure()
+        breaker._open_until = 0.0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+
+        picks = [breaker_manager.fetch_provider() for _ in range(10)]
+
+        assert breaker_manager.providers[1] not in picks
+        assert breaker_manager.providers[1] not in breaker_manager.fetch_providers()
+        assert breaker_manager._hedge_target(breaker_manager.active) is breaker_manager.providers[2]
+        assert breaker_manager._switch_candidate() == 2
+        await breaker_manager.probe_idle_providers()  # the single trial request closes it
+        assert breaker_manager.providers[1] in breaker_manager.fetch_providers()
+
+    @pytest.mark.asyncio
+    async def test_all_open_waits_for_breaker_ready_event(self, breaker_manager):
+        for breaker in breaker_manager.breakers[1:]:
+            breaker.record_failure()
+        switch = asyncio.create_task(breaker_manager.switch_to_healthy_provider())
+        await asyncio.sleep(0.05)
+        assert not switch.done()
+
+        breaker_manager.breakers[2]._open_until = 0.0
+        await breaker_manager.report_success(breaker_manager.providers[2])
+
+        await asyncio.wait_for(switch, 1)
+        assert breaker_manager.active_index == 2
+
+    @pytest.mark.asyncio
+    async def test_all_open_wakes_when_first_cooldown_ends(self, breaker_manager):
+        for breaker in breaker_manager.breakers:
+            breaker.base_cooldown_s = 0.05
+            breaker.jitter = 0
+        breaker_manager.breakers[1].record_failure()
+        await asyncio.sleep(0.02)
+        breaker_manager.breakers[2].record_failure()
+
+        started = time.monotonic()
+        await breaker_manager.switch_to_healthy_provider()
+
+        assert time.monotonic() - started < 0.5
+        assert breaker_manager.active_index == 1
+        assert breaker_manager.breakers[1].state == CircuitBreaker.HALF_OPEN
+
+
+class TestProviderScore:
+    def test_staleness_is_the_windowed_mean_lag(self, clock):
+        score = ProviderScore(lag_thr=30, error_thr=0.2, window_s=60, clock=clock)
+        score.update(24, 0.0)
+        clock.now = 30
+        score.update(0, 0.0)
+        assert score.staleness == 12
+
+        clock.now = 60
+        score.update(0, 0.0)
+        assert score.staleness == 0
+
+    def test_score_combines_the_signals_relative_to_their_thresholds(self, clock):
+        score = ProviderScore(lag_thr=30, error_thr=0.2, window_s=60, latency_thr=1.0, clock=clock)
+        score.update(0, 0.0, 0.0)
+        assert score.score == 1.0
+
+        score.update(30, 0.1, 0.5)  # mean lag 15 s: 0.5 + 0.5 + 0.5
+        assert score.score == pytest.approx(0.4)
+
+    def test_health_recovers_only_past_the_hysteresis_band(self, clock):
+        score = ProviderScore(lag_thr=30, error_thr=0.2, window_s=60, hysteresis=0.2, clock=clock)
+        score.update(0, 0.2)
+        assert not score.is_healthy
+
+        score.update(0, 0.19)  # below the threshold, inside the band
+        assert not score.is_healthy
+        score.update(0, 0.15)
+        assert score.is_healthy
+        score.update(0, 0.19)  # inside the band again, still below the threshold
+        assert score.is_healthy
+
+
+class TestScoreRanking:
+
+    @pytest.fixture
+    def ranked_manager(self, multiple_mock_providers, clock):
+        for provider in multiple_mock_providers:
+            provider.get_error_ratio.return_value = 0
+        return ProviderManager(
+            providers=multiple_mock_providers, lag_thr=30, error_thr=0.1, window_s=60.0, expected_block_time=12,
+            latency_thr=1.0, hysteresis=0.2, clock=clock,
+        )
+
+    async def probe_rounds(self, manager, clock, latencies, rounds=1):
+        for provider, latency in zip(manager.providers, latencies):
+            provider.get_latency_percentile.return_value = latency
+        for _ in range(rounds):
+            clock.now += manager.probe_interval_s
+            await manager.probe_idle_providers()
+
+    @pytest.mark.asyncio
+    async def test_idle_providers_are_scored_on_head_call_p95(self, ranked_manager, clock):
+        await self.probe_rounds(ranked_manager, clock, [0.1, 0.5, 0.1])
+
+        ranked_manager.providers[1].get_latency_percentile.assert_called_with(0.95, "eth_blockNumber")
+        assert ranked_manager.metrics[1].score == pytest.approx(1 / 1.5)
+        assert ranked_manager.ranking[1:] == [2, 1]
+
+    @pytest.mark.asyncio
+    async def test_near_equal_scores_do_not_reorder(self, ranked_manager, clock):
+        await self.probe_rounds(ranked_manager, clock, [0.1, 0.10, 0.12])
+        assert ranked_manager.ranking == [0, 1, 2]
+
+        # provider 2 is now a little faster, then a little slower again: the order holds
+        for latencies in ([0.1, 0.12, 0.10], [0.1, 0.10, 0.12], [0.1, 0.13, 0.09]):
+            await self.probe_rounds(ranked_manager, clock, latencies)
+            assert ranked_manager.ranking == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_clearly_better_provider_moves_ahead(self, ranked_manager, clock):
+        await self.probe_rounds(ranked_manager, clock, [0.1, 0.4, 0.1])
+
+        assert ranked_manager.ranking.index(2) < ranked_manager.ranking.index(1)
+        await ranked_manager.switch_to_healthy_provider()
+        assert ranked_manager.active_index == 2
+
+    @pytest.mark.asyncio
+    async def test_stale_provider_drops_behind_and_recovers_once_the_window_passes(self, ranked_manager, clock):
+        ranked_manager.providers[1].head.return_value = 108  # three blocks, 36 s behind
+        await self.probe_rounds(ranked_manager, clock, [0.1, 0.1, 0.1])
+        assert not ranked_manager.metrics[1].is_healthy
+        assert ranked_manager.ranking[-1] == 1
 
+        ranked_manager.providers[1].head.return_value = 111
+        await self.probe_rounds(ranked_manager, clock, [0.1, 0.1, 0.1], rounds=4)
 
+        assert ranked_manager.metrics[1].staleness == 0
+        assert ranked_manager.metrics[1].is_healthy
@@ -0,0 +1,136 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from web3.exceptions import Web3RPCError
+
+from config import ProviderConfig
+from provider_client import ProviderClient
+from rate_limiter import RateLimiter, TokenBucket, is_rate_limited, retry_after_s
+
+
+def limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+async def issue(rate_limiter, count, **amounts):
+    for _ in range(count):
+        await rate_limiter.acquire(**amounts)
+
+
+class TestTokenBucket:
+    def test_refills_at_rate_up_to_capacity(self, clock):
+        bucket = TokenBucket(rate=10, capacity=5, clock=clock)
+        bucket.take(5)
+
+        clock.now = 0.3
+        assert bucket.available() == pytest.approx(3)
+        clock.now = 10
+        assert bucket.available() == 5
+
+    def test_oversized_take_waits_for_full_bucket_then_goes_into_debt(self, clock):
+        bucket = TokenBucket(rate=10, capacity=5, clock=clock)
+
+        assert bucket.wait_time(50) == 0
+        bucket.take(50)
+        assert bucket.wait_time(1) == pytest.approx(4.6)
+
+
+class TestRateLimiter:
+    @pytest.mark.asyncio
+    async def test_requests_per_second_is_enforced_after_the_burst(self, clock):
+        rate_limiter = limiter(clock, requests_per_sec=10)
+
+        await issue(rate_limiter, 10)
+        assert clock.now == 0  # one second of burst
+
+        await issue(rate_limiter, 20)
+        assert clock.now == pytest.approx(2.0)
+
+    @pytest.mark.asyncio
+    async def test_compute_units_bound_expensive_calls(self, clock):
+        rate_limiter = limiter(clock, requests_per_sec=100, compute_units_per_sec=160)
+
+        await issue(rate_limiter, 10, compute_units=16)
+        assert clock.now == 0
+        await issue(rate_limiter, 20, compute_units=16)
+
+        assert clock.now == pytest.approx(2.0)  # 320 CU at 160 CU/s, well under 100 req/s
+        assert rate_limiter.remaining["compute_units"] == pytest.approx(0)
+
+    @pytest.mark.asyncio
+    async def test_throttling_pauses_halves_the_rate_and_recovers(self, clock):
+        rate_limiter = limiter(clock, requests_per_sec=10, recovery_s=10)
+
+        rate_limiter.on_throttled(retry_after_s=2)
+        assert rate_limiter.headroom == 0
+        await issue(rate_limiter, 1)
+        assert clock.now == pytest.approx(2.0)
+        assert rate_limiter.requests.rate == pytest.approx(5 + 10 * 2 / 10)
+
+        clock.now += 10
+        assert rate_limiter.headroom == 1
+        assert rate_limiter.requests.rate == 10
+
+    @pytest.mark.asyncio
+    async def test_repeated_throttling_keeps_a_minimum_rate(self, clock):
+        rate_limiter = limiter(clock, requests_per_sec=10, min_rate_fraction=0.1)
+
+        for _ in range(10):
+            rate_limiter.on_throttled(retry_after_s=0)
+
+        assert rate_limiter.requests.rate == pytest.approx(1)
+        assert rate_limiter.throttle_count == 10
+
+    @pytest.mark.asyncio
+    async def test_waiters_are_served_in_arrival_order(self, clock):
+        rate_limiter = limiter(clock, requests_per_sec=1)
+        served = []
+
+        async def waiter(name):
+            await rate_limiter.acquire()
+            served.append(name)
+
+        await asyncio.gather(*(waiter(name) for name in "abcd"))
+
+        assert served == list("abcd")
+        assert clock.now == pytest.approx(3.0)
+
+
+class TestRateLimitDetection:
+    def test_http_429_with_retry_after(self):
+        error = aiohttp.ClientResponseError(None, (), status=429, headers={"Retry-After": "3"})
+
+        assert is_rate_limited(error)
+        assert retry_after_s(error) == 3.0
+
+    def test_json_rpc_limit_error(self):
+        error = Web3RPCError("limit", rpc_response={"error": {"code": -32005, "message": "limit exceeded"}})
+
+        assert is_rate_limited(error)
+        assert retry_after_s(error) is None
+        assert not is_rate_limited(aiohttp.ClientResponseError(None, (), status=500))
+
+    @pytest.mark.asyncio
+    async def test_client_slows_down_when_provider_returns_429(self):
+        async def too_many(request):
+            return web.Response(status=429, headers={"Retry-After": "5"})
+
+        app = web.Application()
+        app.router.add_post("/", too_many)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = ProviderClient(ProviderConfig(name="Limited", url=f"http://127.0.0.1:{port}/"))
+
+        with pytest.raises(aiohttp.ClientResponseError):
+            await client.head()
+
+        assert client.rate_limiter.throttle_count == 1
+        assert client.rate_headroom() == 0
+        assert client.rate_limiter.requests.rate == pytest.approx(5, rel=0.01)
+        await client.close()
+        await runner.cleanup()
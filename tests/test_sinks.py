@@ -0,0 +1,226 @@
+import asyncio
+import json
+
+import orjson
+import pytest
+
+from block_record import WIRE_FORMAT, BlockRecord, unpack_records
+from config import OutputConfig
+from sinks import (
+    BlockSink, NdjsonSink, OutputError, RotatingFileSink, SinkPipeline, SocketSink, TeeSink, build_encoder,
+    encode_binary, encode_ndjson,
+)
+
+
+class RecordingSink(BlockSink):
+    def __init__(self, delay_s=0.0, failures=0):
+        self.chunks = []
+        self.flushes = 0
+        self.delay_s = delay_s
+        self.failures = failures  # writes that raise before the sink recovers
+
+    async def write(self, chunk):
+        await asyncio.sleep(self.delay_s)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionResetError("consumer went away")
+        self.chunks.append(chunk)
+
+    async def flush(self):
+        self.flushes += 1
+
+
+def records(chunks):
+    return [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+
+
+class TestSinkPipeline:
+    @pytest.mark.asyncio
+    async def test_records_are_written_in_batches_and_order(self):
+        sink = RecordingSink()
+        pipeline = SinkPipeline(sink, queue_size=100, batch_size=10)
+
+        for number in range(25):
+            pipeline._queue.put_nowait({"number": number})
+        pipeline._ensure_writer()
+        await pipeline.flush()
+
+        assert [len(chunk.splitlines()) for chunk in sink.chunks] == [10, 10, 5]
+        assert [record["number"] for record in records(sink.chunks)] == list(range(25))
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_full_queue_applies_backpressure(self):
+        pipeline = SinkPipeline(RecordingSink(delay_s=0.05), queue_size=2, batch_size=1)
+
+        await pipeline.put({"number": 0})
+        await pipeline.put({"number": 1})
+        await pipeline.put({"number": 2})
+        blocked = asyncio.ensure_future(pipeline.put({"number": 3}))
+        await asyncio.sleep(0.01)
+
+        assert not blocked.done()
+        await blocked
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_idle_pipeline_flushes_on_interval(self):
+        sink = RecordingSink()
+        pipeline = SinkPipeline(sink, flush_interval_s=0.01)
+
+        await pipeline.put({"number": 1})
+        await asyncio.sleep(0.05)
+
+        assert sink.flushes >= 1
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_sink_failure_reaches_the_producer(self):
+        class BrokenSink(BlockSink):
+            async def write(self, chunk):
+                raise OSError("disk full")
+
+        pipeline = SinkPipeline(BrokenSink())
+        await pipeline.put({"number": 1})
+
+        with pytest.raises(OutputError, match="disk full"):
+            await pipeline.flush()
+
+    @pytest.mark.asyncio
+    async def test_writer_dying_on_a_full_queue_fails_the_blocked_put(self):
+        pipeline = SinkPipeline(RecordingSink(delay_s=0.02, failures=1), queue_size=2, batch_size=1)
+        await pipeline.put({"number": 0})
+        await pipeline.put({"number": 1})
+        await pipeline.put({"number": 2})
+
+        with pytest.raises(OutputError):
+            await asyncio.wait_for(pipeline.put({"number": 3}), 1)
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_retried_in_order_by_the_next_writer(self):
+        sink = RecordingSink(failures=1)
+        pipeline = SinkPipeline(sink, batch_size=10)
+        await pipeline.put({"number": 0})
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(OutputError, match="consumer went away"):
+            await pipeline.put({"number": 1})
+        await pipeline.put({"number": 1})
+        await pipeline.flush()
+
+        assert [record["number"] for record in records(sink.chunks)] == [0, 1]
+        await pipeline.stop()
+
+
+class TestSinks:
+    @pytest.mark.asyncio
+    async def test_tee_sink_writes_each_batch_to_every_sink(self):
+        first, second = RecordingSink(), RecordingSink()
+        pipeline = SinkPipeline(TeeSink([first, second]), batch_size=10)
+
+        for number in range(15):
+            await pipeline.put({"number": number})
+        await pipeline.flush()
+
+        assert first.chunks == second.chunks
+        assert [record["number"] for record in records(first.chunks)] == list(range(15))
+        assert (first.flushes, second.flushes) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_ndjson_file_sink(self, tmp_path):
+        path = tmp_path / "blocks.ndjson"
+        pipeline = SinkPipeline(NdjsonSink(str(path)))
+
+        for number in range(3):
+            await pipeline.put({"number": number})
+        await pipeline.close()
+
+        assert [json.loads(line)["number"] for line in path.read_text().splitlines()] == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_rotating_file_sink_rolls_over(self, tmp_path):
+        path = tmp_path / "blocks.ndjson"
+        sink = RotatingFileSink(str(path), max_bytes=100, backup_count=2)
+
+        for number in range(10):
+            await sink.write(b'{"number":%d,"padding":"xxxxxxxxxxxxxxxxxxxx"}\n' % number)
+        await sink.close()
+
+        assert path.stat().st_size <= 100
+        assert (tmp_path / "blocks.ndjson.1").exists()
+        assert (tmp_path / "blocks.ndjson.2").exists()
+        assert not (tmp_path / "blocks.ndjson.3").exists()
+
+    @pytest.mark.asyncio
+    async def test_socket_sinks_deliver_ndjson(self, tmp_path):
+        received = []
+
+        async def handle(reader, writer):
+            received.append(await reader.read())
+            writer.close()
+
+        tcp_server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        unix_path = str(tmp_path / "blocks.sock")
+        unix_server = await asyncio.start_unix_server(handle, unix_path)
+        port = tcp_server.sockets[0].getsockname()[1]
+
+        for sink in (SocketSink(host="127.0.0.1", port=port), SocketSink(path=unix_path)):
+            pipeline = SinkPipeline(sink)
+            await pipeline.put({"number": 7})
+            await pipeline.close()
+        await asyncio.sleep(0.01)
+        tcp_server.close()
+        unix_server.close()
+
+        assert [json.loads(chunk) for chunk in received] == [{"number": 7}, {"number": 7}]
+
+    @pytest.mark.asyncio
+    async def test_socket_sink_reconnects_to_a_restarted_consumer(self):
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            await reader.read()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        sink = SocketSink(host="127.0.0.1", port=server.sockets[0].getsockname()[1])
+        await sink.write(b"1\n")
+        await sink.flush()
+        await asyncio.sleep(0.01)
+        connections[0].transport.abort()  # the consumer restarts
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(ConnectionError):
+            for _ in range(3):  # the first write after a reset may still be accepted locally
+                await sink.write(b"2\n")
+                await sink.flush()
+                await asyncio.sleep(0.01)
+        await sink.write(b"3\n")
+        await sink.flush()
+
+        assert len(connections) == 2
+        await sink.close()
+        server.close()
+
+
+def block_record(number):
+    return BlockRecord(number, bytes.fromhex(f"{number:064x}"), bytes.fromhex(f"{number - 1:064x}"), 1_700_000_000, 7)
+
+
+class TestEncoders:
+    def test_ndjson_line_of_a_record_matches_its_dict(self):
+        record = block_record(0xABC)
+        assert encode_ndjson(record) == orjson.dumps(record.to_dict(), option=orjson.OPT_APPEND_NEWLINE)
+        assert json.loads(encode_ndjson(record))["hash"] == f"0x{0xABC:064x}"
+
+    def test_binary_records_round_trip(self):
+        retract = {"event": "retract", "number": 9, "hash": f"0x{9:064x}"}
+        chunk = b"".join(map(encode_binary, [block_record(8), retract, block_record(9)]))
+
+        assert len(chunk) == 3 * WIRE_FORMAT.size == 3 * 85
+        assert list(unpack_records(chunk)) == [block_record(8), retract, block_record(9)]
+
+    def test_unknown_output_format_is_rejected(self):
+        assert build_encoder(OutputConfig(format="binary")) is encode_binary
+        with pytest.raises(ValueError):
+            build_encoder(OutputConfig(format="xml"))
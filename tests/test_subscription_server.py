@@ -0,0 +1,172 @@
+import asyncio
+
+import orjson
+import pytest
+import pytest_asyncio
+
+from block_record import BlockRecord
+from sinks import encode_ndjson
+from subscription_server import DROP_OLDEST, SubscriptionServer
+
+
+def record(number, branch=0):
+    return BlockRecord(
+        number, bytes([branch]) + number.to_bytes(31, "big"), bytes([branch]) + (number - 1).to_bytes(31, "big"),
+        1_700_000_000 + number, 0,
+    )
+
+
+async def emit(server, *records):
+    await server.write_records(list(records), [encode_ndjson(r) for r in records])
+
+
+async def subscribe(server, request=b"{}\n"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(request)
+    reply = orjson.loads(await asyncio.wait_for(reader.readline(), 1))
+    return reader, writer, reply
+
+
+async def read_lines(reader, count):
+    return [orjson.loads(await asyncio.wait_for(reader.readline(), 1)) for _ in range(count)]
+
+
+@pytest_asyncio.fixture
+async def server():
+    # nothing is written straight to a socket, so a subscriber is behind until its send task runs
+    server = SubscriptionServer(port=0, buffer_size=4, socket_buffer_bytes=0)
+    await server.start()
+    yield server
+    await server.close()
+
+
+class TestSubscriptionServer:
+    @pytest.mark.asyncio
+    async def test_every_subscriber_gets_the_same_encoded_records(self, server):
+        clients = [await subscribe(server) for _ in range(3)]
+        assert clients[0][2] == {"subscribed": True, "from_block": None, "replayed": 0}
+
+        await emit(server, record(100), record(101))
+
+        for reader, writer, _ in clients:
+            assert [line["number"] for line in await read_lines(reader, 2)] == [100, 101]
+            writer.close()
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_from_the_block_including_retractions(self, server):
+        await emit(server, record(100), record(101), record(102))
+        await emit(server, {"event": "retract", "number": 102, "hash": "0x02"}, record(102, branch=1))
+
+        reader, writer, reply = await subscribe(server, b'{"from_block": 101}\n')
+        await emit(server, record(103, branch=1))
+
+        assert reply["replayed"] == 4
+        lines = await read_lines(reader, 5)
+        assert [(line.get("event", "block"), line["number"]) for line in lines] == [
+            ("block", 101), ("block", 102), ("retract", 102), ("block", 102), ("block", 103),
+        ]
+        writer.close()
+
+    @pytest.mark.asyncio
+    async def test_resume_at_the_next_block_is_live(self, server):
+        await emit(server, record(100))
+
+        reader, writer, reply = await subscribe(server, b'{"from_block": 101}\n')
+        await emit(server, record(101))
+
+        assert reply["replayed"] == 0
+        assert [line["number"] for line in await read_lines(reader, 1)] == [101]
+        writer.close()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("from_block", [50, 200])
+    async def test_resume_outside_the_replay_ring_is_refused(self, from_block):
+        server = SubscriptionServer(port=0, replay_size=2)
+        await server.start()
+        try:
+            await emit(server, record(100), record(101), record(102))
+
+            reader, writer, reply = await subscribe(server, b'{"from_block": %d}\n' % from_block)
+
+            assert "error" in reply
+            assert await reader.read() == b""
+            assert not server.subscribers
+        finally:
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_slow_consumer_is_disconnected(self, server):
+        slow_reader, slow_writer, _ = await subscribe(server)
+        # no await yields to the server between these, so nothing reaches the socket: a consumer 5 records behind
+        for number in range(100, 105):
+            await emit(server, record(number))
+
+        assert not server.subscribers
+        assert server.disconnects == 1
+        fast_reader, fast_writer, _ = await subscribe(server)
+        await emit(server, record(105))
+        assert [line["number"] for line in await read_lines(fast_reader, 1)] == [105]
+        slow_writer.close()
+        fast_writer.close()
+
+    @pytest.mark.asyncio
+    async def test_subscriber_leaving_while_caught_up_is_removed(self):
+        server = SubscriptionServer(port=0, buffer_size=4)
+        await server.start()
+        try:
+            reader, writer, _ = await subscribe(server)
+            await emit(server, record(100))
+            await read_lines(reader, 1)
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.01)
+
+            for number in range(101, 110):
+                await emit(server, record(number))
+                await asyncio.sleep(0)
+
+            assert not server.subscribers
+            assert server.disconnects == 0
+        finally:
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_drop_oldest_keeps_the_newest_records(self):
+        server = SubscriptionServer(port=0, buffer_size=4, slow_consumer=DROP_OLDEST, socket_buffer_bytes=0)
+        await server.start()
+        try:
+            reader, writer, _ = await subscribe(server)
+            for number in range(100, 110):
+                await emit(server, record(number))
+
+            assert server.dropped_records == 6
+            assert [line["number"] for line in await read_lines(reader, 4)] == [106, 107, 108, 109]
+            writer.close()
+        finally:
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_subscriber_keeping_up_is_written_to_directly(self):
+        server = SubscriptionServer(port=0, buffer_size=4)
+        await server.start()
+        try:
+            reader, writer, _ = await subscribe(server)
+            for number in range(100, 110):
+                await emit(server, record(number))
+
+            assert [subscriber.pending for subscriber in server.subscribers] == [0]
+            assert [line["number"] for line in await read_lines(reader, 10)] == list(range(100, 110))
+            writer.close()
+        finally:
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_bad_handshake_is_answered_with_an_error(self, server):
+        reader, writer, reply = await subscribe(server, b"not json\n")
+
+        assert "error" in reply
+        writer.close()
+
+    def test_unknown_policy_is_rejected(self):
+        with pytest.raises(ValueError):
+            SubscriptionServer(slow_consumer="block")
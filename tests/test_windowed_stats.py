@@ -0,0 +1,132 @@
+import asyncio
+
+import aiohttp
+import pytest
+from web3.exceptions import BlockNotFound, Web3RPCError
+
+from windowed_stats import RequestStats, WindowedCounts, WindowedQuantiles, error_class
+
+
+def http_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+class TestWindowedCounts:
+    def test_samples_leave_a_sub_window_at_a_time(self, clock):
+        counts = WindowedCounts(2, window_s=60, clock=clock, slots=6)
+        counts.add(0)
+        clock.now = 30
+        counts.add(1, 5)
+
+        clock.now = 59.9
+        assert counts.totals == [1, 5]
+        clock.now = 60
+        assert counts.totals == [0, 5]
+        clock.now = 90
+        assert counts.totals == [0, 0]
+
+    def test_idle_longer_than_the_window_starts_empty(self, clock):
+        counts = WindowedCounts(1, window_s=10, clock=clock)
+        for _ in range(3):
+            counts.add(0)
+        clock.now = 1000
+        counts.add(0)
+
+        assert counts.totals == [1]
+
+
+class TestWindowedQuantiles:
+    def test_quantiles_are_within_the_relative_error(self, clock):
+        sketch = WindowedQuantiles(window_s=60, clock=clock)
+        for i in range(1, 1001):
+            sketch.observe(i / 1000)
+
+        p50, p95, p99 = sketch.quantiles(0.5, 0.95, 0.99)
+
+        assert p50 == pytest.approx(0.5, rel=0.045)
+        assert p95 == pytest.approx(0.95, rel=0.045)
+        assert p99 == pytest.approx(0.99, rel=0.045)
+        assert sketch.mean() == pytest.approx(0.5005)
+
+    def test_only_the_window_counts(self, clock):
+        sketch = WindowedQuantiles(window_s=60, clock=clock)
+        for _ in range(100):
+            sketch.observe(2.0)  # a slow minute
+        clock.now = 60
+        for _ in range(10):
+            sketch.observe(0.05)
+
+        assert sketch.count == 10
+        assert sketch.quantile(0.99) == pytest.approx(0.05, rel=0.045)
+
+    def test_out_of_range_values_are_clamped(self, clock):
+        sketch = WindowedQuantiles(window_s=60, clock=clock, min_value=1e-3, max_value=10)
+        sketch.observe(0.0)
+        sketch.observe(1000.0)
+
+        assert sketch.quantile(0.0) == 1e-3
+        assert sketch.quantile(1.0) <= 10 * 1.05
+
+    def test_tags_are_counted_with_the_values(self, clock):
+        sketch = WindowedQuantiles(window_s=60, clock=clock, tags=2)
+        sketch.observe(0.01)
+        sketch.observe(0.5, tag=1)
+        clock.now = 30
+        sketch.observe(0.02, tag=1)
+
+        assert sketch.tag_counts() == [1, 2]
+        assert sketch.count == 3
+        assert sketch.quantile(1.0) == pytest.approx(0.5, rel=0.045)
+        clock.now = 60
+        assert sketch.tag_counts() == [0, 1]
+        assert sketch.quantile(1.0) == pytest.approx(0.02, rel=0.045)
+
+    def test_empty_window_reads_zero(self, clock):
+        sketch = WindowedQuantiles(window_s=60, clock=clock)
+
+        assert sketch.quantiles(0.5, 0.99) == [0.0, 0.0]
+        assert sketch.mean() == 0.0
+
+
+class TestRequestStats:
+    def test_errors_are_classified(self):
+        assert error_class(http_error(429)) == "rate_limited"
+        assert error_class(Web3RPCError("slow down", rpc_response={"error": {"code": -32005}})) == "rate_limited"
+        assert error_class(asyncio.TimeoutError()) == "timeout"
+        assert error_class(http_error(502)) == "server"
+        assert error_class(aiohttp.ClientConnectionError()) == "connection"
+        assert error_class(BlockNotFound("Block 1 not found")) == "rpc"
+
+    def test_error_rates_per_class_and_weighted(self, clock):
+        stats = RequestStats(window_s=60, clock=clock)
+        for outcome in ["ok"] * 6 + ["rate_limited"] * 2 + ["server"] * 2:
+            stats.record("eth_blockNumber", 0.01, outcome)
+
+        assert stats.error_rate() == 0.4
+        assert stats.error_rate("rate_limited") == 0.2
+        assert stats.error_rate("timeout") == 0.0
+        # rate limiting counts half
+        assert stats.weighted_error_rate() == pytest.approx(0.3)
+
+        clock.now = 60
+        assert stats.error_rate() == 0.0
+
+    def test_histogram_keeps_every_request_on_exact_bounds(self, clock):
+        stats = RequestStats(window_s=60, clock=clock, edges=(0.01, 0.1))
+        stats.record("eth_blockNumber", 0.01)  # on a bound: at or below it
+        stats.record("eth_blockNumber", 0.05)
+        clock.now = 120  # both have left the window
+        stats.record("eth_getBlockByNumber batch", 0.5, "timeout")
+
+        assert stats.count == 1
+        assert stats.histogram((0.01, 0.1)) == ([1, 1, 1], pytest.approx(0.56), 3)
+
+    def test_latency_is_kept_per_method(self, clock):
+        stats = RequestStats(window_s=60, clock=clock)
+        stats.record("eth_blockNumber", 0.02)
+        stats.record("eth_getBlockByNumber batch", 0.8)
+
+        assert stats.latency_quantile(0.95, "eth_blockNumber") == pytest.approx(0.02, rel=0.045)
+        assert stats.latency_quantile(0.95) == pytest.approx(0.8, rel=0.045)
+        assert stats.latency_quantile(0.95, "eth_getLogs") == 0.0
+        assert stats.mean_latency() == pytest.approx(0.41)
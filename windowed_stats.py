@@ -0,0 +1,305 @@
+import asyncio
+import math
+import time
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import add
+
+import aiohttp
+
+from rate_limiter import is_rate_limited
+
+# Outcome classes of a provider request; index 0 is success.
+OUTCOMES = ("ok", "rate_limited", "timeout", "connection", "server", "rpc")
+OUTCOME_INDEX = {outcome: index for index, outcome in enumerate(OUTCOMES)}
+# How much a failure of each class counts against the provider. Rate limiting is mostly down to
+# our own request rate, which the RateLimiter already backs off from.
+ERROR_WEIGHTS = (0.0, 0.5, 1.0, 1.0, 1.0, 1.0)
+
+BUCKETS_PER_DOUBLING = 8  # relative error of a quantile under 2 ** (1 / 16) - 1, about 4.4%
+
+
+def error_class(error):
+    """Outcome class of a failed request: rate_limited, timeout, connection, server (HTTP 5xx) or rpc."""
+    if is_rate_limited(error):
+        return "rate_limited"
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientResponseError):
+        return "server" if error.status >= 500 else "rpc"
+    if isinstance(error, (aiohttp.ClientConnectionError, OSError)):
+        return "connection"
+    # JSON-RPC errors, missing blocks and malformed answers
+    return "rpc"
+
+
+class WindowedCounts:
+    """Counts per index (0..size-1) over the last `window_s` seconds.
+
+    The window is a ring of `slots` sub-windows. Adding touches only the current sub-window: one
+    clock read, compared with the time the sub-window closes, and one in-place update. The closed
+    sub-windows are summed as they close, and one that ages out is subtracted whole (and kept in
+    the lifetime totals), a fixed cost per sub-window period however many samples it held. Reading
+    a total adds the current sub-window to that sum, O(cells read). Samples leave a sub-window at a
+    time, so the totals cover between (slots - 1) / slots of the window and all of it.
+    """
+
+    def __init__(self, size, window_s, clock=time.monotonic, slots=6):
+        self.window_s = window_s
+        self._slot_s = window_s / slots
+        self._clock = clock
+        self._slots = [[0] * size for _ in range(slots)]
+        self._closed = [0] * size  # sums over the closed sub-windows still in the window
+        self._retired = [0] * size  # sums over the sub-windows that have left the window
+        self._epoch = int(clock() / self._slot_s)  # sub-windows since the clock's origin
+        self._slot = self._slots[self._epoch % slots]
+        self._slot_end = (self._epoch + 1) * self._slot_s  # clock reading at which the current sub-window closes
+
+    def add(self, index, amount=1):
+        self._current()[index] += amount
+
+    @property
+    def totals(self):
+        return self.counts()
+
+    def counts(self, start=0, stop=None):
+        """Window totals of cells start..stop-1."""
+        slot = self._current()
+        return list(map(add, self._closed[start:stop], slot[start:stop]))
+
+    def lifetime_counts(self, start=0, stop=None):
+        """Totals of cells start..stop-1 since the counts were created, the window's included."""
+        return list(map(add, self._retired[start:stop], self.counts(start, stop)))
+
+    def _current(self):
+        now = self._clock()
+        return self._slot if now < self._slot_end else self._advance(now)
+
+    def _advance(self, now):
+        # at least one sub-window on, should the division round down right at the boundary
+        epoch = max(int(now / self._slot_s), self._epoch + 1)
+        ring = len(self._slots)
+        closed, retired = self._closed, self._retired
+        for index, count in enumerate(self._slot):
+            if count:
+                closed[index] += count
+        # the sub-windows moved into held samples from a whole window ago
+        for step in range(1, min(epoch - self._epoch, ring) + 1):
+            slot = self._slots[(self._epoch + step) % ring]
+            for index, count in enumerate(slot):
+                if count:
+                    closed[index] -= count
+                    retired[index] += count
+                    slot[index] = 0
+        self._epoch = epoch
+        self._slot = self._slots[epoch % ring]
+        self._slot_end = (epoch + 1) * self._slot_s
+        return self._slot
+
+
+class WindowedQuantiles(WindowedCounts):
+    """Streaming quantiles of the values observed in the last `window_s` seconds.
+
+    Values fall into log-spaced buckets, BUCKETS_PER_DOUBLING per power of two from `min_value`
+    up (the DDSketch/HdrHistogram idea): memory is fixed by the value range rather than the
+    sample count. Values below `min_value` share the first bucket and values beyond `max_value`
+    the last. `edges` are extra bucket boundaries, such as a Prometheus histogram's, which
+    `histogram` can then re-bucket the lifetime counts to exactly. Each value carries one of
+    `tags` classes, so RequestStats files a latency and its outcome together.
+
+    Observing is one clock read and an append to the current sub-window's buffer for the tag
+    (the t-digest idea): the buffered values are bucketed in bulk when the sketch is read or the
+    sub-window closes, off the path of whoever is recording. `count`, `tag_counts` and `mean`
+    then read only the sum and tag cells. A quantile is a pass over the buckets between the
+    lowest and highest ever used, O(buckets) at worst (about 160 with the default range),
+    typically a few dozen for the latencies of one RPC method.
+    """
+
+    def __init__(self, window_s, clock=time.monotonic, slots=6, min_value=1e-4, max_value=100.0, tags=1,
+                 edges=()):
+        self.min_value = min_value
+        doublings = int(math.log2(max_value / min_value) * BUCKETS_PER_DOUBLING) + 1
+        log_edges = [min_value * 2 ** (step / BUCKETS_PER_DOUBLING) for step in range(doublings)]
+        # upper bound of each bucket but the last: a value goes to the first bucket whose bound it doesn't exceed
+        self._bounds = tuple(sorted({*log_edges, *(edge for edge in edges if min_value < edge < log_edges[-1])}))
+        self.buckets = len(self._bounds) + 1
+        # what a quantile falling in each bucket reads as: the geometric middle, or past the last bound
+        self._values = (min_value, *(math.sqrt(low * high) for low, high in zip(self._bounds, self._bounds[1:])),
+                        self._bounds[-1] * 2 ** (0.5 / BUCKETS_PER_DOUBLING))
+        self._lowest, self._highest = self.buckets, -1  # buckets used so far, widened as values are bucketed
+        self._pending = [[] for _ in range(tags)]  # values observed in the current sub-window, not bucketed yet
+        # after the buckets: the sum of the values, then a count per tag
+        super().__init__(self.buckets + 1 + tags, window_s, clock, slots)
+
+    def observe(self, value, tag=0):
+        now = self._clock()
+        if now >= self._slot_end:
+            self._advance(now)
+        self._pending[tag].append(value)
+
+    def used_buckets(self):
+        """The lowest and highest bucket any value has fallen into so far (buckets, -1 before any)."""
+        self._current()
+        return self._lowest, self._highest
+
+    def tag_counts(self):
+        return self.counts(self.buckets + 1)
+
+    @property
+    def count(self):
+        return sum(self.tag_counts())
+
+    def mean(self):
+        """Mean of the values in the window, 0.0 without any."""
+        total, *tags = self.counts(self.buckets)
+        count = sum(tags)
+        return total / count if count else 0.0
+
+    def quantile(self, q):
+        """Nearest-rank quantile (q in 0..1) of the values in the window, 0.0 without any."""
+        return self.quantiles(q)[0]
+
+    def quantiles(self, *qs):
+        """Several quantiles in a single pass over the used buckets."""
+        lowest, highest = self.used_buckets()
+        return self.quantiles_of(self.counts(lowest, highest + 1), lowest, *qs)
+
+    def quantiles_of(self, counts, first_bucket, *qs):
+        """`quantiles` of window counts of this sketch's buckets from `first_bucket` on, e.g. several sketches' added up."""
+        cumulative = list(accumulate(counts))
+        if not cumulative or not cumulative[-1]:
+            return [0.0] * len(qs)
+        count = cumulative[-1]
+        return [self._values[first_bucket + bisect_left(cumulative, max(1, math.ceil(q * count)))] for q in qs]
+
+    def histogram(self, bounds):
+        """Counts of every value observed so far per bucket of `bounds` (plus one past them), their sum and count.
+
+        Exact for bounds that are `edges` of the sketch; a bucket straddling another bound counts above it.
+        """
+        cells = self.lifetime_counts()
+        counts = [0] * (len(bounds) + 1)
+        for upper, count in zip(self._bounds, cells):
+            if count:
+                counts[bisect_left(bounds, upper)] += count
+        counts[-1] += cells[self.buckets - 1]
+        total, *tags = cells[self.buckets:]
+        return counts, total, sum(tags)
+
+    def _current(self):
+        now = self._clock()
+        if now >= self._slot_end:
+            return self._advance(now)
+        self._bucket_pending()
+        return self._slot
+
+    def _advance(self, now):
+        self._bucket_pending()  # into the sub-window they were observed in, before it closes
+        return super()._advance(now)
+
+    def _bucket_pending(self):
+        slot, bounds, last = self._slot, self._bounds, self.buckets - 1
+        for tag, values in enumerate(self._pending):
+            if not values:
+                continue
+            # sorted, the values of a bucket form a run: one bisect per bucket used rather than per value
+            values.sort()
+            start, stop = 0, len(values)
+            lowest = bisect_left(bounds, values[0])
+            while start < stop:
+                bucket = bisect_left(bounds, values[start])
+                end = bisect_right(values, bounds[bucket], start) if bucket < last else stop
+                slot[bucket] += end - start
+                start = end
+            slot[last + 1] += sum(values)
+            slot[last + 2 + tag] += stop
+            self._lowest, self._highest = min(self._lowest, lowest), max(self._highest, bucket)
+            values.clear()
+
+
+class RequestStats:
+    """Latency and outcome of one provider's requests over the last `window_s` seconds.
+
+    One sketch per RPC method, tagged by outcome class (see OUTCOMES); JSON-RPC batches are kept
+    apart from single calls of the same method ("<method> batch"), since a batch takes longer.
+    Recording files into one sketch. Overall figures add the methods up when read: error rates
+    and the mean read OUTCOMES-sized cells per method, an overall quantile every bucket of every
+    method. The sketches also keep what leaves the window, so `histogram` reports every request
+    recorded, on `edges` (see WindowedQuantiles), without a second record per request.
+    """
+
+    def __init__(self, window_s=60, clock=time.monotonic, edges=()):
+        self.window_s = window_s
+        self._clock = clock
+        self.edges = tuple(edges)
+        self.latency_by_method = {}
+
+    def record(self, method, latency_s, outcome="ok"):
+        sketch = self.latency_by_method.get(method)
+        if sketch is None:
+            sketch = self.latency_by_method[method] = WindowedQuantiles(
+                self.window_s, self._clock, tags=len(OUTCOMES), edges=self.edges
+            )
+        sketch.observe(latency_s, OUTCOME_INDEX[outcome])
+
+    def histogram(self, bounds):
+        """Latencies of every request recorded so far per bucket of `bounds` (plus one past them), sum and count."""
+        counts, total, count = [0] * (len(bounds) + 1), 0.0, 0
+        for sketch in self.latency_by_method.values():
+            sketch_counts, sketch_total, sketch_count = sketch.histogram(bounds)
+            counts = list(map(add, counts, sketch_counts))
+            total += sketch_total
+            count += sketch_count
+        return counts, total, count
+
+    @property
+    def count(self):
+        """Requests in the window."""
+        return sum(self.outcome_counts())
+
+    def outcome_counts(self):
+        """Requests in the window per outcome class, in OUTCOMES order."""
+        counts = [0] * len(OUTCOMES)
+        for sketch in self.latency_by_method.values():
+            counts = list(map(add, counts, sketch.tag_counts()))
+        return counts
+
+    def mean_latency(self):
+        """Mean latency over all requests in the window, 0.0 without any."""
+        total = count = 0
+        for sketch in self.latency_by_method.values():
+            latency_sum, *tags = sketch.counts(sketch.buckets)
+            total += latency_sum
+            count += sum(tags)
+        return total / count if count else 0.0
+
+    def latency_quantile(self, q, method=None):
+        """Latency quantile over all requests, or over single calls of `method`; 0.0 without samples."""
+        if method is not None:
+            sketch = self.latency_by_method.get(method)
+            return sketch.quantile(q) if sketch is not None else 0.0
+        sketches = list(self.latency_by_method.values())
+        if not sketches:
+            return 0.0
+        used = [sketch.used_buckets() for sketch in sketches]
+        lowest = min(low for low, _ in used)
+        highest = max(high for _, high in used)
+        counts = [sum(cells) for cells in zip(*(sketch.counts(lowest, highest + 1) for sketch in sketches))]
+        return sketches[0].quantiles_of(counts, lowest, q)[0]
+
+    def error_rate(self, outcome=None):
+        """Fraction of the window's requests that failed, or that failed with class `outcome`."""
+        counts = self.outcome_counts()
+        requests = sum(counts)
+        if not requests:
+            return 0.0
+        failed = requests - counts[0] if outcome is None else counts[OUTCOME_INDEX[outcome]]
+        return failed / requests
+
+    def weighted_error_rate(self):
+        """Failed fraction of the window's requests, each failure counted by its class's ERROR_WEIGHTS."""
+        counts = self.outcome_counts()
+        requests = sum(counts)
+        if not requests:
+            return 0.0
+        return sum(weight * count for weight, count in zip(ERROR_WEIGHTS, counts)) / requests